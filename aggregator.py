@@ -0,0 +1,168 @@
+"""Streaming min/max/sum aggregation over N channels, double buffered.
+
+The voltage/current window used to be 18 module globals plus sample_count:
+every new channel meant three more globals, three more lines in the fold,
+the reset, the snapshot and the global statements of three functions - and
+publishPowerlog copied all of them one by one while holding agg_lock.
+
+WindowAggregator keeps one window in a flat array('d'):
+
+    [min ch0 .. min chN-1 | max ch0 .. max chN-1 | sum ch0 .. sum chN-1]
+
+add() folds one sample of all channels into it. swap() closes the window in
+O(1) - it only exchanges the active buffer for a blank spare - so the lock
+is held for a couple of assignments. The closed window is read and recycled
+(blanked in one slice copy) outside the lock, and becomes the next spare.
+
+Optionally each channel also gets a streaming standard deviation and
+quantile estimates (streamstats.ChannelEstimator), double buffered along
+with the array. configure() switches them on or off; the change applies
+from the next window on.
+
+benchmarks/bench_aggregator.py measures the per-sample update cost.
+"""
+
+from array import array
+
+from streamstats import ChannelEstimator
+
+INF = float("inf")
+
+
+def _fold(buf, n, values):
+    for i, v in enumerate(values):
+        if v < buf[i]:
+            buf[i] = v
+        if v > buf[n + i]:
+            buf[n + i] = v
+        buf[2 * n + i] += v
+
+
+class Window:
+    """A closed window: its buffer, sample count and channel names."""
+
+    __slots__ = ("buf", "count", "channels", "extended")
+
+    def __init__(self, buf, count, channels, extended=None):
+        self.buf = buf
+        self.count = count
+        self.channels = channels
+        self.extended = extended    # ChannelEstimator per channel, or None
+
+    def add(self, values):
+        """Fold a sample into the closed window (e.g. one standing in for an empty window)."""
+        _fold(self.buf, len(self.channels), values)
+        if self.extended is not None:
+            for estimator, v in zip(self.extended, values):
+                estimator.add(v)
+        self.count += 1
+
+    def stats(self):
+        """[(min, max, avg), ...] per channel; 0 for an empty window, as before."""
+        n = len(self.channels)
+        buf = self.buf
+        if not self.count:
+            return [(0, 0, 0)] * n
+        count = self.count
+        return [(buf[i], buf[n + i], buf[2 * n + i] / count) for i in range(n)]
+
+    def extended_stats(self):
+        """[(std or None, [quantiles]), ...] per channel, or None if not enabled."""
+        if self.extended is None:
+            return None
+        return [estimator.result() for estimator in self.extended]
+
+    def as_dict(self):
+        return dict(zip(self.channels, self.stats()))
+
+
+class WindowAggregator:
+    """Min/max/sum per channel over a window; callers serialise add() and swap()."""
+
+    def __init__(self, channels, variance=False, percentiles=()):
+        self.channels = tuple(channels)
+        n = len(self.channels)
+        self._template = array("d", [INF] * n + [-INF] * n + [0.0] * n)
+        self._active = array("d", self._template)
+        self._spare = array("d", self._template)
+        self.count = 0
+        self.configure(variance, percentiles)
+        self._ext_active = self._new_extended()
+        self._ext_spare = None
+
+    def configure(self, variance, percentiles):
+        """Extended statistics for the windows after the current one.
+
+        variance: keep a standard deviation per channel; percentiles: the
+        quantiles to estimate, as integer percents 1-99. Both off (the
+        default) costs nothing per sample.
+        """
+        percentiles = tuple(int(p) for p in percentiles)
+        for p in percentiles:
+            if not 0 < p < 100:
+                raise ValueError(f"percentile {p} outside 1-99")
+        self.extended_config = (bool(variance), percentiles)
+
+    def _new_extended(self):
+        variance, percentiles = self.extended_config
+        if not variance and not percentiles:
+            return None
+        return [ChannelEstimator(variance, percentiles) for _ in self.channels]
+
+    def add(self, values):
+        """Fold one sample (one value per channel, in channel order)."""
+        _fold(self._active, len(self.channels), values)
+        extended = self._ext_active
+        if extended is not None:
+            for estimator, v in zip(extended, values):
+                estimator.add(v)
+        self.count += 1
+
+    def merge(self, window):
+        """Fold a closed window of the same channels into the open one.
+
+        Min of the minima, max of the maxima, sums and counts added: exact
+        for min/max/avg, which is what makes rollups incremental. Extended
+        statistics are not merged.
+        """
+        buf = self._active
+        other = window.buf
+        n = len(self.channels)
+        for i in range(n):
+            if other[i] < buf[i]:
+                buf[i] = other[i]
+            if other[n + i] > buf[n + i]:
+                buf[n + i] = other[n + i]
+            buf[2 * n + i] += other[2 * n + i]
+        self.count += window.count
+
+    def peek(self):
+        """The open window as a Window, without closing it (read it under the callers' lock)."""
+        return Window(self._active, self.count, self.channels, self._ext_active)
+
+    def swap(self):
+        """Close the window: returns it as a Window and starts a blank one."""
+        closed = Window(self._active, self.count, self.channels, self._ext_active)
+        spare = self._spare
+        if spare is None:
+            # The previous window was never recycled
+            spare = array("d", self._template)
+        extended = self._ext_spare
+        if extended is None or extended[0].config != self.extended_config:
+            extended = self._new_extended()
+        self._active, self._spare = spare, None
+        self._ext_active, self._ext_spare = extended, None
+        self.count = 0
+        return closed
+
+    def recycle(self, window):
+        """Blank a closed window's buffer and keep it as the next spare."""
+        if window.channels != self.channels:
+            # Closed by an aggregator since replaced with other channels
+            return
+        window.buf[:] = self._template
+        self._spare = window.buf
+        if window.extended is not None:
+            for estimator in window.extended:
+                estimator.reset()
+            self._ext_spare = window.extended
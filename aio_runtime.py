@@ -0,0 +1,146 @@
+"""Building blocks of the optional asyncio runtime (main.py --asyncio).
+
+The threaded runtime runs powerLoop, the 2 Hz poller, modemLoop and the
+watchdog as separate threads that all contend for modbus_lock/tcp_lock and
+time themselves with time.sleep(). In the asyncio runtime every transport
+has exactly one owner task (BusOwner) that serves a request queue, so there
+is nothing left to lock: jobs simply await their turn on the bus, in the
+same priority classes (and with the same deadline semantics) as the threaded
+runtime's BusScheduler. The jobs
+themselves are coroutines scheduled by periodic(), which sleeps until an
+absolute deadline instead of "interval after the job finished", so the run
+time of a job no longer accumulates as drift.
+
+Only the paho network thread remains next to the event loop thread, which
+saves four thread stacks on the router.
+"""
+
+import asyncio
+import itertools
+import time
+
+from busscheduler import DeadlineExpired, PRIO_PUBLISH, PRIORITY_NAMES
+from pacing import advance, aligned_deadline
+
+
+class BusOwner:
+    """The single task allowed to talk to one pymodbus async client.
+
+    Jobs call read()/write()/write_register() (or request() for anything
+    else); the call is queued and the owner executes requests strictly one
+    at a time, most urgent priority class first and in order within a
+    class. A request still queued past its deadline (time.monotonic() based)
+    fails with DeadlineExpired without touching the bus. The owner
+    (re)connects the client on demand and calls on_connect afterwards, so
+    e.g. the register cache can be dropped on every reconnect just like
+    modbusConnect does in threaded mode. Queue wait and service times go to
+    `stats` (a busscheduler.SchedulerStats) if one is given; with `timeouts`
+    (a bustiming.AdaptiveTimeouts) every request gets a learned timeout.
+    observer(method, args, kwargs, elapsed, result) is called after every
+    executed request, result None if it raised.
+    """
+
+    def __init__(self, client, name, on_connect=None, stats=None, timeouts=None, observer=None):
+        self.client = client
+        self.name = name
+        self.on_connect = on_connect
+        self.stats = stats
+        self.timeouts = timeouts
+        self.observer = observer
+        self.queue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+
+    async def run(self):
+        while True:
+            priority, _, queued_at, deadline, method, args, kwargs, future = await self.queue.get()
+            if future.done():
+                # The caller gave up (cancelled) while the request was queued.
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                if self.stats is not None:
+                    self.stats.expired(priority)
+                future.set_exception(DeadlineExpired(f"{PRIORITY_NAMES[priority]} request expired in queue"))
+                continue
+            started = time.monotonic()
+            try:
+                if not self.client.connected:
+                    if not await self.client.connect():
+                        raise ConnectionError(f"{self.name} connect failed")
+                    if self.on_connect is not None:
+                        self.on_connect()
+                result = await self._call(method, args, kwargs)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            if self.stats is not None:
+                self.stats.served(priority, started - queued_at, time.monotonic() - started)
+
+    async def _call(self, method, args, kwargs):
+        context = None
+        if self.timeouts is not None:
+            context = self.timeouts.before(self.client, method, args, kwargs)
+        result = None
+        started = time.monotonic()
+        try:
+            result = await getattr(self.client, method)(*args, **kwargs)
+            return result
+        finally:
+            if self.timeouts is not None:
+                self.timeouts.after(context, result)
+            if self.observer is not None:
+                self.observer(method, args, kwargs, time.monotonic() - started, result)
+
+    async def request(self, method, *args, priority=PRIO_PUBLISH, deadline=None, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority, next(self._seq), time.monotonic(), deadline,
+                               method, args, kwargs, future))
+        return await future
+
+    async def read(self, address, count=1, slave=1, priority=PRIO_PUBLISH, deadline=None):
+        return await self.request("read_holding_registers", address, count=count, slave=slave,
+                                  priority=priority, deadline=deadline)
+
+    async def write(self, address, values, slave=1, priority=PRIO_PUBLISH):
+        return await self.request("write_registers", address=address, values=values, slave=slave,
+                                  priority=priority)
+
+    async def write_register(self, address, value, slave=1, priority=PRIO_PUBLISH):
+        return await self.request("write_register", address, value, slave=slave, priority=priority)
+
+
+async def periodic(interval, job, name, stats=None, align=False):
+    """Run `await job()` every interval seconds at absolute deadlines.
+
+    interval may be a number or a callable returning one (sendInterval and
+    the poll rate can change at runtime through the config topic). A job
+    that overruns its slot is not made up for with a burst of catch-up
+    runs: the overrun periods are skipped and counted in stats (a
+    pacing.RateStats), like pacing.run_periodic does in threaded mode;
+    align=True runs on wall-clock boundaries as there. Exceptions are
+    printed and never end the loop.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    boundary = None
+    if align:
+        # aligned_deadline works on any monotonic clock; loop.time() is one
+        deadline, boundary = aligned_deadline(interval() if callable(interval) else interval, deadline)
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+    while True:
+        started = loop.time()
+        try:
+            await job()
+        except Exception as e:
+            print(f"Error in {name} job: {e}")
+        now = loop.time()
+        period = interval() if callable(interval) else interval
+        if stats is not None:
+            stats.ran(period, started - deadline, now - started)
+        if align:
+            deadline, boundary = aligned_deadline(period, now, boundary, stats)
+        else:
+            deadline = advance(deadline, period, now, stats)
+        await asyncio.sleep(max(0.0, deadline - now))
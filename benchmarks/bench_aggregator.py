@@ -0,0 +1,130 @@
+"""Per-sample update and window-close cost of the aggregation window.
+
+    python benchmarks/bench_aggregator.py
+
+Compares aggregator.WindowAggregator with the 18-globals fold main.py used
+before (reproduced below), and times the part of a window close that runs
+under agg_lock: the old code snapshotted and reset 19 globals there, the
+aggregator only swaps buffers. The last line is the cost with the extended
+statistics (standard deviation and percentiles) switched on.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from aggregator import WindowAggregator
+
+SAMPLE = (230.1, 231.4, 229.8, 12.31, 11.87, 12.02)
+N = 200000
+
+# --- the previous implementation, for comparison ---------------------------
+voltage_l1_min = voltage_l2_min = voltage_l3_min = float('inf')
+current_l1_min = current_l2_min = current_l3_min = float('inf')
+voltage_l1_max = voltage_l2_max = voltage_l3_max = float('-inf')
+current_l1_max = current_l2_max = current_l3_max = float('-inf')
+voltage_l1_sum = voltage_l2_sum = voltage_l3_sum = 0
+current_l1_sum = current_l2_sum = current_l3_sum = 0
+sample_count = 0
+
+
+def fold_globals(voltage_l1, voltage_l2, voltage_l3, current_l1, current_l2, current_l3):
+    global voltage_l1_min, voltage_l1_max, voltage_l1_sum
+    global voltage_l2_min, voltage_l2_max, voltage_l2_sum
+    global voltage_l3_min, voltage_l3_max, voltage_l3_sum
+    global current_l1_min, current_l1_max, current_l1_sum
+    global current_l2_min, current_l2_max, current_l2_sum
+    global current_l3_min, current_l3_max, current_l3_sum
+    global sample_count
+    voltage_l1_min = min(voltage_l1_min, voltage_l1)
+    voltage_l1_max = max(voltage_l1_max, voltage_l1)
+    voltage_l1_sum += voltage_l1
+    voltage_l2_min = min(voltage_l2_min, voltage_l2)
+    voltage_l2_max = max(voltage_l2_max, voltage_l2)
+    voltage_l2_sum += voltage_l2
+    voltage_l3_min = min(voltage_l3_min, voltage_l3)
+    voltage_l3_max = max(voltage_l3_max, voltage_l3)
+    voltage_l3_sum += voltage_l3
+    current_l1_min = min(current_l1_min, current_l1)
+    current_l1_max = max(current_l1_max, current_l1)
+    current_l1_sum += current_l1
+    current_l2_min = min(current_l2_min, current_l2)
+    current_l2_max = max(current_l2_max, current_l2)
+    current_l2_sum += current_l2
+    current_l3_min = min(current_l3_min, current_l3)
+    current_l3_max = max(current_l3_max, current_l3)
+    current_l3_sum += current_l3
+    sample_count += 1
+
+
+def snapshot_and_reset_globals():
+    global voltage_l1_min, voltage_l1_max, voltage_l1_sum
+    global voltage_l2_min, voltage_l2_max, voltage_l2_sum
+    global voltage_l3_min, voltage_l3_max, voltage_l3_sum
+    global current_l1_min, current_l1_max, current_l1_sum
+    global current_l2_min, current_l2_max, current_l2_sum
+    global current_l3_min, current_l3_max, current_l3_sum
+    global sample_count
+    n = sample_count if sample_count > 0 else 1
+    snap = [(voltage_l1_min, voltage_l1_max, voltage_l1_sum / n),
+            (voltage_l2_min, voltage_l2_max, voltage_l2_sum / n),
+            (voltage_l3_min, voltage_l3_max, voltage_l3_sum / n),
+            (current_l1_min, current_l1_max, current_l1_sum / n),
+            (current_l2_min, current_l2_max, current_l2_sum / n),
+            (current_l3_min, current_l3_max, current_l3_sum / n), sample_count]
+    voltage_l1_min = voltage_l2_min = voltage_l3_min = float('inf')
+    current_l1_min = current_l2_min = current_l3_min = float('inf')
+    voltage_l1_max = voltage_l2_max = voltage_l3_max = float('-inf')
+    current_l1_max = current_l2_max = current_l3_max = float('-inf')
+    voltage_l1_sum = voltage_l2_sum = voltage_l3_sum = 0
+    current_l1_sum = current_l2_sum = current_l3_sum = 0
+    sample_count = 0
+    return snap
+
+
+def per_call_us(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    agg = WindowAggregator(["v1", "v2", "v3", "c1", "c2", "c3"])
+
+    # Same results from both implementations
+    for i in range(50):
+        sample = tuple(v + (i % 7) * 0.1 for v in SAMPLE)
+        fold_globals(*sample)
+        agg.add(sample)
+    old = snapshot_and_reset_globals()
+    window = agg.swap()
+    assert window.count == old[-1] and all(
+        abs(a - b) < 1e-9 for new, prev in zip(window.stats(), old[:-1]) for a, b in zip(new, prev))
+    agg.recycle(window)
+
+    print(f"per-sample update, {len(SAMPLE)} channels:")
+    print(f"  18 globals        {per_call_us(lambda: fold_globals(*SAMPLE), N):6.2f} us")
+    print(f"  WindowAggregator  {per_call_us(lambda: agg.add(SAMPLE), N):6.2f} us")
+
+    def close_new():
+        agg.recycle(agg.swap())
+
+    print("window close held under agg_lock:")
+    print(f"  snapshot + reset  {per_call_us(snapshot_and_reset_globals, N):6.2f} us")
+    print(f"  swap              {per_call_us(lambda: agg.swap(), N):6.2f} us")
+    print(f"  (swap + recycle outside the lock: {per_call_us(close_new, N):.2f} us)")
+
+    wide = WindowAggregator([f"ch{i}" for i in range(24)])
+    wide_sample = tuple(range(24))
+    print(f"per-sample update, 24 channels: {per_call_us(lambda: wide.add(wide_sample), N):.2f} us")
+
+    # Extended statistics (streamstats.py): std plus three P-square percentiles
+    ext = WindowAggregator(["v1", "v2", "v3", "c1", "c2", "c3"], variance=True, percentiles=(5, 50, 95))
+    for i in range(10):
+        ext.add(tuple(v + i * 0.1 for v in SAMPLE))
+    print(f"per-sample update, 6 channels + std + p5/p50/p95: "
+          f"{per_call_us(lambda: ext.add(SAMPLE), N // 10):.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Compression ratio and CPU cost of compressed powerlog batches.
+
+    python benchmarks/bench_batch_compression.py [recorded.hex] [--train]
+
+Run it on the router: the CPU column is what one record costs there, at
+the batch sizes and zlib levels flush_retry_queue can choose. Records are
+main.py v1 frames (energy section on each, as sent) and the same records
+as v2; with a file of recorded v1 frames (one hex payload per line) those
+are used instead of a simulated day. --train prints a dictionary trained
+on the records, in the form powerlog_zdict.DICTIONARIES takes.
+
+Checks first that every batch mode unpacks to the records it was given.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import powerlog_codec
+import powerlog_zdict
+from powerlog_codec import pack_batch, unpack_batch
+from powerlog_v2 import PowerlogV2Encoder, values_from_frame
+from bench_powerlog_v2 import simulated
+
+SERIAL = 12345678901234
+
+
+def simulated_frames(n):
+    frames = []
+    previous = None
+    for t, m, agg, window, _ in simulated(n):
+        consumed = 0 if previous is None else m["consumed_energy"] - previous
+        previous = m["consumed_energy"]
+        sections = [powerlog_codec.pack_energy_deltas(0, t - 10, {"consumed": consumed, "delivered": 0})]
+        frames.append(powerlog_codec.encode(t, m, agg, window=window, sections=sections, router_serial=SERIAL))
+    return frames
+
+
+def as_v2(frames):
+    encoder = PowerlogV2Encoder(keyframe=30, stream=1)
+    return [encoder.encode_values(*values_from_frame(frame)) for frame in frames]
+
+
+def check(frames, records_v2):
+    mixed = frames[:20] + records_v2[:20]
+    for records in (frames[:1], frames[:60], records_v2[:60], mixed):
+        assert unpack_batch(pack_batch(records)) == records
+        for level in (0, 1, 6, 9):
+            for zdict in (0, powerlog_zdict.DEFAULT_ZDICT):
+                assert unpack_batch(pack_batch(records, level, zdict)) == records
+    print("all batch modes unpack to their records")
+
+
+def measure(records, batch, level, zdict=powerlog_zdict.DEFAULT_ZDICT):
+    """(compressed / raw, us per record to pack, us per record to unpack)."""
+    raw = sum(len(r) for r in records)
+    chunks = [records[i:i + batch] for i in range(0, len(records), batch)]
+    start = time.perf_counter()
+    packed = [pack_batch(chunk, level, zdict) for chunk in chunks]
+    pack_us = (time.perf_counter() - start) / len(records) * 1e6
+    start = time.perf_counter()
+    for payload in packed:
+        unpack_batch(payload)
+    unpack_us = (time.perf_counter() - start) / len(records) * 1e6
+    return sum(len(p) for p in packed) / raw, pack_us, unpack_us
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if args:
+        with open(args[0]) as f:
+            frames = [bytes.fromhex(line.strip()) for line in f if line.strip()]
+        label = f"{len(frames)} recorded frames"
+    else:
+        frames = simulated_frames(8640)
+        label = "8640 simulated frames (one day at 10 s)"
+    records_v2 = as_v2(frames)
+    check(frames, records_v2)
+
+    if "--train" in sys.argv:
+        zdict = powerlog_zdict.train(frames + records_v2)
+        print(f"dictionary of {len(zdict)} bytes:")
+        for i in range(0, len(zdict), 36):
+            print(f'        "{zdict[i:i + 36].hex()}"')
+        return
+
+    print(label)
+    print("records  batch  level    size   pack us/rec   unpack us/rec")
+    for name, records in (("v1", frames), ("v2", records_v2)):
+        for batch in (10, 60, 300):
+            ratio, _, _ = measure(records, batch, None)
+            print(f"{name:7}  {batch:5d}   none  {ratio:6.1%}")
+            for level in (1, 6, 9):
+                ratio, pack_us, unpack_us = measure(records, batch, level)
+                print(f"{name:7}  {batch:5d}  {level:5d}  {ratio:6.1%}   {pack_us:11.2f}   {unpack_us:13.2f}")
+    print("preset dictionary, level 6 (v1 batches are stored by column, without one):")
+    for batch in (1, 10, 60):
+        with_dict, _, _ = measure(records_v2, batch, 6)
+        without, _, _ = measure(records_v2, batch, 6, zdict=0)
+        print(f"v2       {batch:5d}      6  {with_dict:6.1%} with, {without:6.1%} without")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Recovery and throughput of the disk-backed retry queue (diskqueue.py).
+
+    python benchmarks/bench_diskqueue.py
+
+Run it on the router for the throughput numbers: the directory is a
+temporary one, on the filesystem of TMPDIR.
+
+Checks first, each on a fresh directory, with a "crash" being a queue that
+is simply abandoned and a new DiskQueue opened on the same path:
+  - records in flight (popped, not done) and records done past the saved
+    low-water mark come back after a restart, in order, and fully done
+    sealed segments are gone from the directory,
+  - a stale cursor replays from the oldest segment left, a cursor not on a
+    record boundary replays its whole segment,
+  - a torn tail is cut back to the last whole record, a record failing its
+    CRC cuts the segment there,
+  - a sealed segment with nothing left to send is deleted on recovery,
+    wherever it sits,
+  - max_bytes drops the oldest segments whole and counts what they held,
+  - unpop() and extend() serve put-back records first, in their order,
+  - an unusable directory keeps the queue in memory.
+Then append and pop/done rates.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from diskqueue import CURSOR, RECORD, DiskQueue
+
+TOPIC = "t/data"
+RECORD_BYTES = RECORD.size + len(TOPIC) + 8     # 24: ten records to a 256-byte segment
+
+
+def payload(i):
+    return b"rec%05d" % i
+
+
+def fill(q, first, n):
+    for i in range(first, first + n):
+        q.append(TOPIC, payload(i))
+
+
+def drain(q, done=True):
+    """Pop everything; returns the payload numbers in order."""
+    out = []
+    while True:
+        popped = q.pop()
+        if popped is None:
+            return out
+        record, topic, data = popped
+        assert topic == TOPIC
+        out.append(int(bytes(data)[3:]))
+        if done:
+            q.done([record])
+
+
+def files(path):
+    return sorted(os.listdir(path))
+
+
+def segment(path, seq):
+    return os.path.join(path, f"{seq:08d}.seg")
+
+
+def check_restart(path):
+    q = DiskQueue(path, segment_bytes=256)
+    fill(q, 0, 40)
+    assert files(path) == ["00000000.seg", "00000001.seg", "00000002.seg", "00000003.seg"]
+    popped = [q.pop()[0] for _ in range(25)]
+    q.done(popped[:12])                  # segment 0 and two of segment 1
+    q.done(popped[14:18])                # done past the low-water mark
+    assert files(path) == ["00000001.seg", "00000002.seg", "00000003.seg"]
+    q.sync()
+    with open(os.path.join(path, CURSOR)) as f:
+        assert json.load(f) == {"segment": 1, "offset": 2 * RECORD_BYTES}
+
+    # Crash: 12, 13 and 18..24 in flight, 14..17 done but after the cursor
+    q = DiskQueue(path, segment_bytes=256)
+    assert len(q) == 28
+    assert drain(q) == list(range(12, 40))
+    assert files(path) == ["00000003.seg", CURSOR]
+
+    # Everything done, but the cursor not saved again: it is stale, and the
+    # oldest segment left is replayed from its start
+    q = DiskQueue(path, segment_bytes=256)
+    assert drain(q) == list(range(30, 40))
+
+    # A cursor not on a record boundary replays its whole segment
+    with open(os.path.join(path, CURSOR), "w") as f:
+        json.dump({"segment": 3, "offset": 5}, f)
+    q = DiskQueue(path, segment_bytes=256)
+    assert drain(q) == list(range(30, 40))
+    q.sync()
+    q = DiskQueue(path, segment_bytes=256)
+    assert len(q) == 0 and drain(q) == []
+
+
+def check_torn(path):
+    q = DiskQueue(path, segment_bytes=256)
+    fill(q, 0, 15)
+    q.sync()
+    size = os.path.getsize(segment(path, 1))
+    with open(segment(path, 1), "ab") as f:
+        f.write(RECORD.pack(0, 8, len(TOPIC)) + TOPIC.encode() + b"rec")   # power cut mid-write
+    q = DiskQueue(path, segment_bytes=256)
+    assert os.path.getsize(segment(path, 1)) == size
+    assert drain(q, done=False) == list(range(15))
+    q.append(TOPIC, payload(15))         # appended on a record boundary again
+
+    # A flipped payload byte in the third record of segment 1: cut there
+    with open(segment(path, 1), "r+b") as f:
+        f.seek(2 * RECORD_BYTES + RECORD.size + len(TOPIC))
+        f.write(b"X")
+    q = DiskQueue(path, segment_bytes=256)
+    assert os.path.getsize(segment(path, 1)) == 2 * RECORD_BYTES
+    assert drain(q) == list(range(12))
+
+
+def check_done_segments(path):
+    q = DiskQueue(path, segment_bytes=256)
+    fill(q, 0, 40)
+    q.sync()
+    with open(segment(path, 2), "wb"):
+        pass                             # cut back to nothing, in the middle
+    q = DiskQueue(path, segment_bytes=256)
+    assert files(path) == ["00000000.seg", "00000001.seg", "00000003.seg", CURSOR]
+    assert drain(q) == list(range(20)) + list(range(30, 40))
+
+
+def check_cap(path):
+    q = DiskQueue(path, segment_bytes=256, max_bytes=600)
+    fill(q, 0, 60)
+    kept = drain(q)
+    snapshot = q.snapshot()
+    assert kept == list(range(60 - len(kept), 60))
+    assert snapshot["dropped"] == 60 - len(kept) and snapshot["dropped"] % 10 == 0
+    assert len(kept) * RECORD_BYTES <= 600
+
+
+def check_redo(path):
+    q = DiskQueue(path, segment_bytes=256)
+    fill(q, 0, 5)
+    r0, r1, r2 = (q.pop()[0] for _ in range(3))
+    q.extend([r0, r1])                   # PUBACK timeout: back for another attempt
+    q.unpop(r2)                          # batch cut short: back to the front
+    assert len(q) == 5
+    order = []
+    while True:
+        popped = q.pop()
+        if popped is None:
+            break
+        order.append((int(bytes(popped[2])[3:]), popped[0]))
+    assert [n for n, _ in order] == [2, 0, 1, 3, 4]
+    q.done([record for _, record in order])
+    assert q.segments[0].done_until == 5 * RECORD_BYTES
+    q.sync()
+    assert len(DiskQueue(path, segment_bytes=256)) == 0
+
+
+def check_memory(path):
+    with open(path, "w"):
+        pass                             # a file where the directory should be
+    q = DiskQueue(path, memory_max=3)
+    fill(q, 0, 5)
+    snapshot = q.snapshot()
+    assert snapshot["inMemory"] == 3 and snapshot["dropped"] == 2
+    assert drain(q) == [2, 3, 4]         # the oldest go first, as on disk
+
+
+def check():
+    for test in (check_restart, check_torn, check_done_segments, check_cap, check_redo, check_memory):
+        root = tempfile.mkdtemp()
+        try:
+            test(os.path.join(root, "retry"))
+        finally:
+            shutil.rmtree(root)
+    print("restart, stale and misaligned cursors, torn tails, CRC cuts, done segments, "
+          "the size cap, put-back order and the memory fallback all recover as expected")
+
+
+def main():
+    check()
+    n = 20000
+    root = tempfile.mkdtemp()
+    try:
+        q = DiskQueue(os.path.join(root, "retry"), max_bytes=64 * 1024 * 1024)
+        data = bytes(200)
+        start = time.perf_counter()
+        for _ in range(n):
+            q.append("powerlog/12345678/data", data)
+        append_us = (time.perf_counter() - start) / n * 1e6
+        start = time.perf_counter()
+        q.sync()
+        sync_ms = (time.perf_counter() - start) * 1e3
+        start = time.perf_counter()
+        while True:
+            popped = q.pop()
+            if popped is None:
+                break
+            q.done([popped[0]])
+        pop_us = (time.perf_counter() - start) / n * 1e6
+        print(f"{n} records of 200 bytes: append {append_us:.2f} us, pop+done {pop_us:.2f} us per record, "
+              f"sync of {q.syncs} segment(s) {sync_ms:.1f} ms")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Deadlines of the periodic loops (pacing.py): plain and wall-clock aligned.
+
+    python benchmarks/bench_pacing.py
+
+Checks first:
+  - advance() keeps the grid and skips (and counts) whole overrun periods,
+  - aligned_deadline() returns the next multiple of the interval and counts
+    the boundaries passed in between as missed,
+  - a run woken just before its boundary - wall time a little below `last`,
+    as an early asyncio timer or an NTP step back gives - still gets
+    last + interval, not `last` again, and no miss is counted.
+Then the cost of one deadline computation.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pacing import RateStats, advance, aligned_deadline
+
+
+def check():
+    stats = RateStats("check")
+    assert advance(100.0, 10, 105.0, stats) == 110.0
+    assert advance(100.0, 10, 135.0, stats) == 130.0          # 110, 120 missed
+    assert stats.snapshot()["missed"] == 2
+
+    stats = RateStats("check")
+    deadline, boundary = aligned_deadline(10, 50.0, wall=1000.4)
+    assert boundary == 1010 and abs(deadline - 59.6) < 1e-6
+    deadline, boundary = aligned_deadline(10, 50.0, last=1000, stats=stats, wall=1009.8)
+    assert boundary == 1010 and stats.snapshot()["missed"] == 0
+    deadline, boundary = aligned_deadline(10, 50.0, last=1000, stats=stats, wall=1031.0)
+    assert boundary == 1040 and stats.snapshot()["missed"] == 3  # 1010, 1020, 1030
+
+    # Woken early: the wall clock has not reached `last` yet
+    for wall in (999.999, 999.0, 995.0, 1000.0 - 1e-9):
+        deadline, boundary = aligned_deadline(10, 50.0, last=1000, stats=stats, wall=wall)
+        assert boundary == 1010, (wall, boundary)
+        assert abs(deadline - (50.0 + 1010 - wall)) < 1e-6
+    # On the boundary itself, and a clock stepped back by more than a period
+    assert aligned_deadline(10, 50.0, last=1000, stats=stats, wall=1000.0)[1] == 1010
+    assert aligned_deadline(10, 50.0, last=1000, stats=stats, wall=970.0)[1] == 1010
+    assert stats.snapshot()["missed"] == 3
+    print("advance keeps the grid; aligned boundaries count misses and never repeat `last`")
+
+
+def main():
+    check()
+    n = 200000
+    us = min(timeit.repeat(lambda: aligned_deadline(10, 50.0, 1000), number=n, repeat=5)) / n * 1e6
+    print(f"aligned_deadline: {us:.2f} us")
+    us = min(timeit.repeat(lambda: advance(100.0, 0.2, 100.1), number=n, repeat=5)) / n * 1e6
+    print(f"advance:          {us:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
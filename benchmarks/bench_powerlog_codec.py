@@ -0,0 +1,170 @@
+"""Golden check and encode cost of the powerlog frame (powerlog_codec.py).
+
+    python benchmarks/bench_powerlog_codec.py
+
+The word-list encoder main.py and multi_emdx_logger.py used before is
+reproduced below. The codec must give byte-for-byte the same frames -
+for a fixed golden record, for edge values (negative, overflowing,
+out-of-range frequency) and for random records - with and without the
+main.py trailer; decode() must read them back. Then both encoders are
+timed, and a backlog packed into batch messages is unpacked again.
+"""
+
+import os
+import random
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import powerlog_codec
+from powerlog_codec import PowerlogEncoder, decode, pack_batch, unpack_batch
+
+N = 20000
+
+GOLDEN = dict(
+    device_serial=0x0123ABCD, voltage_l1=230.125, voltage_l2=229.5, voltage_l3=231.875,
+    current_l1=12.25, current_l2=11.5, current_l3=12.0, current_n=0.75,
+    active_power=8.125, reactive_power=-1.5, apparent_power=8.25,
+    sign_active=0, sign_reactive=1, chained_voltage_l1l2=399.5, frequency=50.0,
+    consumed_energy=123456789.0, delivered_energy=4567.0, power_factor=0.98,
+    sector_power_factor=1, ct_ratio=400, operating_hours=8760.5,
+)
+GOLDEN_AGGREGATES = [229000, 231000, 230125, 229000, 230000, 229500, 231000, 232000, 231875,
+                     12000, 12500, 12250, 11000, 12000, 11500, 11500, 12500, 12000, 50]
+# Frame of GOLDEN at timestamp 1700000000, captured from the word-list encoder
+GOLDEN_HEX = (
+    "6553f1000123abcd000382ed0003807c000389c300002fda00002cec00002ee0000002ee"
+    "0000032cffffff6a00000339000000010006188c01f4075bcd15000011d7006200010190"
+    "223800037e8800038658000382ed00037e88000382700003807c0003865800038a400003"
+    "89c300002ee0000030d400002fda00002af800002ee000002cec00002cec000030d40000"
+    "2ee000000032"
+)
+
+
+# --- the previous implementation, for comparison ---------------------------
+def old_frame(timestamp, d, aggregated_values, window=None, sections=(), router_serial_int=None):
+    binary_data = bytearray()
+    binary_data.extend(struct.pack('>I', timestamp))
+    registers = [
+        d['device_serial'] >> 16,
+        d['device_serial'] & 0xFFFF,
+        int(d['voltage_l1'] * 1000) >> 16,
+        int(d['voltage_l1'] * 1000) & 0xFFFF,
+        int(d['voltage_l2'] * 1000) >> 16,
+        int(d['voltage_l2'] * 1000) & 0xFFFF,
+        int(d['voltage_l3'] * 1000) >> 16,
+        int(d['voltage_l3'] * 1000) & 0xFFFF,
+        int(d['current_l1'] * 1000) >> 16,
+        int(d['current_l1'] * 1000) & 0xFFFF,
+        int(d['current_l2'] * 1000) >> 16,
+        int(d['current_l2'] * 1000) & 0xFFFF,
+        int(d['current_l3'] * 1000) >> 16,
+        int(d['current_l3'] * 1000) & 0xFFFF,
+        int(d['current_n'] * 1000) >> 16,
+        int(d['current_n'] * 1000) & 0xFFFF,
+        int(d['active_power'] * 100) >> 16,
+        int(d['active_power'] * 100) & 0xFFFF,
+        int(d['reactive_power'] * 100) >> 16,
+        int(d['reactive_power'] * 100) & 0xFFFF,
+        int(d['apparent_power'] * 100) >> 16,
+        int(d['apparent_power'] * 100) & 0xFFFF,
+        d['sign_active'],
+        d['sign_reactive'],
+        int(d['chained_voltage_l1l2'] * 1000) >> 16,
+        int(d['chained_voltage_l1l2'] * 1000) & 0xFFFF,
+        int(min(100, max(0, d['frequency'])) * 10),
+        int(d['consumed_energy']) >> 16,
+        int(d['consumed_energy']) & 0xFFFF,
+        int(d['delivered_energy']) >> 16,
+        int(d['delivered_energy']) & 0xFFFF,
+        int(d['power_factor'] * 100),
+        d['sector_power_factor'],
+        d['ct_ratio'],
+        int(d['operating_hours'])
+    ]
+    for reg in registers:
+        binary_data.extend(struct.pack('>H', reg & 0xFFFF))
+    for value in aggregated_values:
+        binary_data.extend(struct.pack('>I', value & 0xffffffff))
+    if window is not None:
+        binary_data.extend(struct.pack('>II', *window))
+    for section in sections:
+        binary_data.extend(section)
+    if router_serial_int is not None:
+        binary_data.extend(struct.pack('>Q', router_serial_int & 0xFFFFFFFFFFFFFFFF))
+    return bytes(binary_data)
+
+
+def random_record():
+    return dict(
+        device_serial=random.randrange(1 << 32),
+        voltage_l1=random.uniform(0, 260), voltage_l2=random.uniform(0, 260), voltage_l3=random.uniform(0, 260),
+        current_l1=random.uniform(0, 600), current_l2=random.uniform(0, 600), current_l3=random.uniform(0, 600),
+        current_n=random.uniform(0, 50),
+        active_power=random.uniform(-500, 500), reactive_power=random.uniform(-500, 500),
+        apparent_power=random.uniform(0, 500),
+        sign_active=random.randrange(2), sign_reactive=random.randrange(2),
+        chained_voltage_l1l2=random.uniform(0, 450), frequency=random.uniform(-5, 120),
+        consumed_energy=random.uniform(0, 1e11), delivered_energy=random.uniform(0, 1e7),
+        power_factor=random.uniform(-1, 1), sector_power_factor=random.randrange(4),
+        ct_ratio=random.randrange(1, 70000), operating_hours=random.uniform(0, 70000),
+    )
+
+
+def check():
+    frame = PowerlogEncoder().encode(1700000000, GOLDEN, GOLDEN_AGGREGATES)
+    assert frame == old_frame(1700000000, GOLDEN, GOLDEN_AGGREGATES)
+    assert frame.hex() == GOLDEN_HEX, frame.hex()
+
+    encoder = PowerlogEncoder(size=64)    # also exercises the buffer growing
+    sections = [powerlog_codec.pack_energy_deltas(4, 1699999990, {"consumed": 1.5, "delivered": 0})]
+    for i in range(5000):
+        record = random_record()
+        aggregates = [random.randrange(-(1 << 33), 1 << 33) for _ in range(19)]
+        timestamp = random.randrange(1 << 32)
+        assert encoder.encode(timestamp, record, aggregates) == old_frame(timestamp, record, aggregates)
+        serial = random.randrange(1 << 64)
+        full = encoder.encode(timestamp, record, aggregates, window=(timestamp - 10, timestamp),
+                              sections=sections, router_serial=serial)
+        assert full == old_frame(timestamp, record, aggregates, (timestamp - 10, timestamp), sections, serial)
+        back = decode(full)
+        assert back["router_serial"] == serial and back["window_end"] == timestamp
+        assert back["sections"][0][1]["consumed"] == 1.5
+
+    back = decode(PowerlogEncoder().encode(1700000000, GOLDEN, GOLDEN_AGGREGATES))
+    assert back["voltage_l1"] == 230.125 and back["reactive_power"] == -1.5 and back["ct_ratio"] == 400
+    assert back["aggregates"][-1] == 50 and "router_serial" not in back
+    print("golden frame, 5000 random records with and without trailer: identical to the old encoder")
+
+
+def per_call_us(stmt):
+    return min(timeit.repeat(stmt, number=N, repeat=5)) / N * 1e6
+
+
+def main():
+    check()
+    encoder = PowerlogEncoder()
+    window = (1699999990, 1700000000)
+    serial = 12345678901234
+    old = per_call_us(lambda: old_frame(1700000000, GOLDEN, GOLDEN_AGGREGATES, window, (), serial))
+    new = per_call_us(lambda: encoder.encode(1700000000, GOLDEN, GOLDEN_AGGREGATES, window, (), serial))
+    print(f"encode one powerlog frame: word lists {old:.2f} us, codec {new:.2f} us")
+
+    # A backlog of fixed-size frames, then one with an energy section on some
+    sections = [powerlog_codec.pack_energy_deltas(0, 1699999990, {"consumed": 1.5, "delivered": 0})]
+    fixed = [encoder.encode(1700000000 + 10 * i, random_record(), GOLDEN_AGGREGATES, window, (), serial)
+             for i in range(60)]
+    mixed = [encoder.encode(1700000000 + 10 * i, random_record(), GOLDEN_AGGREGATES, window,
+                            sections if i % 3 else (), serial)
+             for i in range(60)]
+    for records in (fixed, mixed):
+        batch = pack_batch(records)
+        assert unpack_batch(batch) == records
+        print(f"batch of {len(records)} frames: {sum(map(len, records))} bytes of frames, "
+              f"{len(batch)} bytes as one message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Round trip and size of the v2 powerlog format (powerlog_v2.py) against v1.
+
+    python benchmarks/bench_powerlog_v2.py [recorded.hex]
+
+Without an argument a day of 10 s records is simulated: slowly drifting
+voltages, load steps on the currents, counting energy registers. With a
+file of recorded v1 frames (one hex payload per line, as dumped from the
+broker, with main.py's trailer) those are re-encoded instead.
+
+Checks first, on random and on simulated records:
+  - every v2 record decodes to exactly the values the v1 frame carries
+    (apart from energy, which v2 does not truncate to 32 bits),
+  - energy counters above 2^32 survive,
+  - delivery in random order, with duplicates, decodes every record,
+  - a lost record costs only the records up to the next keyframe.
+Then v1 and v2 sizes and encode times are compared.
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import powerlog_codec
+from powerlog_v2 import PowerlogV2Decoder, PowerlogV2Encoder, parse, values_from_frame
+
+ENERGY = ("consumed_energy", "delivered_energy")
+WINDOW_SECTIONS = [powerlog_codec.pack_energy_deltas(0, 1699999990, {"consumed": 12.5, "delivered": 0})]
+
+
+def simulated(n, serial=0x0123ABCD, start=1700000000):
+    """n records of one meter: (timestamp, measurement, aggregates, window, sections)."""
+    rnd = random.Random(7)
+    v = [230.0, 230.0, 230.0]
+    load = 120.0
+    consumed = 4_294_000_000.0           # crosses 2^32 after a few hours
+    records = []
+    for i in range(n):
+        t = start + 10 * i
+        v = [x + rnd.gauss(0, 0.15) - (x - 230) * 0.05 for x in v]
+        if rnd.random() < 0.01:
+            load = max(5.0, load + rnd.gauss(0, 40))
+        i_phase = [load * (1 + rnd.gauss(0, 0.02)) for _ in range(3)]
+        power = sum(a * b for a, b in zip(v, i_phase)) / 1000
+        consumed += power * 10 / 3.6
+        m = dict(
+            device_serial=serial,
+            voltage_l1=v[0], voltage_l2=v[1], voltage_l3=v[2],
+            current_l1=i_phase[0], current_l2=i_phase[1], current_l3=i_phase[2],
+            current_n=abs(rnd.gauss(0, 2)),
+            active_power=power, reactive_power=power * 0.2, apparent_power=power * 1.02,
+            sign_active=0, sign_reactive=0, chained_voltage_l1l2=v[0] * 1.732,
+            frequency=50 + rnd.gauss(0, 0.02),
+            consumed_energy=consumed, delivered_energy=1234.0,
+            power_factor=0.98, sector_power_factor=1, ct_ratio=400, operating_hours=8760 + i // 360,
+        )
+        aggregates = []
+        for x in v + i_phase:
+            aggregates += [int((x - 0.4) * 1000), int((x + 0.4) * 1000), int(x * 1000)]
+        aggregates.append(50)
+        sections = WINDOW_SECTIONS if i % 6 == 0 else ()
+        records.append((t, m, aggregates, (t - 10, t), sections))
+    return records
+
+
+def random_records(n):
+    rnd = random.Random(11)
+    records = []
+    for i in range(n):
+        m = {name: rnd.uniform(-300, 300) for name, _ in powerlog_codec.FIELDS}
+        for name in ("device_serial", "sign_active", "sign_reactive", "sector_power_factor", "ct_ratio"):
+            m[name] = rnd.randrange(1 << 15)
+        m["device_serial"] = 42
+        m["operating_hours"] = rnd.uniform(0, 60000)
+        m["frequency"] = rnd.uniform(-5, 120)
+        m["power_factor"] = rnd.uniform(0, 1)     # v1 slot is unsigned
+        for name in ENERGY:
+            m[name] = rnd.uniform(0, 1e6)
+        t = rnd.randrange(1 << 31)
+        aggregates = [rnd.randrange(-(1 << 31), 1 << 31) for _ in range(18)] + [rnd.randrange(1 << 16)]
+        records.append((t, m, aggregates, (t - 10, t), WINDOW_SECTIONS if rnd.random() < 0.5 else ()))
+    return records
+
+
+def same_as_v1(record, frame):
+    expected = powerlog_codec.decode(frame)
+    for key, value in expected.items():
+        if key not in ENERGY:
+            assert record[key] == value, (key, record[key], value)
+
+
+def check(serial):
+    for records in (random_records(3000), simulated(3000)):
+        encoder = PowerlogV2Encoder(keyframe=30, stream=1)
+        decoder = PowerlogV2Decoder()
+        for t, m, agg, window, sections in records:
+            (record,) = decoder.feed(encoder.encode(t, m, agg, window, sections, serial))
+            frame = powerlog_codec.encode(t, m, agg, window=window, sections=sections, router_serial=serial)
+            same_as_v1(record, frame)
+            for name in ENERGY:
+                assert record[name] == int(m[name])
+    assert record["consumed_energy"] > 2 ** 32
+
+    # Shuffled, with duplicates: everything decodes, once the bases are in
+    records = simulated(500)
+    encoder = PowerlogV2Encoder(keyframe=30, stream=2)
+    payloads = [encoder.encode(t, m, agg, window, sections, serial) for t, m, agg, window, sections in records]
+    shuffled = payloads + random.Random(3).sample(payloads, 50)
+    random.Random(5).shuffle(shuffled)
+    decoder = PowerlogV2Decoder(history=1000)
+    seen = {r["seq"] for p in shuffled for r in decoder.feed(p)}
+    assert seen == set(range(500)), len(seen)
+
+    # A lost record: the rest of its keyframe interval is held back, the
+    # next keyframe decodes again
+    decoder = PowerlogV2Decoder()
+    seen = {r["seq"] for i, p in enumerate(payloads) if i != 45 for r in decoder.feed(p)}
+    assert seen == set(range(500)) - set(range(45, 60)), sorted(set(range(500)) - seen)
+    print("3000 random and 3000 simulated records: v2 round trip equals v1 (energy at full width); "
+          "shuffled and duplicated delivery decodes all; a loss costs up to the next keyframe")
+
+
+def recorded(path):
+    with open(path) as f:
+        frames = [bytes.fromhex(line.strip()) for line in f if line.strip()]
+    return frames
+
+
+def main():
+    serial = 12345678901234
+    check(serial)
+
+    if len(sys.argv) > 1:
+        frames = recorded(sys.argv[1])
+        label = f"{len(frames)} recorded frames"
+    else:
+        records = simulated(8640)
+        frames = [powerlog_codec.encode(t, m, agg, window=window, sections=sections, router_serial=serial)
+                  for t, m, agg, window, sections in records]
+        label = "8640 simulated records (one day at 10 s)"
+
+    v1 = sum(len(f) for f in frames)
+    print(label)
+    print(f"  v1                     {v1:8d} bytes, {v1 / len(frames):6.1f} per record")
+    for keyframe in (1, 30, 360):
+        encoder = PowerlogV2Encoder(keyframe=keyframe)
+        v2 = 0
+        for frame in frames:
+            meter, values, sections = values_from_frame(frame)
+            payload = encoder.encode_values(meter, values, sections)
+            assert parse(payload)["meter"] == meter
+            v2 += len(payload)
+        print(f"  v2, keyframe every {keyframe:3d} {v2:8d} bytes, {v2 / len(frames):6.1f} per record "
+              f"({v2 / v1:.0%} of v1)")
+
+    if len(sys.argv) == 1:
+        t, m, agg, window, sections = records[100]
+        encoder = PowerlogV2Encoder()
+        n = 20000
+        us_v1 = min(timeit.repeat(lambda: powerlog_codec.encode(t, m, agg, window, sections, serial),
+                                  number=n, repeat=5)) / n * 1e6
+        us_v2 = min(timeit.repeat(lambda: encoder.encode(t, m, agg, window, sections, serial),
+                                  number=n, repeat=5)) / n * 1e6
+        print(f"encode one record: v1 {us_v1:.2f} us, v2 {us_v2:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
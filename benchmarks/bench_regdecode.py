@@ -0,0 +1,97 @@
+"""Decode cost of the RMU/UMG and EMDX register blocks.
+
+    python benchmarks/bench_regdecode.py
+
+Compares the per-value struct.unpack('>f', struct.pack('>HH', ...)) decode
+main.py used before (reproduced below) with regdecode.BlockDecoder, and with
+its NumPy path when NumPy is installed. Checks first that all of them give
+bit-identical values.
+"""
+
+import os
+import random
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import regdecode
+from regdecode import BlockDecoder
+
+N = 20000
+
+# The float offsets the RMU publish decoded, and the poll subset
+RMU_PUBLISH_OFFSETS = (0, 2, 4, 12, 14, 16, 18, 26, 34, 42, 50, 68, 76)
+
+
+def random_float_block(words):
+    registers = []
+    for _ in range(words // 2):
+        registers.extend(struct.unpack(">HH", struct.pack(">f", random.uniform(-500, 500))))
+    return registers
+
+
+# --- the previous implementation, for comparison ---------------------------
+def old_rmu_publish(main_registers):
+    return [struct.unpack('>f', struct.pack('>HH', main_registers[o], main_registers[o + 1]))[0]
+            for o in RMU_PUBLISH_OFFSETS]
+
+
+def old_rmu_poll(voltage_block, current_block):
+    return [struct.unpack('>f', struct.pack('>HH', b[o], b[o + 1]))[0]
+            for b, o in ((voltage_block, 0), (voltage_block, 2), (voltage_block, 4),
+                         (current_block, 0), (current_block, 2), (current_block, 4))]
+
+
+def old_emdx(block1):
+    return [(block1[o] << 16 | block1[o + 1]) / 1000.0 for o in range(0, 14, 2)]
+
+
+def per_call_us(stmt):
+    return min(timeit.repeat(stmt, number=N, repeat=5)) / N * 1e6
+
+
+def main():
+    main_registers = random_float_block(86)
+    voltage_block, current_block = main_registers[0:6], main_registers[12:20]
+    emdx_block = [random.randrange(0x10000) for _ in range(14)]
+
+    rmu_main = BlockDecoder(86)
+    rmu_voltage = BlockDecoder(6)
+    rmu_current = BlockDecoder(8)
+    emdx = BlockDecoder(14, "I", divisors=1000.0)
+
+    def new_rmu_publish():
+        floats = rmu_main.decode(main_registers)
+        return [floats[o // 2] for o in RMU_PUBLISH_OFFSETS]
+
+    def new_rmu_poll():
+        return rmu_voltage.decode(voltage_block) + rmu_current.decode(current_block)[:3]
+
+    assert new_rmu_publish() == old_rmu_publish(main_registers)
+    assert new_rmu_poll() == old_rmu_poll(voltage_block, current_block)
+    assert emdx.decode(emdx_block) == old_emdx(emdx_block)
+
+    print("us per decode              per value   BlockDecoder   NumPy")
+    have_numpy = regdecode.numpy is not None
+    rows = [
+        ("RMU publish, 86 registers", lambda: old_rmu_publish(main_registers), new_rmu_publish,
+         BlockDecoder(86, numpy=True) if have_numpy else None, main_registers),
+        ("RMU poll, V + I blocks", lambda: old_rmu_poll(voltage_block, current_block), new_rmu_poll,
+         None, None),
+        ("EMDX V/I block, u32/1000", lambda: old_emdx(emdx_block), lambda: emdx.decode(emdx_block),
+         BlockDecoder(14, "I", divisors=1000.0, numpy=True) if have_numpy else None, emdx_block),
+    ]
+    for label, old, new, vector, block in rows:
+        numpy_us = "-"
+        if vector is not None:
+            assert vector.decode(block) == (new() if block is emdx_block else rmu_main.decode(block))
+            numpy_us = f"{per_call_us(lambda: vector.decode(block)):6.2f}"
+        print(f"{label:26} {per_call_us(old):8.2f}   {per_call_us(new):11.2f}   {numpy_us:>6}")
+    if not have_numpy:
+        print("(NumPy not installed: NumPy column skipped)")
+
+
+if __name__ == "__main__":
+    main()
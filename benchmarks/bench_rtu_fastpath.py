@@ -0,0 +1,115 @@
+"""CPU time per RTU read: pymodbus path vs. the rtufast fast path.
+
+Run on the router (or anywhere) from the repository root:
+
+    python benchmarks/bench_rtu_fastpath.py            # simulated meter
+    python benchmarks/bench_rtu_fastpath.py /dev/ttyHS0 # real bus, slave 1
+
+With no port a fake serial port answers every request instantly with a
+valid, CRC-correct response, so the numbers are pure CPU cost of building,
+framing and decoding - what the fast path is meant to save. On a real port
+the wall time includes the frames on the wire; the CPU time is still what
+matters for the router.
+
+Both paths must return identical registers; the script checks that first.
+"""
+
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pymodbus.client.serial import ModbusSerialClient
+
+from rtufast import RtuFastPath, crc16, with_crc
+
+# (slave, address, count) of the reads main.py sends most often
+READS = [(1, 0x1000, 14), (49, 19000, 86), (49, 19000, 20)]
+ROUNDS = 2000
+
+
+class FakeMeterPort:
+    """Just enough of a pyserial port to answer 0x03 reads from memory."""
+
+    def __init__(self):
+        self._out = b""
+        self.timeout = 0.3
+        self.inter_byte_timeout = None
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return len(self._out)
+
+    def inWaiting(self):
+        return len(self._out)
+
+    def reset_input_buffer(self):
+        self._out = b""
+
+    def write(self, frame):
+        assert crc16(frame) == 0
+        slave, fc, address, count = struct.unpack(">BBHH", frame[:6])
+        words = [(address + i) & 0xFFFF for i in range(count)]
+        self._out = with_crc(struct.pack(f">BBB{count}H", slave, fc, 2 * count, *words))
+        return len(frame)
+
+    def read(self, size):
+        data, self._out = self._out[:size], self._out[size:]
+        return data
+
+    def close(self):
+        self.is_open = False
+
+
+def make_client(port):
+    client = ModbusSerialClient(port=port or "/dev/null", baudrate=19200, timeout=0.3)
+    if port:
+        if not client.connect():
+            sys.exit(f"cannot open {port}")
+    else:
+        client.socket = FakeMeterPort()
+        # Nothing to wait for on a fake port
+        client._recv_interval = 0
+        client.silent_interval = 0
+    return client
+
+
+def bench(label, fn, reads):
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    for _ in range(ROUNDS):
+        for slave, address, count in reads:
+            fn(address, count=count, slave=slave)
+    n = ROUNDS * len(reads)
+    cpu = (time.process_time() - cpu0) / n * 1e6
+    wall = (time.perf_counter() - wall0) / n * 1e6
+    print(f"{label:10s} {cpu:8.1f} us CPU/read {wall:8.1f} us wall/read")
+    return cpu
+
+
+def main():
+    global ROUNDS
+    port = sys.argv[1] if len(sys.argv) > 1 else None
+    reads = READS
+    if port:
+        reads = [(1, 0x1000, 14)]
+        ROUNDS = 200
+    client = make_client(port)
+    fast = RtuFastPath(client)
+
+    for slave, address, count in reads:
+        a = client.read_holding_registers(address, count=count, slave=slave)
+        b = fast.read_holding_registers(address, count=count, slave=slave)
+        assert not a.isError() and not b.isError(), (a, b)
+        assert list(a.registers) == b.registers, (slave, address, count)
+    print(f"{len(reads)} read shapes, {ROUNDS} rounds, identical registers on both paths")
+
+    slow = bench("pymodbus", client.read_holding_registers, reads)
+    quick = bench("fast path", fast.read_holding_registers, reads)
+    print(f"fast path uses {quick / slow:.0%} of the pymodbus CPU time per read")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Wall time per RTU read: silence-based vs. exact-length response framing.
+
+Run from the repository root:
+
+    python benchmarks/bench_rtu_framing.py            # simulated 19200 baud meter
+    python benchmarks/bench_rtu_framing.py /dev/ttyHS0 # real bus, slave 1
+
+The simulated port releases the response byte by byte at the 19200 baud
+character time after a fixed turnaround, so both clients see a realistic
+line; the difference per read is the silence the stock client waits out
+after the last byte. On the router, the modemlog "mbRead" field gives the
+same comparison from production traffic (start main.py with and without
+--silence-framing).
+"""
+
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pymodbus.client.serial import ModbusSerialClient
+
+from rtufast import ExactLengthSerialClient, crc16, with_crc
+
+READS = [(1, 0x1000, 14), (49, 19000, 86), (49, 19000, 20)]
+ROUNDS = 50
+BAUDRATE = 19200
+TURNAROUND = 0.003      # slave think time before the first response byte
+
+
+class TimedMeterPort:
+    """A pyserial stand-in that answers 0x03 reads at serial-line speed."""
+
+    def __init__(self):
+        self.char_time = 10.0 / BAUDRATE
+        self.timeout = 0.3
+        self.inter_byte_timeout = None
+        self.is_open = True
+        self._frame = b""
+        self._start = 0.0
+        self._taken = 0
+
+    def _arrived(self):
+        elapsed = time.perf_counter() - self._start
+        if elapsed <= 0:
+            return 0
+        return min(len(self._frame), int(elapsed / self.char_time))
+
+    @property
+    def in_waiting(self):
+        return self._arrived() - self._taken
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def reset_input_buffer(self):
+        self._taken = len(self._frame)
+
+    def write(self, frame):
+        assert crc16(frame) == 0
+        slave, fc, address, count = struct.unpack(">BBHH", frame[:6])
+        words = [(address + i) & 0xFFFF for i in range(count)]
+        self._frame = with_crc(struct.pack(f">BBB{count}H", slave, fc, 2 * count, *words))
+        self._taken = 0
+        # Request on the wire, then the slave's turnaround
+        self._start = time.perf_counter() + len(frame) * self.char_time + TURNAROUND
+        return len(frame)
+
+    def read(self, size):
+        want = min(self._taken + size, len(self._frame))
+        ready_at = self._start + want * self.char_time
+        delay = ready_at - time.perf_counter()
+        if delay > self.timeout:
+            time.sleep(self.timeout)
+        elif delay > 0:
+            time.sleep(delay)
+        end = min(self._arrived(), self._taken + size)
+        data = self._frame[self._taken:end]
+        self._taken = end
+        return data
+
+    def close(self):
+        self.is_open = False
+
+
+def make_client(cls, port):
+    client = cls(port=port or "/dev/null", baudrate=BAUDRATE, timeout=0.3)
+    if port:
+        if not client.connect():
+            sys.exit(f"cannot open {port}")
+    else:
+        client.socket = TimedMeterPort()
+    return client
+
+
+def bench(label, client, reads):
+    results = {}
+    for slave, address, count in reads:
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            response = client.read_holding_registers(address, count=count, slave=slave)
+            assert not response.isError(), response
+        results[(slave, address, count)] = (time.perf_counter() - start) / ROUNDS * 1000
+    print(label + "".join(f"  {ms:7.2f}" for ms in results.values()))
+    return results
+
+
+def main():
+    port = sys.argv[1] if len(sys.argv) > 1 else None
+    reads = [(1, 0x1000, 14)] if port else READS
+    print(f"{ROUNDS} reads each, ms of wall time per read")
+    print("framing " + "".join(f"  {s}/{a}/{c}" for s, a, c in reads))
+    silence = bench("silence ", make_client(ModbusSerialClient, port), reads)
+    exact = bench("exact   ", make_client(ExactLengthSerialClient, port), reads)
+    saved = sum(silence.values()) - sum(exact.values())
+    print(f"exact-length framing saves {saved / len(reads):.2f} ms per read on average")
+
+
+if __name__ == "__main__":
+    main()
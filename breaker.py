@@ -0,0 +1,130 @@
+"""Per-slave circuit breaker for Modbus devices that stop answering.
+
+When a meter drops off the bus the poller used to keep hammering it about
+five times a second, every attempt burning the full timeout (and pymodbus's
+retries) on a shared half-duplex line. The breaker turns that into a
+bounded, backing-off retry:
+
+    closed     normal operation; failure_threshold unanswered requests in a
+               row open the breaker
+    open       requests to the slave are skipped without touching the bus
+               until the backoff delay has passed
+    half-open  exactly one caller gets to send a cheap probe (the serial
+               register); an answer closes the breaker, silence re-opens it
+               with the next, doubled delay
+
+The delay grows base_delay * 2**(n-1) up to max_delay with +-jitter, so
+several slaves (or several loggers after a power cut) do not come back in
+lockstep. Only "no answer" counts as a failure: an exception response means
+the device is alive.
+"""
+
+import random
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, base_delay=1.0, max_delay=60.0, jitter=0.2):
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0           # consecutive unanswered requests
+        self.open_streak = 0        # consecutive openings without a close
+        self.retry_at = 0.0
+        self.opened = 0             # cumulative transitions, for the modemlog
+        self.closed = 0
+        self.skipped = 0
+
+    def acquire(self):
+        """Decide whether a caller may talk to the slave now.
+
+        Returns CLOSED (go ahead), HALF_OPEN (go ahead, and you are the
+        probe - send something cheap) or OPEN (skip this cycle).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == CLOSED:
+                return CLOSED
+            # A probe that never reported back (its caller died) must not
+            # leave the breaker half-open forever.
+            if now >= self.retry_at and (self.state == OPEN or now - self.retry_at > self.max_delay):
+                self.state = HALF_OPEN
+                return HALF_OPEN
+            self.skipped += 1
+            return OPEN
+
+    def retry_in(self):
+        """Seconds until the next probe is allowed (0 if not open)."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.retry_at - time.monotonic())
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                self.closed += 1
+            self.state = CLOSED
+            self.failures = 0
+            self.open_streak = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.open_streak += 1
+        self.opened += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.open_streak - 1))
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.retry_at = time.monotonic() + delay
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "opened": self.opened,
+                "closed": self.closed,
+                "skipped": self.skipped,
+            }
+
+
+class BreakerBoard:
+    """One CircuitBreaker per slave id, created on first use."""
+
+    def __init__(self, **settings):
+        self._settings = settings
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, slave):
+        with self._lock:
+            breaker = self._breakers.get(slave)
+            if breaker is None:
+                breaker = self._breakers[slave] = CircuitBreaker(**self._settings)
+            return breaker
+
+    def success(self, slave):
+        if slave is not None:
+            self.get(slave).success()
+
+    def failure(self, slave):
+        if slave is not None:
+            self.get(slave).failure()
+
+    def snapshot(self):
+        """{slave id (str): breaker snapshot} for the modemlog."""
+        with self._lock:
+            breakers = sorted(self._breakers.items())
+        return {str(slave): breaker.snapshot() for slave, breaker in breakers}
@@ -0,0 +1,131 @@
+"""Priority and deadline-aware arbitration of the RS485 bus.
+
+With a plain lock every RTU transaction is served first-come-first-served:
+a provisioning write or the handful of reads of a powerlog publish can sit
+in front of the 2 Hz voltage/current poll and skew the min/max window. The
+BusScheduler hands the bus out per transaction by priority class instead:
+
+    PRIO_POLL          the fast voltage/current poll
+    PRIO_PUBLISH       the periodic powerlog reads
+    PRIO_TELEMETRY     slow, best-effort reads (static-register refreshes)
+    PRIO_PROVISIONING  configuration writes and their read-backs
+
+Transactions are not preempted - one frame on the wire at a time is a hard
+Modbus rule - but whenever the bus frees up the most urgent waiter goes
+first, so lower classes only ever fill the idle time in between. A request
+may carry a deadline (time.monotonic() based): if it is still queued when
+the deadline passes it is dropped with DeadlineExpired instead of being
+served late, which is what a poll sample wants - a stale one is worthless,
+the next poll is already due.
+
+Per-class queue-wait and service-time totals are kept in SchedulerStats and
+exported in the modemlog. The asyncio runtime's BusOwner uses the same
+classes and stats.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+PRIO_POLL = 0
+PRIO_PUBLISH = 1
+PRIO_TELEMETRY = 2
+PRIO_PROVISIONING = 3
+
+PRIORITY_NAMES = {
+    PRIO_POLL: "poll",
+    PRIO_PUBLISH: "publish",
+    PRIO_TELEMETRY: "telemetry",
+    PRIO_PROVISIONING: "provisioning",
+}
+
+
+class DeadlineExpired(Exception):
+    """A scheduled bus request was dropped because its deadline passed."""
+
+
+class SchedulerStats:
+    """Cumulative per-class counters: served, expired, wait and service time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._classes = {p: [0, 0, 0.0, 0.0, 0.0] for p in PRIORITY_NAMES}  # n, expired, wait, wait_max, service
+
+    def served(self, priority, wait, service):
+        with self._lock:
+            c = self._classes[priority]
+            c[0] += 1
+            c[2] += wait
+            c[3] = max(c[3], wait)
+            c[4] += service
+
+    def expired(self, priority):
+        with self._lock:
+            self._classes[priority][1] += 1
+
+    def snapshot(self):
+        """{class name: {n, expired, waitAvgMs, waitMaxMs, svcAvgMs}} for the modemlog."""
+        with self._lock:
+            out = {}
+            for priority, (n, expired, wait, wait_max, service) in self._classes.items():
+                out[PRIORITY_NAMES[priority]] = {
+                    "n": n,
+                    "expired": expired,
+                    "waitAvgMs": round(wait / n * 1000, 1) if n else 0,
+                    "waitMaxMs": round(wait_max * 1000, 1),
+                    "svcAvgMs": round(service / n * 1000, 1) if n else 0,
+                }
+            return out
+
+
+class BusScheduler:
+    """Thread-safe priority arbiter for a single shared transport.
+
+    submit() blocks the calling thread until it is that request's turn, runs
+    fn(*args, **kwargs) with exclusive access to the bus and returns its
+    result. It replaces `with modbus_lock:` around every RTU transaction.
+    """
+
+    def __init__(self, stats=None):
+        self._cond = threading.Condition()
+        self._busy = False
+        self._waiting = []                  # heap of [priority, seq]
+        self._seq = itertools.count()
+        self.stats = stats if stats is not None else SchedulerStats()
+
+    def submit(self, priority, fn, *args, deadline=None, **kwargs):
+        queued_at = time.monotonic()
+        entry = [priority, next(self._seq)]
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            while self._busy or self._waiting[0] is not entry:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        self._drop(entry)
+                        self.stats.expired(priority)
+                        raise DeadlineExpired(f"{PRIORITY_NAMES[priority]} request expired in queue")
+                self._cond.wait(timeout)
+            heapq.heappop(self._waiting)
+            if deadline is not None and time.monotonic() >= deadline:
+                self._cond.notify_all()
+                self.stats.expired(priority)
+                raise DeadlineExpired(f"{PRIORITY_NAMES[priority]} request expired in queue")
+            self._busy = True
+        started = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            finished = time.monotonic()
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+            self.stats.served(priority, started - queued_at, finished - started)
+
+    def _drop(self, entry):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+        # The head may have changed: let the new head's owner re-check.
+        self._cond.notify_all()
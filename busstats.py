@@ -0,0 +1,168 @@
+"""RS485 bus utilisation and latency statistics.
+
+modbus_error_count says that reads fail, not why, how slow the good ones
+are or how much headroom the bus has left. BusStats is fed from two places:
+
+  - every RTU transaction (rtu_call in threaded mode, the RTU BusOwner in
+    asyncio mode): wall time with the bus held, per slave and register
+    block, into a latency histogram; busy time for the duty cycle; the
+    outcome (answered, exception response, no answer)
+  - every response frame, where the transport can see them
+    (rtufast.ExactLengthSerialClient and the fast path): bytes on the wire
+    and the frame-level error class - timeout, CRC, short frame, exception
+
+summary() is the compact per-modemlog view, dump() the full one with every
+histogram (published on demand, see on_message). Queue wait for the bus is
+in the scheduler stats (busSched) already and not repeated here.
+"""
+
+import threading
+import time
+
+# Histogram bucket upper bounds in ms; one extra overflow bucket above the last.
+LATENCY_BOUNDS_MS = (5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+
+ERROR_CLASSES = ("timeout", "crc", "short", "exception")
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "n", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BOUNDS_MS) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        i = 0
+        while i < len(LATENCY_BOUNDS_MS) and ms > LATENCY_BOUNDS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.n += other.n
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (max for the overflow)."""
+        if not self.n:
+            return 0
+        rank = q * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return LATENCY_BOUNDS_MS[i] if i < len(LATENCY_BOUNDS_MS) else round(self.max, 1)
+        return round(self.max, 1)
+
+    def to_dict(self):
+        return {
+            "n": self.n,
+            "avgMs": round(self.total / self.n, 2) if self.n else 0,
+            "maxMs": round(self.max, 2),
+            "p50Ms": self.quantile(0.5),
+            "p95Ms": self.quantile(0.95),
+            "hist": list(self.counts),
+        }
+
+
+class BusStats:
+    """Thread-safe bus statistics; label(slave, address, count) names a block."""
+
+    def __init__(self, label=None):
+        self._label = label or (lambda slave, address, count: f"{slave}:{address}/{count}")
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._latency = {}                      # block label -> LatencyHistogram
+        self._busy = 0.0                        # seconds with a transaction on the bus
+        self._tx = 0
+        self._rx = 0
+        self._errors = dict.fromkeys(ERROR_CLASSES, 0)
+        self._exception_codes = {}
+        self._window_start = self._started      # duty cycle window of summary()
+        self._window_busy = 0.0
+
+    def transaction(self, slave, address, count, elapsed, outcome, tx=None, rx=None, exception_code=None):
+        """One transaction: outcome is None (answered), "exception" or "timeout".
+
+        Leave tx/rx at None when the transport reports its frames through
+        frame(); otherwise pass the byte counts estimated from the request
+        shape, and the outcome doubles as the error class.
+        """
+        label = self._label(slave, address, count)
+        with self._lock:
+            hist = self._latency.get(label)
+            if hist is None:
+                hist = self._latency[label] = LatencyHistogram()
+            hist.add(elapsed * 1000)
+            self._busy += elapsed
+            self._window_busy += elapsed
+            if tx is not None:
+                self._tx += tx
+                if outcome != "timeout":
+                    self._rx += rx if outcome is None else 5
+                if outcome is not None:
+                    self._errors[outcome] += 1
+                if exception_code is not None:
+                    self._exception_codes[exception_code] = self._exception_codes.get(exception_code, 0) + 1
+
+    def frame(self, tx, rx, error=None, exception_code=None):
+        """One request/response frame pair as seen by the transport."""
+        with self._lock:
+            self._tx += tx
+            self._rx += rx
+            if error is not None:
+                self._errors[error] += 1
+            if exception_code is not None:
+                self._exception_codes[exception_code] = self._exception_codes.get(exception_code, 0) + 1
+
+    def summary(self):
+        """Compact view for every modemlog.
+
+        Counters are cumulative like modbusErrors; dutyPct is the share of
+        time the bus was busy since the previous summary.
+        """
+        now = time.monotonic()
+        with self._lock:
+            total = LatencyHistogram()
+            for hist in self._latency.values():
+                total.merge(hist)
+            window = now - self._window_start
+            duty = self._window_busy / window * 100 if window > 0 else 0
+            self._window_start = now
+            self._window_busy = 0.0
+            return {
+                "dutyPct": round(duty, 1),
+                "txB": self._tx,
+                "rxB": self._rx,
+                "n": total.n,
+                "p50Ms": total.quantile(0.5),
+                "p95Ms": total.quantile(0.95),
+                "maxMs": round(total.max, 1),
+                "err": dict(self._errors),
+            }
+
+    def dump(self):
+        """Everything, including the per-block histograms (published on demand)."""
+        now = time.monotonic()
+        with self._lock:
+            uptime = now - self._started
+            return {
+                "timestamp": time.time(),
+                "uptimeSec": round(uptime),
+                "busySec": round(self._busy, 1),
+                "dutyPct": round(self._busy / uptime * 100, 2) if uptime > 0 else 0,
+                "txB": self._tx,
+                "rxB": self._rx,
+                "err": dict(self._errors),
+                "exceptionCodes": {str(code): n for code, n in sorted(self._exception_codes.items())},
+                "bucketsMs": list(LATENCY_BOUNDS_MS),
+                "latency": {label: hist.to_dict() for label, hist in sorted(self._latency.items())},
+            }
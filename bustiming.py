@@ -0,0 +1,198 @@
+"""Adaptive per-slave response timeouts for the RTU transport.
+
+The serial client used to run with a fixed timeout=0.3. A healthy EMDX at
+19200 baud starts answering within a few milliseconds, so every frame lost
+to noise cost the full 300 ms - times (retries + 1) inside pymodbus - while
+holding the bus. AdaptiveTimeouts learns what "normal" looks like per
+(slave, function code) and sizes each request's timeout from that, the way
+TCP sizes its retransmission timeout:
+
+    turnaround = elapsed - wire time of request and response at the baud rate
+    srtt/rttvar  EWMA of the turnaround and of its deviation (RFC 6298 gains)
+    high         the PERCENTILE of the last WINDOW turnarounds
+    timeout      = max(srtt + 4 * rttvar, high) * margin * backoff + wire time
+                   clamped to [floor, ceiling]
+
+Learning the turnaround instead of the raw round trip matters because the
+response length varies wildly per request: an 86-register RMU read is ~180
+bytes (~95 ms on the wire), the 14-register poll ~33 bytes. The wire time of
+each request is added back on top, so one learned figure fits every size.
+
+Until MIN_SAMPLES answers have been seen the ceiling is used. A request that
+is not answered doubles the backoff factor of its key (reset by the next
+answer), so a slave that got slow is not cut off for good. Samples that took
+longer than the timeout in force can only have come from a pymodbus retry
+and are not learned.
+"""
+
+import threading
+import time
+from collections import deque
+
+MIN_SAMPLES = 8
+
+# Function codes and frame sizes (bytes incl. address and CRC) of the client
+# methods this code base uses: method -> (fc, request_bytes(args, kwargs), response_bytes).
+_SHAPES = {
+    "read_holding_registers": (3, lambda count: 8, lambda count: 5 + 2 * count),
+    "write_register": (6, lambda count: 8, lambda count: 8),
+    "write_registers": (16, lambda count: 9 + 2 * count, lambda count: 8),
+}
+
+
+def transaction_shape(method, args, kwargs):
+    """Return (function code, request bytes, response bytes) of a client call, or None."""
+    shape = _SHAPES.get(method)
+    if shape is None:
+        return None
+    fc, request_bytes, response_bytes = shape
+    if method == "write_registers":
+        values = kwargs.get("values", args[1] if len(args) > 1 else ())
+        count = len(values)
+    else:
+        count = kwargs.get("count", args[1] if len(args) > 1 else 1)
+    return fc, request_bytes(count), response_bytes(count)
+
+
+def set_client_timeout(client, timeout):
+    """Apply a response timeout to a sync or async pymodbus serial client.
+
+    The sync client frames on comm_params.timeout_connect, the async one on
+    its transaction manager's own copy of comm_params; the pyserial port
+    keeps the value it was opened with, so it is updated as well.
+    """
+    client.comm_params.timeout_connect = timeout
+    for manager in (getattr(client, "transaction", None), getattr(client, "ctx", None)):
+        if manager is not None and manager.comm_params is not client.comm_params:
+            manager.comm_params.timeout_connect = timeout
+    socket = getattr(client, "socket", None)
+    if socket is not None and getattr(socket, "timeout", timeout) != timeout:
+        # pyserial reconfigures the port on every assignment
+        socket.timeout = timeout
+
+
+class _Estimator:
+    __slots__ = ("srtt", "rttvar", "samples", "backoff", "n", "misses")
+
+    def __init__(self, window):
+        self.srtt = None
+        self.rttvar = 0.0
+        self.samples = deque(maxlen=window)
+        self.backoff = 1
+        self.n = 0
+        self.misses = 0
+
+
+class AdaptiveTimeouts:
+    """Per (slave, function code) latency tracking and timeout selection.
+
+    floor/ceiling: bounds in seconds for every timeout handed out; the
+                   ceiling is also used until a key has MIN_SAMPLES answers.
+    alpha/beta:    EWMA gains of the mean and the deviation.
+    percentile:    which percentile of the last `window` turnarounds to cover.
+    margin:        multiplier on the learned turnaround.
+    """
+
+    def __init__(self, baudrate, floor=0.05, ceiling=0.3, alpha=0.125, beta=0.25,
+                 percentile=0.99, window=64, margin=1.5):
+        # 1 start + 8 data + 1 stop bit per character (8N1).
+        self.char_time = 10.0 / baudrate
+        self.floor = floor
+        self.ceiling = ceiling
+        self.alpha = alpha
+        self.beta = beta
+        self.percentile = percentile
+        self.window = window
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._keys = {}
+
+    def _estimator(self, key):
+        est = self._keys.get(key)
+        if est is None:
+            est = self._keys[key] = _Estimator(self.window)
+        return est
+
+    def _high(self, est):
+        ordered = sorted(est.samples)
+        return ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+    def _turnaround_timeout(self, est):
+        return max(est.srtt + 4 * est.rttvar, self._high(est)) * self.margin
+
+    def timeout(self, slave, fc, request_bytes, response_bytes):
+        """The timeout to use for one request of this shape."""
+        with self._lock:
+            est = self._estimator((slave, fc))
+            if est.n < MIN_SAMPLES:
+                return self.ceiling
+            wire = (request_bytes + response_bytes) * self.char_time
+            t = self._turnaround_timeout(est) * est.backoff + wire
+        return min(self.ceiling, max(self.floor, t))
+
+    def observe(self, slave, fc, elapsed, request_bytes, response_bytes):
+        """Learn from an answered request that took `elapsed` seconds."""
+        turnaround = max(0.0, elapsed - (request_bytes + response_bytes) * self.char_time)
+        with self._lock:
+            est = self._estimator((slave, fc))
+            if est.srtt is None:
+                est.srtt = turnaround
+                est.rttvar = turnaround / 2
+            else:
+                est.rttvar += self.beta * (abs(est.srtt - turnaround) - est.rttvar)
+                est.srtt += self.alpha * (turnaround - est.srtt)
+            est.samples.append(turnaround)
+            est.backoff = 1
+            est.n += 1
+
+    def missed(self, slave, fc):
+        """Record an unanswered request: back off until the next answer."""
+        with self._lock:
+            est = self._estimator((slave, fc))
+            est.misses += 1
+            if est.n >= MIN_SAMPLES and self._turnaround_timeout(est) * est.backoff < self.ceiling:
+                est.backoff *= 2
+
+    def before(self, client, method, args, kwargs):
+        """Set the client's timeout for this call; returns the context for after()."""
+        shape = transaction_shape(method, args, kwargs)
+        if shape is None:
+            return None
+        fc, request_bytes, response_bytes = shape
+        slave = kwargs.get("slave", 1)
+        applied = self.timeout(slave, fc, request_bytes, response_bytes)
+        set_client_timeout(client, applied)
+        return slave, fc, request_bytes, response_bytes, applied, time.monotonic()
+
+    def after(self, context, result):
+        """Learn from the outcome of a call prepared with before().
+
+        result is the response, or None if the call raised (no answer).
+        """
+        if context is None:
+            return
+        slave, fc, request_bytes, response_bytes, applied, started = context
+        elapsed = time.monotonic() - started
+        answered = result is not None and (not result.isError()
+                                           or getattr(result, "exception_code", None) is not None)
+        if not answered:
+            self.missed(slave, fc)
+        elif elapsed <= applied:
+            self.observe(slave, fc, elapsed, request_bytes, response_bytes)
+
+    def snapshot(self):
+        """{"slave/fc": {n, miss, srttMs, pHighMs, toMs}} for the modemlog.
+
+        toMs is the learned turnaround timeout (before the wire time of a
+        specific request is added and before clamping).
+        """
+        with self._lock:
+            out = {}
+            for (slave, fc), est in sorted(self._keys.items()):
+                entry = {"n": est.n, "miss": est.misses}
+                if est.srtt is not None:
+                    entry["srttMs"] = round(est.srtt * 1000, 1)
+                    entry["pHighMs"] = round(self._high(est) * 1000, 1)
+                    entry["toMs"] = round(self._turnaround_timeout(est) * est.backoff * 1000, 1)
+                out[f"{slave}/{fc}"] = entry
+            return out
@@ -0,0 +1,61 @@
+"""Report-by-exception for the powerlog: deadbands plus a heartbeat.
+
+A site at zero load for hours still sent a full powerlog every
+sendInterval. With a DeadbandFilter the publish cycle first asks due():
+the window is published only if a configured quantity moved further than
+its deadband from the value last published - judged on the window's min
+and max as well as its average, so a short excursion inside an otherwise
+quiet window still counts - or if the heartbeat interval has passed
+without a publish.
+
+When a cycle is not due the window is simply not closed: it keeps
+accumulating, min/max/avg and sample count included, and the next publish
+covers the whole stretch with its true start and end. Nothing measured is
+dropped, it is just reported in fewer, longer windows.
+"""
+
+import threading
+
+
+class DeadbandFilter:
+    """deadbands: {channel name: absolute band}; heartbeat: seconds."""
+
+    def __init__(self, deadbands, heartbeat):
+        self.deadbands = dict(deadbands)
+        self.heartbeat = heartbeat
+        self._lock = threading.Lock()
+        self._reference = {}        # channel -> average last published
+        self._last = None           # monotonic time of the last publish
+        self.sent = 0
+        self.suppressed = 0
+
+    def due(self, now, values):
+        """Whether the window with these {channel: (min, max, avg)} must be published.
+
+        Counts the outcome; call published() when it is.
+        """
+        with self._lock:
+            if self._last is None or now - self._last >= self.heartbeat:
+                return True
+            for name, band in self.deadbands.items():
+                if name not in values:
+                    continue
+                ref = self._reference.get(name)
+                low, high, avg = values[name]
+                if ref is None or high - ref > band or ref - low > band or abs(avg - ref) > band:
+                    return True
+            self.suppressed += 1
+            return False
+
+    def published(self, now, values):
+        """Make these {channel: (min, max, avg)} the reference for the next windows."""
+        with self._lock:
+            self._last = now
+            self.sent += 1
+            for name in self.deadbands:
+                if name in values:
+                    self._reference[name] = values[name][2]
+
+    def snapshot(self):
+        with self._lock:
+            return {"sent": self.sent, "suppressed": self.suppressed, "heartbeatSec": self.heartbeat}
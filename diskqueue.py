@@ -0,0 +1,434 @@
+"""Disk-backed retry queue: append-only segment files with a read cursor.
+
+The retry queue was an in-memory deque, and paho's inflight queue and
+pending_pubs are memory too: a restart, a power cut or a startup.sh
+re-clone lost everything that had not been acknowledged yet, and an
+outage longer than the deque's 5000 entries lost the oldest records.
+
+DiskQueue keeps the queued records in segment files under one directory,
+NNNNNNNN.seg, each a sequence of
+
+    crc32      uint32  of topic + payload
+    length     uint32  payload bytes
+    topic_len  uint16  topic bytes
+    topic      UTF-8
+    payload
+
+Records are appended to the newest segment; a full one (segment_bytes) is
+sealed and a new one started. Reading goes through a cursor and mmap: a
+popped payload is a memoryview of the mapped segment, so packing a batch
+reads straight from the page cache without copying each record first.
+Every popped record is handed out as a Record; done() marks it delivered,
+extend() puts it back for another attempt (it is re-read from disk, not
+written again). A sealed segment whose records are all done is deleted.
+
+The cursor file holds the low-water mark: the oldest segment and the
+offset up to which all of its records are done. After a restart reading
+resumes there, so anything that was in flight is sent again - duplicates
+are absorbed by the database's UNIQUE (deviceid, timestamp) constraint,
+as for the PUBACK timeout resends. A record torn by a power cut fails its
+CRC and the segment is cut back to the last whole record.
+
+Flash wear: records are only ever appended (never rewritten in place),
+fsync is batched (sync_bytes written or sync_seconds passed, and once per
+sealed segment), and the cursor file is rewritten at most every
+sync_seconds and only when it moved. All of it is sync_due(), left to the
+owner to call periodically (main.py once per publish cycle, off the event
+loop in the asyncio runtime) rather than run by append() in whatever
+thread queued the record - a segment sealed by append() keeps a
+duplicate descriptor for the next sync_due() to fsync. Without fsync a process crash still
+loses nothing - the data is in the page cache - only a power cut can take
+the unsynced tail. The total is capped at max_bytes, and a new segment is
+not allowed to eat into the last min_free bytes of the filesystem: beyond
+either, the oldest segment is dropped whole, like the deque dropped its
+oldest entries. If the directory cannot be written at all, records are
+kept in memory (memory_max of them) so the logger carries on as before.
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import deque
+
+RECORD = struct.Struct(">IIH")
+SUFFIX = ".seg"
+CURSOR = "cursor.json"
+
+
+def fsync_all(fds):
+    """fsync and close descriptors handed out by DiskQueue.sync_due(fsync=False)."""
+    for fd in fds:
+        try:
+            os.fsync(fd)
+        except OSError as e:
+            print(f"Could not sync retry queue segment: {e}")
+        finally:
+            os.close(fd)
+
+
+class _Segment:
+    __slots__ = ("seq", "path", "size", "records", "read", "done", "done_until", "done_ahead",
+                 "mm", "deleted")
+
+    def __init__(self, seq, path):
+        self.seq = seq
+        self.path = path
+        self.size = 0
+        self.records = 0
+        self.read = 0                # records popped through the cursor
+        self.done = 0                # records marked done
+        self.done_until = 0          # every record before this offset is done
+        self.done_ahead = {}         # offset -> end of done records past done_until
+        self.mm = None
+        self.deleted = False
+
+
+class Record:
+    """A popped record: its place in a segment, or (topic, payload) if it is only in memory."""
+    __slots__ = ("segment", "offset", "end", "data")
+
+    def __init__(self, segment, offset=0, end=0, data=None):
+        self.segment = segment
+        self.offset = offset
+        self.end = end
+        self.data = data
+
+
+class DiskQueue:
+    """FIFO of (topic, payload) records in segment files under `path`; not thread-safe."""
+
+    def __init__(self, path, segment_bytes=256 * 1024, max_bytes=8 * 1024 * 1024, min_free=1024 * 1024,
+                 sync_bytes=16 * 1024, sync_seconds=60.0, memory_max=5000):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+        self.sync_bytes = sync_bytes
+        self.sync_seconds = sync_seconds
+        self.segments = []           # oldest first; the last one is appended to
+        self.dropped = 0             # records lost to the size cap
+        self.syncs = 0
+        self.record_bytes = 0        # payload size of the last appended record
+        self._redo = deque()         # Records put back, served before the cursor
+        self._memory = deque(maxlen=memory_max)
+        self._waiting = 0            # records to be popped (unread, redo, memory)
+        self._bytes = 0
+        self._file = None
+        self._read_seg = None
+        self._read_offset = 0
+        self._unsynced = 0
+        self._unsynced_since = 0.0
+        self._sealed = []            # descriptors of sealed segments still to fsync
+        self._cursor_saved = None
+        self._cursor_time = 0.0
+        try:
+            os.makedirs(path, exist_ok=True)
+            self._recover()
+        except OSError as e:
+            print(f"Retry queue directory {path} unusable, keeping the queue in memory: {e}")
+            self._file = None
+
+    # --- startup ---------------------------------------------------------
+    def _recover(self):
+        try:
+            with open(os.path.join(self.path, CURSOR)) as f:
+                cursor = json.load(f)
+            cursor = (int(cursor["segment"]), int(cursor["offset"]))
+        except Exception:
+            cursor = None
+        names = sorted(n for n in os.listdir(self.path) if n.endswith(SUFFIX) and n[:-len(SUFFIX)].isdigit())
+        for name in names:
+            seg = _Segment(int(name[:-len(SUFFIX)]), os.path.join(self.path, name))
+            if cursor is not None and seg.seq < cursor[0]:
+                # Entirely before the low-water mark: done, only not deleted yet
+                os.remove(seg.path)
+                continue
+            start = cursor[1] if cursor is not None and seg.seq == cursor[0] else 0
+            self._scan(seg, start)
+            self.segments.append(seg)
+            self._bytes += seg.size
+            self._waiting += seg.records - seg.done
+        # Every sealed segment with nothing left to send goes - not only the
+        # front one: a torn segment cut back to nothing can sit anywhere
+        for seg in self.segments[:-1]:
+            if seg.done == seg.records:
+                self._delete(seg)
+        if self.segments:
+            front = self.segments[0]
+            front.read = front.done
+            self._read_seg, self._read_offset = front, front.done_until
+        if not self.segments or self.segments[-1].size >= self.segment_bytes:
+            self._new_segment()
+        else:
+            self._file = open(self.segments[-1].path, "ab")
+        if self._waiting:
+            print(f"Retry queue: {self._waiting} record(s) recovered from {self.path}")
+
+    def _scan(self, seg, start):
+        """Count the whole records of a segment, cut a torn tail; records before `start` are done."""
+        with open(seg.path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            crc, length, topic_len = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + topic_len + length
+            if end > len(data) or zlib.crc32(data[offset + RECORD.size:end]) != crc:
+                break
+            if offset == start:
+                seg.done_until = start
+            seg.records += 1
+            if end <= start:
+                seg.done += 1
+            offset = end
+        if offset == start:
+            seg.done_until = start
+        if offset < len(data):
+            print(f"Retry queue: {seg.path} cut from {len(data)} to {offset} bytes (torn record)")
+            with open(seg.path, "r+b") as f:
+                f.truncate(offset)
+        if seg.done_until != start:
+            # Cursor not on a record boundary of this segment: replay all of it
+            seg.done = 0
+        seg.size = offset
+
+    # --- writing ---------------------------------------------------------
+    def _new_segment(self):
+        seq = self.segments[-1].seq + 1 if self.segments else 0
+        seg = _Segment(seq, os.path.join(self.path, f"{seq:08d}{SUFFIX}"))
+        self._file = open(seg.path, "ab")
+        self.segments.append(seg)
+        if self._read_seg is None:
+            self._read_seg, self._read_offset = seg, 0
+
+    def _rotate(self):
+        active = self.segments[-1]
+        # Its fsync is left to the next sync_due(), on a duplicate descriptor
+        self._sealed.append(os.dup(self._file.fileno()))
+        self._unsynced = 0
+        self._file.close()
+        self._file = None
+        self._new_segment()
+        if active.done == active.records:
+            self._delete(active)
+
+    def _free(self):
+        st = os.statvfs(self.path)
+        return st.f_bavail * st.f_frsize
+
+    def _make_room(self, size):
+        while len(self.segments) > 1 and (self._bytes + size > self.max_bytes or
+                                          self._free() < self.min_free + size):
+            self._drop(self.segments[0])
+
+    def append(self, topic, payload):
+        """Queue one record at the back."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        topic_bytes = topic.encode()
+        header = RECORD.pack(zlib.crc32(payload, zlib.crc32(topic_bytes)), len(payload), len(topic_bytes))
+        size = RECORD.size + len(topic_bytes) + len(payload)
+        try:
+            if self._file is None:
+                self._new_segment()
+            if self.segments[-1].size and self.segments[-1].size + size > self.segment_bytes:
+                self._rotate()
+            self._make_room(size)
+            seg = self.segments[-1]
+            try:
+                self._file.write(header + topic_bytes + bytes(payload))
+                self._file.flush()
+            except OSError:
+                # Cut a partial write so the next record starts on a boundary
+                self._file.truncate(seg.size)
+                raise
+        except OSError as e:
+            if len(self._memory) == self._memory.maxlen:
+                self.dropped += 1
+            else:
+                self._waiting += 1
+            self._memory.append((topic, bytes(payload)))
+            print(f"Retry queue write failed, record held in memory: {e}")
+            return
+        if not self._unsynced:
+            self._unsynced_since = time.monotonic()
+        seg.size += size
+        seg.records += 1
+        self._bytes += size
+        self._unsynced += size
+        self._waiting += 1
+        self.record_bytes = len(payload)
+
+    def extend(self, entries):
+        """Queue (topic, payload) pairs at the back, and put popped Records back for another attempt."""
+        for entry in entries:
+            if isinstance(entry, Record):
+                if entry.segment is None or not entry.segment.deleted:
+                    self._redo.append(entry)
+                    self._waiting += 1
+            else:
+                self.append(*entry)
+
+    # --- reading ---------------------------------------------------------
+    def _map(self, seg):
+        if seg.mm is None or len(seg.mm) < seg.size:
+            # The active segment grows: map it again at its new size. Views
+            # into the old map keep that alive until they are gone.
+            with open(seg.path, "rb") as f:
+                seg.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return seg.mm
+
+    def _read(self, seg, offset):
+        mm = self._map(seg)
+        _, length, topic_len = RECORD.unpack_from(mm, offset)
+        start = offset + RECORD.size
+        topic = mm[start:start + topic_len].decode()
+        end = start + topic_len + length
+        return topic, memoryview(mm)[start + topic_len:end], end
+
+    def pop(self):
+        """(Record, topic, payload) of the next record, or None; payload is a memoryview."""
+        while self._redo:
+            record = self._redo.popleft()
+            if record.segment is None:
+                self._waiting -= 1
+                return (record,) + record.data
+            if record.segment.deleted:
+                continue
+            self._waiting -= 1
+            topic, payload, _ = self._read(record.segment, record.offset)
+            return record, topic, payload
+        if self._memory:
+            self._waiting -= 1
+            data = self._memory.popleft()
+            return (Record(None, data=data),) + data
+        seg = self._read_seg
+        while seg is not None:
+            if self._read_offset < seg.size:
+                topic, payload, end = self._read(seg, self._read_offset)
+                record = Record(seg, self._read_offset, end)
+                self._read_offset = end
+                seg.read += 1
+                self._waiting -= 1
+                return record, topic, payload
+            index = self.segments.index(seg) + 1
+            if index >= len(self.segments):
+                return None
+            seg = self._read_seg = self.segments[index]
+            self._read_offset = 0
+        return None
+
+    def unpop(self, record):
+        """Return a just popped Record to the front."""
+        self._redo.appendleft(record)
+        self._waiting += 1
+
+    def done(self, entries):
+        """Mark popped Records delivered; other entries are ignored."""
+        for record in entries:
+            if not isinstance(record, Record) or record.segment is None or record.segment.deleted:
+                continue
+            seg = record.segment
+            if record.end <= seg.done_until or record.offset in seg.done_ahead:
+                continue
+            seg.done += 1
+            if record.offset == seg.done_until:
+                seg.done_until = record.end
+                while seg.done_until in seg.done_ahead:
+                    seg.done_until = seg.done_ahead.pop(seg.done_until)
+            else:
+                seg.done_ahead[record.offset] = record.end
+            if seg is not self.segments[-1] and seg.done == seg.records:
+                self._delete(seg)
+
+    # --- removing --------------------------------------------------------
+    def _delete(self, seg):
+        seg.deleted = True
+        if seg.mm is not None:
+            try:
+                seg.mm.close()
+            except BufferError:
+                pass                 # a payload view is still out; unmapped when it goes
+            seg.mm = None
+        try:
+            os.remove(seg.path)
+        except OSError as e:
+            print(f"Could not remove retry segment {seg.path}: {e}")
+        if self._read_seg is seg:
+            index = self.segments.index(seg) + 1
+            self._read_seg = self.segments[index] if index < len(self.segments) else None
+            self._read_offset = 0
+        self.segments.remove(seg)
+        self._bytes -= seg.size
+
+    def _drop(self, seg):
+        """Drop the oldest segment whole to stay within the caps."""
+        redo = [r for r in self._redo if r.segment is seg]
+        if redo:
+            self._redo = deque(r for r in self._redo if r.segment is not seg)
+        self._waiting -= seg.records - seg.read + len(redo)
+        lost = seg.records - seg.done
+        self.dropped += lost
+        print(f"Retry queue over its cap: dropped {lost} oldest record(s)")
+        self._delete(seg)
+
+    # --- housekeeping ----------------------------------------------------
+    def _take_unsynced(self, active):
+        """Descriptors to fsync: the sealed segments', and the active one's if `active`."""
+        fds, self._sealed = self._sealed, []
+        if active and self._unsynced and self._file is not None:
+            fds.append(os.dup(self._file.fileno()))
+            self._unsynced = 0
+        self.syncs += len(fds)
+        return fds
+
+    def sync(self):
+        """fsync what was appended and save the cursor if it moved."""
+        fsync_all(self._take_unsynced(True))
+        self._save_cursor()
+
+    def sync_due(self, fsync=True):
+        """sync() if sync_bytes were appended or sync_seconds have passed since.
+
+        Segments sealed since the last call are fsynced in any case. With
+        fsync=False the fsyncs are the caller's: returns duplicate
+        descriptors for fsync_all(), so a caller holding a lock around the
+        queue can release it first. The cursor is saved either way.
+        """
+        now = time.monotonic()
+        due = bool(self._unsynced) and (self._unsynced >= self.sync_bytes or
+                                        now - self._unsynced_since >= self.sync_seconds)
+        fds = self._take_unsynced(due)
+        if due or now - self._cursor_time >= self.sync_seconds:
+            self._save_cursor()
+        if fsync:
+            fsync_all(fds)
+            return []
+        return fds
+
+    def _save_cursor(self):
+        if not self.segments:
+            return
+        front = self.segments[0]
+        cursor = (front.seq, front.done_until)
+        if cursor == self._cursor_saved:
+            return
+        self._cursor_time = time.monotonic()
+        tmp = os.path.join(self.path, CURSOR + ".tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"segment": cursor[0], "offset": cursor[1]}, f)
+            # No fsync: a lost cursor update only means records sent again
+            os.replace(tmp, os.path.join(self.path, CURSOR))
+            self._cursor_saved = cursor
+        except OSError as e:
+            print(f"Could not save retry queue cursor: {e}")
+
+    def __len__(self):
+        return self._waiting
+
+    def snapshot(self):
+        return {"records": self._waiting, "bytes": self._bytes, "segments": len(self.segments),
+                "inMemory": len(self._memory), "dropped": self.dropped, "syncs": self.syncs}
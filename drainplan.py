@@ -0,0 +1,81 @@
+"""Batch size and compression level for draining the retry backlog.
+
+flush_retry_queue used one fixed batch size. The right size depends on
+the link: a batch should be big enough that the per-message round trip
+does not dominate, and small enough to be acknowledged well within the
+PUBACK timeout, after which all of its records would be sent again. The
+right zlib level depends on it too: on a slow cellular link every byte
+saved is worth the CPU, on a fast one level 1 gets most of the gain.
+
+DrainPlanner estimates the link throughput from the PUBACKs of tracked
+publishes - the delivery rate, bytes acknowledged over the time since the
+previous acknowledgement or the send, whichever is later, so back-to-back
+batches in flight measure the pipe rather than the round trip - and the
+compression ratio from the batches it packed, both as moving averages.
+plan() turns queue depth and those estimates into a batch size and level:
+as many records as the link moves in `target` seconds, compressed.
+"""
+
+import threading
+
+
+class DrainPlanner:
+    """Chooses (records per batch, zlib level or None) for a backlog of a given depth.
+
+    min_backlog: depth from which records are batched at all;
+    min_records/max_records: bounds of a batch; target: seconds one batch
+    should take on the link; rate: assumed bytes/s until PUBACKs have been
+    measured; slow/fast: bytes/s below which level 9 and from which level
+    1 are used (6 in between). compress: whether batches are compressed.
+    """
+
+    def __init__(self, min_backlog=30, min_records=10, max_records=300, target=5.0,
+                 rate=2000.0, slow=16000.0, fast=128000.0, alpha=0.2, compress=False):
+        self.min_backlog = min_backlog
+        self.min_records = min_records
+        self.max_records = max_records
+        self.target = target
+        self.slow = slow
+        self.fast = fast
+        self.alpha = alpha
+        self.compress = compress
+        self.rate = rate
+        self.ratio = 0.5
+        self._last_ack = 0.0
+        self._plan = (1, None)
+        self._lock = threading.Lock()
+
+    def acked(self, nbytes, sent_at, now):
+        """A tracked publish of `nbytes` sent at `sent_at` was acknowledged at `now`."""
+        with self._lock:
+            elapsed = now - max(sent_at, self._last_ack)
+            self._last_ack = now
+            if elapsed > 0:
+                self.rate += self.alpha * (nbytes / elapsed - self.rate)
+
+    def packed(self, raw, compressed):
+        """A batch of `raw` record bytes went out as `compressed` bytes."""
+        with self._lock:
+            self.ratio += self.alpha * (compressed / raw - self.ratio)
+
+    def plan(self, depth, record_bytes):
+        """(records per batch, zlib level or None) for `depth` queued records of about `record_bytes`."""
+        with self._lock:
+            if depth < self.min_backlog:
+                self._plan = (1, None)
+                return self._plan
+            level = None
+            per_record = record_bytes
+            if self.compress:
+                per_record *= self.ratio
+                level = 9 if self.rate < self.slow else 1 if self.rate >= self.fast else 6
+            records = int(self.rate * self.target / max(1.0, per_record))
+            records = max(self.min_records, min(self.max_records, records, depth))
+            self._plan = (records, level)
+            return self._plan
+
+    def snapshot(self):
+        with self._lock:
+            records, level = self._plan
+            return {"rate": round(self.rate), "ratio": round(self.ratio, 3),
+                    "records": records, "level": level, "compress": self.compress}
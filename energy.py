@@ -0,0 +1,107 @@
+"""Per-interval energy from the meter's counters, with persistent baseline.
+
+The powerlog carries the absolute consumed/delivered energy counters,
+scaled by the CT ratio and truncated to 32 bits, and the backend
+differenced consecutive rows. One lost row merged two intervals, a CT
+ratio change made one delta meaningless, and a counter wrap a huge negative.
+
+EnergyTracker does the differencing on the device, against the raw counter
+values it last published. update() only computes: the reading becomes
+the baseline with commit(), once the powerlog carrying its deltas is
+queued or published - a cycle that fails after update() leaves the old
+baseline, and the next delta covers both intervals instead of losing one.
+The baseline is kept in a small JSON file, rewritten on every commit so
+it always matches the last published reading, and a restart continues
+from there without double-counting anything. The write is atomic (temp
+file, rename) but not fsynced: a few dozen bytes to the page cache per
+powerlog; only a power cut can roll the file back to an older baseline
+(the next delta then overlaps rows already sent, as its `since` shows),
+or lose it. Per update it reports the delta of each counter since
+the previous reading together with flags saying what it had to handle:
+
+  BASELINE     no usable previous reading (first run, other meter): delta 0
+  CT_CHANGED   the CT ratio differs from the previous reading; the delta
+               straddles two scalings, so it is 0 and a new baseline starts
+  WRAPPED      a counter passed its modulus (raw u32 on the EMDX) and the
+               delta was taken across the wrap
+  RESET        a counter went backwards without a plausible wrap (meter
+               reset or replaced counter): delta 0, new baseline
+"""
+
+import json
+import os
+
+BASELINE = 0x01
+CT_CHANGED = 0x02
+WRAPPED = 0x04
+RESET = 0x08
+
+
+class EnergyTracker:
+    def __init__(self, path):
+        self.path = path
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Energy baseline {self.path} unreadable, starting over: {e}")
+            return None
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        tmp = self.path + ".tmp"
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(self.state, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            # The baseline is still right in memory; only a restart before
+            # the next successful save would difference against an older one
+            print(f"Could not save energy baseline {self.path}: {e}")
+
+    def update(self, meter, ct_ratio, raw, now, scale=lambda value: value, modulus=None):
+        """Difference a new reading; returns (flags, previous reading time or None, {name: delta}, reading).
+
+        raw: {counter name: raw counter value}; scale converts a raw delta
+        into the payload's energy unit (the CT scaling); modulus is the raw
+        counter range if it wraps (2**32 for a u32 register), None if not.
+        Pass `reading` to commit() once the deltas are on their way.
+        """
+        prev = self.state
+        flags = 0
+        deltas = dict.fromkeys(raw, 0)
+        since = None
+        if prev is None or prev.get("meter") != meter or set(prev.get("raw", {})) != set(raw):
+            flags |= BASELINE
+        elif prev.get("ct") != ct_ratio:
+            flags |= CT_CHANGED
+            since = prev["time"]
+        else:
+            since = prev["time"]
+            for name, value in raw.items():
+                last = prev["raw"][name]
+                d = value - last
+                if d < 0:
+                    if modulus is not None and last > modulus / 2 and value < modulus / 2:
+                        d += modulus
+                        flags |= WRAPPED
+                    else:
+                        flags |= RESET
+                        d = 0
+                deltas[name] = scale(d)
+            if flags & RESET:
+                deltas = dict.fromkeys(raw, 0)
+        reading = {"meter": meter, "ct": ct_ratio, "time": now, "raw": dict(raw)}
+        return flags, since, deltas, reading
+
+    def commit(self, reading):
+        """Make a reading returned by update() the baseline, and save it."""
+        self.state = reading
+        self._save()
@@ -0,0 +1,156 @@
+"""Sag/swell and over-current detection on the poll stream.
+
+The poller sees every voltage/current sample, but all that survives a
+window is min/max/avg: a 400 ms sag to 180 V shows up as a low minimum with
+no shape, no duration and no telling which came first on which phase.
+Raising the send rate to see that would cost bandwidth all the time for
+something that happens a few times a month.
+
+EventDetector looks at every sample instead. A Rule is one threshold on one
+channel (sag or swell on a phase voltage, over-current on a phase current)
+with hysteresis: it triggers when the value crosses `level` and re-arms
+only once it is back past `clear`, so a value hovering at the threshold
+does not fire on every other sample. A ring buffer keeps the last `pre`
+samples; on a trigger those plus the next `post` samples (further triggers
+meanwhile join the same event) go out as one compact event message on a
+separate topic.
+
+Memory is fixed: the ring buffer and at most one capture of pre + post + 1
+samples.
+"""
+
+from collections import deque
+
+SAG = "sag"
+SWELL = "swell"
+OVERCURRENT = "overcurrent"
+PHASES = ("L1", "L2", "L3")
+
+
+class Rule:
+    __slots__ = ("kind", "channel", "phase", "level", "clear", "above", "active", "extreme")
+
+    def __init__(self, kind, channel, phase, level, hysteresis, above):
+        self.kind = kind
+        self.channel = channel      # index into the sample
+        self.phase = phase
+        self.level = level
+        self.clear = level - hysteresis if above else level + hysteresis
+        self.above = above          # triggers above level (swell, over-current) or below (sag)
+        self.active = False
+        self.extreme = None         # furthest value since the trigger
+
+    def check(self, value):
+        """Feed one value; True if this value starts a new event."""
+        if self.active:
+            if (value < self.clear) if self.above else (value > self.clear):
+                self.active = False
+            elif (value > self.extreme) if self.above else (value < self.extreme):
+                self.extreme = value
+            return False
+        if (value > self.level) if self.above else (value < self.level):
+            self.active = True
+            self.extreme = value
+            return True
+        return False
+
+
+def _per_phase(value):
+    if isinstance(value, (list, tuple)):
+        if len(value) != len(PHASES):
+            raise ValueError(f"per-phase setting needs {len(PHASES)} values, got {len(value)}")
+        return list(value)
+    return [value] * len(PHASES)
+
+
+def build_rules(nominalV=230.0, sagPct=90.0, swellPct=110.0, overCurrentA=None, hysteresisPct=2.0):
+    """Rules for the POWER_CHANNELS sample (V L1-L3, I L1-L3) from config settings.
+
+    Every setting is one number for all phases or a list of three. Sag and
+    swell are percentages of the nominal voltage, the voltage hysteresis a
+    percentage of it too; over-current is in A (None: off) with a hysteresis
+    of hysteresisPct of the limit. A percentage of None switches that
+    rule off.
+    """
+    nominal = _per_phase(nominalV)
+    hysteresis = _per_phase(hysteresisPct)
+    rules = []
+    for i, phase in enumerate(PHASES):
+        band = nominal[i] * hysteresis[i] / 100.0
+        sag = _per_phase(sagPct)[i]
+        swell = _per_phase(swellPct)[i]
+        limit = _per_phase(overCurrentA)[i]
+        if sag is not None:
+            rules.append(Rule(SAG, i, phase, nominal[i] * sag / 100.0, band, above=False))
+        if swell is not None:
+            rules.append(Rule(SWELL, i, phase, nominal[i] * swell / 100.0, band, above=True))
+        if limit is not None:
+            rules.append(Rule(OVERCURRENT, 3 + i, phase, float(limit), limit * hysteresis[i] / 100.0, above=True))
+    return rules
+
+
+class EventDetector:
+    """Threshold rules plus a pre-trigger ring buffer; emit(message) per event.
+
+    add() is called by one producer (the poller) only.
+    """
+
+    def __init__(self, rules, pre=10, post=10, emit=None):
+        self.rules = rules
+        self.post = post
+        self.emit = emit
+        self.events = 0
+        self._ring = deque(maxlen=pre)
+        self._capture = None        # (triggers, samples, post samples still to come)
+
+    def add(self, timestamp, sample):
+        triggered = [rule for rule in self.rules if rule.check(sample[rule.channel])]
+        entry = (timestamp, sample)
+        if self._capture is not None:
+            triggers, samples, remaining = self._capture
+            triggers.extend((timestamp, rule) for rule in triggered)
+            samples.append(entry)
+            if remaining <= 1:
+                self._finish()
+            else:
+                self._capture = (triggers, samples, remaining - 1)
+        elif triggered:
+            samples = list(self._ring)
+            samples.append(entry)
+            self._capture = ([(timestamp, rule) for rule in triggered], samples, self.post)
+            if self.post <= 0:
+                self._finish()
+        self._ring.append(entry)
+
+    def _finish(self):
+        triggers, samples, _ = self._capture
+        self._capture = None
+        self.events += 1
+        if self.emit is not None:
+            self.emit(self.message(triggers, samples))
+
+    @staticmethod
+    def message(triggers, samples):
+        """Compact event message: triggers plus samples relative to the first one.
+
+        samples: [ms after t0, V L1, V L2, V L3 (0.1 V), I L1, I L2, I L3 (0.01 A)]
+        extreme: the furthest value seen until the message went out;
+        cleared: whether the rule had re-armed by then.
+        """
+        t0 = samples[0][0]
+        return {
+            "timestamp": round(triggers[0][0], 3),
+            "t0": round(t0, 3),
+            "triggers": [{
+                "type": rule.kind,
+                "phase": rule.phase,
+                "atMs": round((at - t0) * 1000),
+                "threshold": round(rule.level, 2),
+                "extreme": round(rule.extreme, 2),
+                "cleared": not rule.active,
+            } for at, rule in triggers],
+            "samples": [[round((t - t0) * 1000)]
+                        + [round(v, 1) for v in sample[:3]]
+                        + [round(i, 2) for i in sample[3:6]]
+                        for t, sample in samples],
+        }
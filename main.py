@@ -1,21 +1,61 @@
+import sys
 import json
 import time
 import struct
 import random
+import asyncio
 import threading
-from collections import deque
-from pymodbus.client.serial import ModbusSerialClient
-from pymodbus.client.tcp import ModbusTcpClient
+from pymodbus.client.serial import ModbusSerialClient, AsyncModbusSerialClient
+from pymodbus.client.tcp import ModbusTcpClient, AsyncModbusTcpClient
 from paho.mqtt import client as mqtt_client
 import uuid
+from regmap import EMDX_REGISTERS, RMU_REGISTERS, read_blocks, read_blocks_async
+from regcache import RegisterCache
+from aio_runtime import BusOwner, periodic
+from busscheduler import (BusScheduler, DeadlineExpired, PRIO_POLL, PRIO_PUBLISH,
+                          PRIO_TELEMETRY, PRIO_PROVISIONING)
+from bustiming import AdaptiveTimeouts, transaction_shape
+from breaker import BreakerBoard, CLOSED, HALF_OPEN
+from rtufast import RtuFastPath, ExactLengthSerialClient
+from busstats import BusStats
+from aggregator import WindowAggregator
+from quantities import (QUANTITY_IDS, EMDX_QUANTITIES, RMU_QUANTITIES, blocks_for, check_names,
+                        decode as decode_quantities)
+from pacing import RateStats, run_periodic
+from events import EventDetector, build_rules
+from deadband import DeadbandFilter
+from rollup import Rollups
+from energy import EnergyTracker
+from regdecode import BlockDecoder
+from drainplan import DrainPlanner
+from diskqueue import DiskQueue, fsync_all
+import powerlog_codec
+from powerlog_v2 import PowerlogV2Encoder, DEFAULT_KEYFRAME
+from functools import partial
 #l Load credentials
 json_file_path = r".secrets/credentials.json"
 with open(json_file_path, "r") as f:
     credentials = json.load(f)
 
+# Runtime selection: the default threaded runtime, or the asyncio runtime
+# (one event loop with a bus-owner task per transport, see aio_runtime.py)
+# when started as `python main.py --asyncio`.
+ASYNC_RUNTIME = "--asyncio" in sys.argv
+
+# Fixed register reads can bypass the pymodbus request/response machinery
+# with precomputed frames and exact-length reads (rtufast.py). Threaded
+# runtime only; enable with `python main.py --rtu-fast`.
+RTU_FAST_PATH = "--rtu-fast" in sys.argv
+
+# RTU responses end on their known length instead of on inter-frame silence
+# (rtufast.ExactLengthSerialClient). `--silence-framing` restores the stock
+# pymodbus framing, e.g. to compare mbRead in the modemlog before/after.
+RTU_EXACT_FRAMING = "--silence-framing" not in sys.argv
+
 # MODBUS
-# Set up modbus RTU for production use
-modbusclient = ModbusSerialClient(
+# Set up modbus RTU for production use. The settings are shared with the
+# AsyncModbusSerialClient of the asyncio runtime.
+RTU_SETTINGS = dict(
     port='/dev/ttyHS0', # for production use /dev/ttyHS0, local /dev/tty.usbserial-FTWJW5L4
     stopbits=1,
     bytesize=8,
@@ -23,19 +63,37 @@ modbusclient = ModbusSerialClient(
     baudrate=19200,
     timeout=0.3 
 )
+# Response timeouts are learned per slave and function code from observed
+# latencies (bustiming.py) and kept within these bounds; the configured
+# timeout above is the ceiling and the value used until enough answers have
+# been seen. Lower the floor only if every meter on the bus is known-fast.
+RTU_TIMEOUT_FLOOR = 0.05
+RTU_TIMEOUT_CEILING = RTU_SETTINGS["timeout"]
 # Set up modbus TCP
-tcpClient = ModbusTcpClient(
+TCP_SETTINGS = dict(
     host="localhost",  #localhost for production use
     port=502
 )
+modbusclient = (ExactLengthSerialClient if RTU_EXACT_FRAMING else ModbusSerialClient)(**RTU_SETTINGS)
+rtu_fast = RtuFastPath(modbusclient)
+tcpClient = ModbusTcpClient(**TCP_SETTINGS)
 
 # pymodbus clients are NOT thread-safe: only one request/response frame may be on
 # the wire at a time. These locks serialise every access to the shared transports
 # so the polling thread and the publish threads can never interleave frames.
-modbus_lock = threading.Lock()  # protects the RTU client (modbusclient)
+# The RTU client is guarded by bus_scheduler instead of a plain lock: same
+# mutual exclusion, but the bus is handed out by priority class (poll first,
+# provisioning last) and a queued request can expire - see busscheduler.py.
+bus_scheduler = BusScheduler()  # protects the RTU client (modbusclient)
+rtu_timeouts = AdaptiveTimeouts(RTU_SETTINGS["baudrate"], floor=RTU_TIMEOUT_FLOOR,
+                                ceiling=RTU_TIMEOUT_CEILING)
+# Per-slave circuit breakers (breaker.py): 3 unanswered reads in a row stop
+# the poll/publish jobs from talking to that slave; a single serial-register
+# probe is sent after 1s, 2s, 4s, ... up to a minute until it answers again.
+rtu_breakers = BreakerBoard(failure_threshold=3, base_delay=1.0, max_delay=60.0)
 tcp_lock = threading.Lock()     # protects the TCP client (tcpClient)
 agg_lock = threading.Lock()     # protects the voltage/current aggregation state
-stats_lock = threading.Lock()   # protects modbus_error_count
+stats_lock = threading.Lock()   # protects modbus_error_count and mb_read_time
 
 # Cumulative count of failed Modbus RTU reads since script start. Sent along in
 # every modemlog message so RS485 health is visible in the database without a
@@ -44,30 +102,181 @@ stats_lock = threading.Lock()   # protects modbus_error_count
 # per-interval delta is trivially computed backend-side.
 modbus_error_count = 0
 
+# Wall time of the RTU read transactions themselves (bus held, queue wait
+# excluded): [count, total seconds, max seconds]. Reported with the framing
+# in use so the effect of exact-length framing shows up per site.
+mb_read_time = [0, 0.0, 0.0]
+RTU_FRAMING = "fast" if RTU_FAST_PATH else "exact" if RTU_EXACT_FRAMING else "silence"
+
+def bus_block_label(slave, address, count):
+    """Histogram key of an RTU transaction: slave and the register blocks it covers."""
+    regmap = RMU_REGISTERS if slave == 49 else EMDX_REGISTERS
+    return f"{slave} {regmap.describe(address, count)}"
+
+# Latency histograms per slave/block, bytes on the wire, duty cycle and error
+# classes of the RTU bus (busstats.py). Compact summary in every modemlog as
+# "bus"; the full dump is published on request via the config topic.
+bus_stats = BusStats(label=bus_block_label)
+rtu_fast.frame_hook = bus_stats.frame
+if RTU_EXACT_FRAMING:
+    modbusclient.frame_hook = bus_stats.frame
+
+def record_rtu_transaction(method, args, kwargs, elapsed, result, framed=False):
+    """Feed one executed RTU call into bus_stats (threaded and asyncio runtime).
+
+    framed: the transport reported the frames of this call itself (bytes and
+    frame-level errors), so only latency and busy time are added here.
+    """
+    shape = transaction_shape(method, args, kwargs)
+    if shape is None:
+        return
+    fc, tx, rx = shape
+    if result is None or (result.isError() and getattr(result, "exception_code", None) is None):
+        outcome = "timeout"
+    elif result.isError():
+        outcome = "exception"
+    else:
+        outcome = None
+    address = kwargs.get("address", args[0] if args else 0)
+    count = kwargs.get("count", args[1] if len(args) > 1 else 1) if fc == 3 else 1
+    exception_code = getattr(result, "exception_code", None) if outcome == "exception" else None
+    if framed:
+        tx = rx = exception_code = None
+    bus_stats.transaction(kwargs.get("slave", 1), address, count, elapsed, outcome, tx, rx, exception_code)
+
 def count_modbus_error():
     global modbus_error_count
     with stats_lock:
         modbus_error_count += 1
 
-def mb_read(*args, **kwargs):
-    """Thread-safe read on the RTU client.
+def rtu_call(method, *args, **kwargs):
+    """One call on the RTU client with the adaptive timeout; the caller holds the bus."""
+    context = rtu_timeouts.before(modbusclient, method, args, kwargs)
+    target = rtu_fast if RTU_FAST_PATH and method == "read_holding_registers" else modbusclient
+    result = None
+    started = time.perf_counter()
+    try:
+        result = getattr(target, method)(*args, **kwargs)
+        return result
+    finally:
+        rtu_timeouts.after(context, result)
+        elapsed = time.perf_counter() - started
+        record_rtu_transaction(method, args, kwargs, elapsed, result,
+                               framed=RTU_EXACT_FRAMING or target is rtu_fast)
+        if method == "read_holding_registers":
+            with stats_lock:
+                mb_read_time[0] += 1
+                mb_read_time[1] += elapsed
+                mb_read_time[2] = max(mb_read_time[2], elapsed)
+
+def mb_read(*args, priority=PRIO_PUBLISH, deadline=None, **kwargs):
+    """Thread-safe read on the RTU client, scheduled in the given priority class.
 
     Centrally counts every failed read: the error branches after each mb_read
     call only print() and return, which is invisible remotely - this counter
-    is what makes those silent skips show up in the modemlog."""
-    with modbus_lock:
-        result = modbusclient.read_holding_registers(*args, **kwargs)
+    is what makes those silent skips show up in the modemlog.
+
+    A read the slave did not answer (timeout, garbled frame) also drops
+    everything cached for that slave: a meter that stops answering may come
+    back as a different meter, and its cached serial/CT ratio must not
+    outlive that. A Modbus exception response is an answer - the meter is
+    there, it just rejects that register - so it leaves the cache alone.
+    Neither does a request that expired in the scheduler queue (DeadlineExpired):
+    it never reached the bus."""
     try:
-        if result.isError():
-            count_modbus_error()
+        result = bus_scheduler.submit(priority, rtu_call, "read_holding_registers",
+                                      *args, deadline=deadline, **kwargs)
+    except DeadlineExpired:
+        raise
     except Exception:
-        pass
+        register_cache.invalidate(kwargs.get("slave"))
+        rtu_breakers.failure(kwargs.get("slave"))
+        raise
+    check_read_result(result, kwargs.get("slave"))
     return result
 
-def mb_write(*args, **kwargs):
-    """Thread-safe write on the RTU client."""
-    with modbus_lock:
-        return modbusclient.write_registers(*args, **kwargs)
+def check_read_result(result, slave):
+    """Error and breaker bookkeeping after every RTU read (threaded and asyncio runtime)."""
+    try:
+        if result.isError():
+            count_modbus_error()
+            if getattr(result, "exception_code", None) is None:
+                register_cache.invalidate(slave)
+                rtu_breakers.failure(slave)
+                return
+        rtu_breakers.success(slave)
+    except AttributeError as e:
+        # Not a pymodbus response: nothing to count or feed the breaker
+        print(f"Unexpected read result from slave {slave}: {e}")
+
+def rtu_slave_ready(regmap, slave):
+    """Circuit-breaker gate in front of the RTU poll and publish jobs.
+
+    False while the slave's breaker is open. When a probe is due, this
+    caller sends it - one read of the serial register, whose outcome mb_read
+    feeds back into the breaker - and goes ahead only if it was answered.
+    """
+    verdict = rtu_breakers.get(slave).acquire()
+    if verdict == HALF_OPEN:
+        address, count = regmap.blocks["serial"]
+        try:
+            mb_read(address, count=count, slave=slave, priority=PRIO_TELEMETRY)
+        except Exception as e:
+            # mb_read has already fed the failure to the breaker
+            print(f"Breaker probe of slave {slave} failed: {e}")
+        return rtu_breakers.get(slave).state == CLOSED
+    return verdict == CLOSED
+
+# Register blocks per job. The planner in regmap.py merges each list into as
+# few contiguous reads as the device allows.
+EMDX_POLL_BLOCKS = ["voltage_current"]
+EMDX_PUBLISH_BLOCKS = ["serial", "voltage_current", "power", "frequency", "consumed_energy",
+                       "delivered_energy", "power_factor", "ct_ratio", "operating_hours"]
+RMU_POLL_BLOCKS = ["voltage", "current"]
+RMU_PUBLISH_BLOCKS = ["main", "ct_ratio", "serial", "operating_hours"]
+
+# Snapshot cache shared between the poller and publishPowerlog. The poller
+# stores every voltage/current read with POLL_SNAPSHOT_TTL; publishPowerlog
+# takes that block from the cache while it is fresh instead of reading the
+# same 14 registers again a moment later. ~5 polls per second, so a snapshot
+# older than 1s means the poller is stuck or failing - then we read ourselves.
+#
+# The same cache keeps the static blocks of each register map (serial number,
+# CT ratio) for STATIC_REGISTER_TTL: primed at device detection, dropped on
+# reconnect, read errors and provisioning writes, and re-read lazily by the
+# next publish once the TTL runs out. Saves two frames on every publish.
+POLL_SNAPSHOT_TTL = 1.0
+STATIC_REGISTER_TTL = 3600
+EMDX_REGISTERS.static_ttl = STATIC_REGISTER_TTL
+RMU_REGISTERS.static_ttl = STATIC_REGISTER_TTL
+register_cache = RegisterCache()
+
+def prime_static_registers():
+    """Read the static blocks of the connected device into the cache."""
+    if emdx_connected:
+        regmap, slaveid = EMDX_REGISTERS, 1
+    elif rmu_connected:
+        regmap, slaveid = RMU_REGISTERS, 49
+    else:
+        return
+    try:
+        blocks, error = read_blocks(partial(mb_read, priority=PRIO_TELEMETRY), regmap,
+                                    sorted(regmap.static), slaveid, cache=register_cache)
+        if error is not None:
+            print(f"Could not prime static {regmap.name} registers: {error}")
+    except Exception as e:
+        print(f"Could not prime static {regmap.name} registers: {e}")
+
+def mb_write(*args, priority=PRIO_PROVISIONING, **kwargs):
+    """Thread-safe write on the RTU client, by default in the provisioning class.
+
+    Every write is provisioning (emdx_insertStandardSettings, the serial
+    randomiser, rmu_update_ct_settings) and may change configuration
+    registers, so the slave's cached blocks are dropped whatever the outcome."""
+    try:
+        return bus_scheduler.submit(priority, rtu_call, "write_registers", *args, **kwargs)
+    finally:
+        register_cache.invalidate(kwargs.get("slave"))
 
 routerSerial = "0000000000000000"
 # These topics will be properly defined after getting routerSerial
@@ -97,13 +306,49 @@ MAX_QUEUED_MESSAGES = 5000       # cap paho's in-memory QoS1 queue (~14h of powe
 # the payload at build time, so a message delivered several cycles late still
 # carries its original time.
 #
-# maxlen bounds memory just like paho's own cap: on overflow the OLDEST entries
-# are dropped (deque behaviour), keeping the most recent measurements. Entries
-# are (topic, payload) tuples - the topic carries the per-message device_serial.
-RETRY_QUEUE_MAX = 5000           # ~14h at 10s interval; 158 bytes each -> trivial RAM
-retry_queue = deque(maxlen=RETRY_QUEUE_MAX)
+# The queue lives on disk (diskqueue.py: append-only segment files, batched
+# fsync, a read cursor), so it survives restarts, power cuts and client
+# rebuilds, and RAM stays flat however long the outage. Records only reach
+# the disk once a publish failed or timed out - with a healthy link nothing
+# is written, which is most of the flash-wear policy. Popped records stay on
+# disk until their PUBACK (DiskQueue.done); a timeout puts them back. The
+# directory is relative to the working directory, which startup.sh keeps
+# outside the re-cloned repo. RETRY_QUEUE_MAX_BYTES bounds it like the old
+# deque's maxlen: beyond it the OLDEST records are dropped, a segment at a
+# time. Records are (topic, payload) - the topic carries the per-message
+# device_serial.
+RETRY_QUEUE_DIR = ".state/retry"
+RETRY_QUEUE_MAX_BYTES = 8 * 1024 * 1024  # ~4 days at 10s interval (~200 bytes per record)
+RETRY_QUEUE_MIN_FREE = 1024 * 1024       # never fill the filesystem beyond this
+retry_queue = DiskQueue(RETRY_QUEUE_DIR, max_bytes=RETRY_QUEUE_MAX_BYTES, min_free=RETRY_QUEUE_MIN_FREE)
 retry_lock = threading.Lock()
 
+# --- Batched backlog drain ------------------------------------------------
+# After a long outage the queue holds thousands of powerlogs, and draining
+# them one QoS1 message each is bound by round trips, not bytes: every
+# record pays its own MQTT header, topic and PUBACK over a link that is
+# often barely back. Once the backlog is deep, flush_retry_queue packs
+# consecutive powerlogs of one meter into a single batch message
+# (powerlog_codec.pack_batch) on <device>/batch instead of <device>/data.
+# The records inside are the original frames, timestamps included, so the
+# backend unpacks the batch and ingests them exactly as if they had come
+# one by one. A batch is tracked as ONE unit in pending_pubs: a missing
+# PUBACK puts all of its records back in the retry queue (as single
+# records, they are re-batched on the next flush if still deep).
+#
+# drain_planner (drainplan.py) sizes the batches - what the link moved per
+# second, measured from the PUBACKs, times BATCH_TARGET_SECONDS - and, once
+# the backend has confirmed it decodes them with {"compressBacklog": true}
+# on the config topic, picks the zlib level of compressed batches
+# (powerlog_codec.pack_batch): 9 on a slow link, 1 on a fast one.
+BATCH_MIN_BACKLOG = 30           # queue depth from which the drain batches (5 min at 10s)
+BATCH_MIN_RECORDS = 10           # bounds of one batch message
+BATCH_MAX_RECORDS = 300          # (~50 kB uncompressed)
+BATCH_TARGET_SECONDS = 5         # a batch should take about this long on the link
+drain_planner = DrainPlanner(min_backlog=BATCH_MIN_BACKLOG, min_records=BATCH_MIN_RECORDS,
+                             max_records=BATCH_MAX_RECORDS, target=BATCH_TARGET_SECONDS)
+batches_sent = 0                 # cumulative batch messages, reported in modemlog
+
 # --- PUBACK tracking (the "soft rejection" fix) ---------------------------
 # Field data (7405: 209/761 rows missing while retry_queue stayed 0) proved the
 # rc check alone is NOT enough: in the window before paho detects a silently
@@ -113,49 +358,45 @@ retry_lock = threading.Lock()
 # QoS1 message is the PUBACK, surfaced via the on_publish callback.
 #
 # Mechanism: every tracked publish registers its mid in pending_pubs together
-# with (topic, payload, time). on_publish removes it on confirmation. A sweep
+# with the retry-queue entries it carries and the time. on_publish removes it on confirmation. A sweep
 # each powerLoop cycle moves entries older than PENDING_TIMEOUT into the retry
 # queue - unconfirmed means presumed lost, so WE resend. If paho's own retry
 # delivers it after all, the resend becomes a duplicate, which the database
 # absorbs via the UNIQUE (deviceid, timestamp) constraint + ON CONFLICT DO
 # NOTHING. That constraint is a hard prerequisite for this design.
 PENDING_TIMEOUT = 30             # seconds without PUBACK before we presume loss
-pending_pubs = {}                # mid -> (topic, payload, queued_at)
+pending_pubs = {}                # mid -> (entries, queued_at, bytes); entries are
+                                 # the records the message carries: itself as
+                                 # (topic, payload), or retry-queue Records
+# Held across client.publish() and the mid registration, so on_publish (on
+# the network thread) cannot see a PUBACK before its mid is registered.
 pending_lock = threading.Lock()
-# on_publish can theoretically fire before the publisher registers the mid
-# (callback runs on the network thread). Confirmed-but-unknown mids land here;
-# bounded because on_publish also fires for untracked publishes (logMQTT,
-# modemlog) whose mids we must not accumulate forever.
-early_acks = deque(maxlen=256)
 publish_timeouts = 0             # cumulative PUBACK timeouts, reported in modemlog
 
-def publish_tracked(client, topic, payload):
+def publish_tracked(client, topic, payload, entries=None):
     """Publish a powerlog message with full delivery tracking, non-blocking.
 
     Hard rejection (rc != SUCCESS, e.g. NO_CONN): straight into the retry
     queue - paho did not accept it. Soft path (rc == SUCCESS): register the
     mid and let on_publish / the timeout sweep decide whether it truly landed.
+    entries: the retry-queue Records the message carries (one, or all of a
+    batch) - those, not the message, are what goes back to the retry queue.
     Returns True if the message is in flight, False if it went to the queue.
     """
+    if entries is None:
+        entries = ((topic, payload),)
     with pending_lock:
         try:
             result = client.publish(topic, payload, qos=1)
         except Exception as e:
             print(f"publish raised: {e}")
-            queue_failed_publish(topic, payload)
+            queue_failed_publish(entries)
             return False
         if result.rc != mqtt_client.MQTT_ERR_SUCCESS:
             # Hard rejection: paho did NOT queue this (e.g. MQTT_ERR_NO_CONN).
-            queue_failed_publish(topic, payload)
+            queue_failed_publish(entries)
             return False
-        if result.mid in early_acks:
-            # PUBACK already came in before we could register - delivered.
-            try:
-                early_acks.remove(result.mid)
-            except ValueError:
-                pass
-            return True
-        pending_pubs[result.mid] = (topic, payload, time.time())
+        pending_pubs[result.mid] = (entries, time.time(), len(payload))
         return True
 
 def on_publish(client, userdata, mid, reason_code=None, properties=None):
@@ -166,10 +407,12 @@ def on_publish(client, userdata, mid, reason_code=None, properties=None):
     try:
         with pending_lock:
             if mid in pending_pubs:
-                del pending_pubs[mid]
-            else:
-                # Untracked publish (logMQTT/modemlog) or the rare early ack.
-                early_acks.append(mid)
+                entries, sent_at, nbytes = pending_pubs.pop(mid)
+                drain_planner.acked(nbytes, sent_at, time.time())
+                # Records from the retry queue can now leave the disk
+                with retry_lock:
+                    retry_queue.done(entries)
+            # Otherwise an untracked publish (logMQTT/modemlog): nothing to do
     except Exception as e:
         print(f"on_publish error: {e}")
 
@@ -184,17 +427,18 @@ def sweep_pending():
     now = time.time()
     expired = []
     with pending_lock:
-        for mid, (topic, payload, queued_at) in list(pending_pubs.items()):
+        for mid, (entries, queued_at, _) in list(pending_pubs.items()):
             if now - queued_at > PENDING_TIMEOUT:
-                expired.append((topic, payload))
+                expired.append(entries)
                 del pending_pubs[mid]
     if expired:
         with stats_lock:
             publish_timeouts += len(expired)
         with retry_lock:
-            for item in expired:
-                retry_queue.append(item)
-        print(f"PUBACK timeout on {len(expired)} message(s) - moved to retry queue")
+            for entries in expired:
+                retry_queue.extend(entries)
+        records = sum(len(entries) for entries in expired)
+        print(f"PUBACK timeout on {len(expired)} message(s), {records} record(s) - moved to retry queue")
 
 def drain_pending_to_retry():
     """Move ALL pending publishes to the retry queue.
@@ -203,72 +447,167 @@ def drain_pending_to_retry():
     inflight state dies with it, so nothing pending will ever be confirmed.
     """
     with pending_lock:
-        items = [(t, p) for (t, p, _) in pending_pubs.values()]
+        items = [entry for (entries, _, _) in pending_pubs.values() for entry in entries]
         pending_pubs.clear()
     if items:
         with retry_lock:
-            for item in items:
-                retry_queue.append(item)
+            retry_queue.extend(items)
         print(f"Moved {len(items)} pending publish(es) to retry queue before client rebuild")
 
 
-def queue_failed_publish(topic, payload):
-    """Store a powerlog message whose publish was rejected, for later retry."""
+def queue_failed_publish(entries):
+    """Store the records of a rejected publish, (topic, payload) or Records, for later retry."""
     with retry_lock:
-        retry_queue.append((topic, payload))
+        retry_queue.extend(entries)
         depth = len(retry_queue)
     print(f"Publish rejected, queued for retry (queue depth: {depth})")
 
+def sync_retry_queue():
+    """The retry queue's batched fsync and cursor save, when due.
+
+    Blocking file I/O: the asyncio runtime runs it in the executor. The
+    fsyncs themselves - also those of segments sealed by a publish that
+    queued records - run after retry_lock is released, so a publish
+    queueing a record meanwhile does not wait for the flash.
+    """
+    with retry_lock:
+        fds = retry_queue.sync_due(fsync=False)
+    fsync_all(fds)
+
 def flush_retry_queue(client):
     """Retry every held powerlog message once, non-blocking.
 
     Runs at the start of each powerLoop cycle, before the new measurement, so
     backlog is delivered in roughly chronological order ahead of fresh data.
-    Successful re-publishes are removed; failures are kept for the next round.
-    A message that fails is re-appended, so the queue naturally drains only as
-    fast as the connection allows without ever blocking the loop.
+    Records stay on disk until their PUBACK; a failed one is put back for the
+    next round, so the queue naturally drains only as fast as the connection
+    allows without ever blocking the loop. The retry queue's periodic
+    fsync/cursor save is sync_retry_queue(), run by the caller before.
+
+    From BATCH_MIN_BACKLOG queued records on, powerlogs are sent in batches
+    sized (and compressed) by drain_planner (see the batched backlog drain
+    above).
     """
+    global batches_sent
     with retry_lock:
         pending = len(retry_queue)
+        record_bytes = retry_queue.record_bytes
     if not pending:
         return
-    print(f"Flushing retry queue ({pending} message(s))...")
+    batch_records, level = drain_planner.plan(pending, record_bytes)
+    batching = batch_records > 1
+    if batching:
+        print(f"Flushing retry queue ({pending} message(s), batches of {batch_records}"
+              f"{'' if level is None else f', zlib level {level}'})...")
+    else:
+        print(f"Flushing retry queue ({pending} message(s))...")
     # Process at most the current depth: messages re-queued this round are left
     # for the next cycle, so a persistently-down link can't spin here forever.
-    for _ in range(pending):
+    while pending > 0:
         with retry_lock:
-            if not retry_queue:
+            popped = retry_queue.pop()
+            if popped is None:
                 break
-            topic, payload = retry_queue.popleft()
+            record, topic, payload = popped
+            # The entries are the queue's Records, payloads are views of
+            # the mapped segment files
+            entries, records = [record], [payload]
+            # A batch is consecutive powerlog frames of one meter; rollups
+            # (JSON) and other meters' records end it.
+            if batching and topic.endswith("/data"):
+                while len(entries) < min(batch_records, pending):
+                    popped = retry_queue.pop()
+                    if popped is None:
+                        break
+                    if popped[1] != topic:
+                        retry_queue.unpop(popped[0])
+                        break
+                    entries.append(popped[0])
+                    records.append(popped[2])
+        pending -= len(entries)
         # publish_tracked: hard rejection puts it back in the queue itself;
         # soft path registers the mid so a lost PUBACK re-queues it via the
         # sweep. Either way nothing can silently vanish from here anymore.
-        if not publish_tracked(client, topic, payload):
+        if len(entries) == 1:
+            delivered = publish_tracked(client, topic, bytes(payload), entries)
+        else:
+            batch_topic = topic[:-len("data")] + "batch"
+            payload = powerlog_codec.pack_batch(records, level)
+            if level is not None:
+                drain_planner.packed(sum(map(len, records)), len(payload))
+            delivered = publish_tracked(client, batch_topic, payload, entries)
+            if delivered:
+                with stats_lock:
+                    batches_sent += 1
+        if not delivered:
             # Link is down - the message is already re-queued (at the back;
             # order across a failed flush round is not worth extra machinery,
             # the payload carries its own timestamp). Stop hammering.
             break
 
 
-voltage_l1_min = float('inf')
-voltage_l1_max = float('-inf')
-voltage_l1_sum = 0
-voltage_l2_min = float('inf')
-voltage_l2_max = float('-inf')
-voltage_l2_sum = 0      
-voltage_l3_min = float('inf')
-voltage_l3_max = float('-inf')
-voltage_l3_sum = 0
-current_l1_min = float('inf')
-current_l1_max = float('-inf')
-current_l1_sum = 0
-current_l2_min = float('inf')
-current_l2_max = float('-inf')
-current_l2_sum = 0
-current_l3_min = float('inf')
-current_l3_max = float('-inf')
-current_l3_sum = 0
-sample_count = 0
+# Voltage/current aggregation window: min/max/sum per channel, filled by the
+# poller and closed by publishPowerlog (aggregator.py). A new aggregated
+# quantity is one more name here plus its value in decode_poll_sample.
+POWER_CHANNELS = ["voltage_l1", "voltage_l2", "voltage_l3", "current_l1", "current_l2", "current_l3"]
+power_window = WindowAggregator(POWER_CHANNELS)
+# Extended powerlog statistics: standard deviation and streaming percentiles
+# per channel (streamstats.py), appended as a tagged section of the payload.
+# Off by default; set with {"windowStats": {"std": true, "percentiles":
+# [5, 50, 95]}} on the config topic, {"windowStats": false} switches off.
+# The other measured quantities (quantities.py) in a second window, closed
+# together with power_window and published as a tagged section. All of them
+# by default; {"aggregate": ["active_power", "frequency"]} on the config
+# topic narrows the set (fewer registers on every poll), [] switches it off.
+quantity_window = WindowAggregator(QUANTITY_IDS)
+# Multi-resolution rollups (rollup.py) of the same samples: POWER_CHANNELS
+# plus the aggregated quantities, in 10 s / 1 min / 15 min windows. Each
+# resolution is published on ET/powerlogger/<meter serial>/<label> with its
+# own QoS, or not at all: 0 is fire-and-forget (live views), 1 is tracked
+# and retried like the powerlog (history). Set with {"rollups": {"10s": 0,
+# "1min": false, "15min": 1}} on the config topic; all off by default.
+ROLLUP_BASE = 10
+ROLLUP_LABELS = {10: "10s", 60: "1min", 900: "15min"}
+ROLLUP_QOS = dict.fromkeys(ROLLUP_LABELS)    # seconds -> 0, 1 or None (not published)
+rollups = Rollups(POWER_CHANNELS + list(quantity_window.channels), base=ROLLUP_BASE,
+                  tiers=[s for s in ROLLUP_LABELS if s != ROLLUP_BASE])
+# Meter serial of the last powerlog, for the rollup topics
+powerlog_device_serial = None
+# Interval energy (energy.py): consumed/delivered deltas since the previous
+# powerlog, against a raw-counter baseline kept on disk across restarts.
+ENERGY_STATE_PATH = ".state/energy.json"
+energy_tracker = EnergyTracker(ENERGY_STATE_PATH)
+# Sag/swell/over-current detection on every poll sample (events.py), with
+# EVENT_PRE_SAMPLES before and EVENT_POST_SAMPLES after the trigger in each
+# event message, published on ET/modemlogger/<serial>/events. Thresholds via
+# {"events": {"nominalV": 230, "sagPct": 90, "swellPct": 110,
+# "overCurrentA": [400, 400, 400], "hysteresisPct": 2, "pre": 10,
+# "post": 10}} on the config topic; {"events": false} switches it off.
+EVENT_SETTINGS = dict(nominalV=230.0, sagPct=90.0, swellPct=110.0, overCurrentA=None, hysteresisPct=2.0)
+EVENT_PRE_SAMPLES = 10
+EVENT_POST_SAMPLES = 10
+event_detector = EventDetector(build_rules(**EVENT_SETTINGS), pre=EVENT_PRE_SAMPLES,
+                               post=EVENT_POST_SAMPLES, emit=lambda message: publish_event(message))
+# Report-by-exception (deadband.py): None publishes every window. Set with
+# {"reportByException": {"deadbands": {"voltage": 2, "current": 0.5,
+# "active_power": 1}, "heartbeat": 300}} on the config topic, where
+# "voltage"/"current" stand for all three phases and other names are
+# POWER_CHANNELS or quantities; {"reportByException": false} switches off.
+DEADBAND_GROUPS = {
+    "voltage": ["voltage_l1", "voltage_l2", "voltage_l3"],
+    "current": ["current_l1", "current_l2", "current_l3"],
+}
+RBE_DEFAULT_HEARTBEAT = 300
+powerlog_filter = None
+# Powerlog payload format: None sends the v1 frame (powerlog_codec.py), the
+# default until the backend decodes v2 for this device. {"payloadFormat": 2}
+# (or {"payloadFormat": {"version": 2, "keyframe": 30}}) on the config topic
+# switches to the delta/varint v2 records of powerlog_v2.py, {"payloadFormat":
+# 1} back. Every switch starts a new encoder, so v2 opens with a keyframe.
+powerlog_v2 = None
+# Wall time the active window opened: the previous boundary, or the start of
+# the script for the first (partial) window. Protected by agg_lock.
+power_window_opened = time.time()
 polling_active = True
 
 def getRouterSerial():
@@ -297,13 +636,14 @@ def getRouterSerial():
         return False
 
 def modbusConnect(modbusclient):
-    with modbus_lock:
-        connected = modbusclient.connect()
+    # (Re)connecting means the bus may have changed under us: forget every
+    # cached block, static ones included.
+    register_cache.invalidate()
+    connected = bus_scheduler.submit(PRIO_POLL, modbusclient.connect)
     while not connected:
         logMQTT(client, topicLog, "Modbus RTU initialisation failed - is the port correct?")
         time.sleep(1)
-        with modbus_lock:
-            connected = modbusclient.connect()
+        connected = bus_scheduler.submit(PRIO_POLL, modbusclient.connect)
 
 
 def modbusTcpConnect(tcpClient):
@@ -654,50 +994,100 @@ def connectionWatchdog():
     by itself never trigger anything. The thread check runs every cycle, so a
     thread that dies mid-outage is caught at the next action moment.
     """
-    disconnect_since = None
-    last_action = 0
-    attempt = 0
+    state = new_watchdog_state()
     while True:
         time.sleep(WATCHDOG_CHECK_INTERVAL)
         try:
-            if client is not None and client.is_connected():
-                if disconnect_since is not None:
-                    print(f"Watchdog: MQTT connection restored after {int(time.time() - disconnect_since)}s and {attempt} recovery attempt(s)")
-                disconnect_since = None
-                attempt = 0
-                continue
-
-            now = time.time()
-            if disconnect_since is None:
-                disconnect_since = now
-                last_action = now
-                if not mqtt_thread_alive():
-                    # A dead thread can never recover by itself, so there is
-                    # nothing to wait for: rebuild immediately.
-                    print("Watchdog: MQTT connection lost and network thread is DEAD - rebuilding MQTT client immediately")
-                    rebuild_mqtt_client()
-                else:
-                    # Thread alive: start the clock, don't act yet - give
-                    # paho's own reconnect a chance first.
-                    print("Watchdog: MQTT connection lost, monitoring...")
-                continue
-
-            if now - last_action >= WATCHDOG_TOGGLE_INTERVAL:
-                last_action = now
-                attempt += 1
-                down_for = int(now - disconnect_since)
-                if not mqtt_thread_alive():
-                    print(f"Watchdog: paho network thread is DEAD after {down_for}s offline (attempt {attempt}) - rebuilding MQTT client")
-                    rebuild_mqtt_client()
-                else:
-                    print(f"Watchdog: no MQTT connection for {down_for}s, thread alive (attempt {attempt}) - toggling mobile data")
-                    toggleConnection()
+            action = watchdog_check(state)
+            if action == "rebuild":
+                rebuild_mqtt_client()
+            elif action == "toggle":
+                toggleConnection()
         except Exception as e:
             # The watchdog is the safety net - it must never die itself.
             print(f"Watchdog error: {e}")
 
+def new_watchdog_state():
+    return {"disconnect_since": None, "last_action": 0, "attempt": 0}
+
+def watchdog_check(state):
+    """One watchdog tick: return "rebuild", "toggle" or None.
+
+    The diagnosis logic of connectionWatchdog, without the sleeping and the
+    acting, so the asyncio runtime runs exactly the same decisions.
+    """
+    if client is not None and client.is_connected():
+        if state["disconnect_since"] is not None:
+            print(f"Watchdog: MQTT connection restored after {int(time.time() - state['disconnect_since'])}s and {state['attempt']} recovery attempt(s)")
+        state["disconnect_since"] = None
+        state["attempt"] = 0
+        return None
+
+    now = time.time()
+    if state["disconnect_since"] is None:
+        state["disconnect_since"] = now
+        state["last_action"] = now
+        if not mqtt_thread_alive():
+            # A dead thread can never recover by itself, so there is
+            # nothing to wait for: rebuild immediately.
+            print("Watchdog: MQTT connection lost and network thread is DEAD - rebuilding MQTT client immediately")
+            return "rebuild"
+        # Thread alive: start the clock, don't act yet - give
+        # paho's own reconnect a chance first.
+        print("Watchdog: MQTT connection lost, monitoring...")
+        return None
+
+    if now - state["last_action"] >= WATCHDOG_TOGGLE_INTERVAL:
+        state["last_action"] = now
+        state["attempt"] += 1
+        down_for = int(now - state["disconnect_since"])
+        if not mqtt_thread_alive():
+            print(f"Watchdog: paho network thread is DEAD after {down_for}s offline (attempt {state['attempt']}) - rebuilding MQTT client")
+            return "rebuild"
+        print(f"Watchdog: no MQTT connection for {down_for}s, thread alive (attempt {state['attempt']}) - toggling mobile data")
+        return "toggle"
+    return None
+
 sendInterval = 10
 
+def publish_event(message):
+    """Publish one detected power quality event (EventDetector emit callback).
+
+    Tracked like the powerlog, so an event during a link outage is queued
+    and retried instead of lost.
+    """
+    topic = f"{topicModemBase}/{routerSerial}/events"
+    print(f"Power event: {[(t['type'], t['phase']) for t in message['triggers']]}")
+    publish_tracked(client, topic, json.dumps(message))
+
+def set_event_detection(setting):
+    """Apply an events config value: false, or settings for build_rules plus pre/post."""
+    global event_detector
+    if not setting:
+        rules, pre, post = [], EVENT_PRE_SAMPLES, EVENT_POST_SAMPLES
+    else:
+        setting = dict(setting)
+        pre = int(setting.pop("pre", EVENT_PRE_SAMPLES))
+        post = int(setting.pop("post", EVENT_POST_SAMPLES))
+        rules = build_rules(**dict(EVENT_SETTINGS, **setting))
+    # Replaced whole: the poller picks up the new detector with its next sample
+    event_detector = EventDetector(rules, pre=pre, post=post, emit=event_detector.emit)
+    return len(rules)
+
+def publish_bus_stats(client):
+    """Publish the full bus_stats dump (all latency histograms) once."""
+    message = bus_stats.dump()
+    message["scheduler"] = bus_scheduler.stats.snapshot()
+    message["timeouts"] = rtu_timeouts.snapshot()
+    topic = f"{topicModemBase}/{routerSerial}/busstats"
+    result = client.publish(topic, json.dumps(message), qos=1)
+    if result[0] != 0:
+        print(f"Failed to send bus statistics to topic {topic}")
+
+# Keys the config topic understands; a message needs at least one of them.
+CONFIG_KEYS = {"sendInterval", "pollRate", "busStats", "windowStats", "aggregate", "events",
+               "reportByException", "rollups", "payloadFormat", "compressBacklog"}
+
 def on_message(client, userdata, msg):
     global sendInterval
     # Same rule as the other callbacks: this runs on paho's network-loop
@@ -708,7 +1098,16 @@ def on_message(client, userdata, msg):
         if msg.topic == topicReset:
             payload = msg.payload.decode()
             print(f"Reset action requested: {payload}")
-            if payload == 'modem':
+            if async_loop is not None:
+                # asyncio runtime: the TCP transport belongs to the event
+                # loop's bus owner, hand the action over to the loop.
+                if payload == 'modem':
+                    asyncio.run_coroutine_threadsafe(reboot_modem_async(), async_loop)
+                elif payload == 'connection':
+                    asyncio.run_coroutine_threadsafe(toggle_connection_async(), async_loop)
+                else:
+                    print(f'Unknown reset command: {payload}')
+            elif payload == 'modem':
                 rebootModem()
             elif payload == 'connection':
                 # Manual trigger for remote testing. Run in a separate thread:
@@ -723,8 +1122,41 @@ def on_message(client, userdata, msg):
                 payload = msg.payload.decode()
                 print(f"Config update received: {payload}")
                 config = json.loads(payload)
-                sendInterval = config["sendInterval"]
-                logMQTT(client, topicLog, f"Config updated - sendInterval set to {sendInterval}")
+                if not CONFIG_KEYS & config.keys():
+                    raise KeyError("sendInterval")
+                if "sendInterval" in config:
+                    sendInterval = config["sendInterval"]
+                    logMQTT(client, topicLog, f"Config updated - sendInterval set to {sendInterval}")
+                if "pollRate" in config:
+                    rate = set_poll_rate(config["pollRate"])
+                    logMQTT(client, topicLog, f"Config updated - pollRate set to {rate:g} Hz (requested {config['pollRate']})")
+                if "windowStats" in config:
+                    variance, percentiles = set_window_stats(config["windowStats"])
+                    logMQTT(client, topicLog, f"Config updated - windowStats std={variance} percentiles={list(percentiles)} from the next window")
+                if "aggregate" in config:
+                    names = set_aggregate_quantities(config["aggregate"])
+                    logMQTT(client, topicLog, f"Config updated - aggregate set to {list(names)}")
+                if "events" in config:
+                    n = set_event_detection(config["events"])
+                    logMQTT(client, topicLog, f"Config updated - event detection with {n} rules")
+                if "reportByException" in config:
+                    rbe = set_report_by_exception(config["reportByException"])
+                    if rbe is None:
+                        logMQTT(client, topicLog, "Config updated - reportByException off")
+                    else:
+                        logMQTT(client, topicLog, f"Config updated - reportByException deadbands={rbe.deadbands} heartbeat={rbe.heartbeat:g}s")
+                if "rollups" in config:
+                    published = set_rollup_publishing(config["rollups"])
+                    logMQTT(client, topicLog, f"Config updated - rollups {published}")
+                if "compressBacklog" in config:
+                    drain_planner.compress = bool(config["compressBacklog"])
+                    logMQTT(client, topicLog, f"Config updated - compressBacklog {drain_planner.compress}")
+                if "payloadFormat" in config:
+                    version = set_payload_format(config["payloadFormat"])
+                    logMQTT(client, topicLog, f"Config updated - payloadFormat v{version} from the next powerlog")
+                if config.get("busStats"):
+                    # {"busStats": true}: one-off full RTU bus statistics dump
+                    publish_bus_stats(client)
             except Exception as error:
                 print(f"Error processing config message: {error}")
                 logMQTT(client, topicLog, f"Invalid config message: {str(error)}")
@@ -757,494 +1189,464 @@ def scale_energy_by_ct_ratio(energy_value, ct_ratio):
     else:
         return energy_value / 1000  # No scaling for ct_ratio < 1
 
-def poll_voltage_and_current(slaveid=1):
-    global voltage_l1_min, voltage_l1_max, voltage_l1_sum
-    global voltage_l2_min, voltage_l2_max, voltage_l2_sum
-    global voltage_l3_min, voltage_l3_max, voltage_l3_sum
-    global current_l1_min, current_l1_max, current_l1_sum
-    global current_l2_min, current_l2_max, current_l2_sum
-    global current_l3_min, current_l3_max, current_l3_sum
-    global sample_count
-    
-    try:
-        # Initialize variables for readings
-        voltage_l1 = voltage_l2 = voltage_l3 = 0
-        current_l1 = current_l2 = current_l3 = 0
-        
-        # Read voltage and current registers based on connected device type
-        if emdx_connected:
-            # For EMDX, use the provided slaveid (typically 1)
-            block1 = mb_read(int(0x1000), count=14, slave=slaveid)
-            if block1.isError():
-                print("Error reading EMDX voltage and current registers")
-                return
-                
-            # Extract values with EMDX scaling
-            voltage_l1 = (block1.registers[0] << 16 | block1.registers[1]) / 1000.0  
-            voltage_l2 = (block1.registers[2] << 16 | block1.registers[3]) / 1000.0
-            voltage_l3 = (block1.registers[4] << 16 | block1.registers[5]) / 1000.0
-            current_l1 = (block1.registers[6] << 16 | block1.registers[7]) / 1000.0  
-            current_l2 = (block1.registers[8] << 16 | block1.registers[9]) / 1000.0
-            current_l3 = (block1.registers[10] << 16 | block1.registers[11]) / 1000.0
-            
-        elif rmu_connected:
-            # For RMU/UMG, always use slave ID 49 - override the parameter
-            rmu_slaveid = 49
-            
-            # Read voltage registers - first block
-            voltage_block = mb_read(19000, count=6, slave=rmu_slaveid)
-            if voltage_block.isError():
-                print("Error reading RMU voltage registers")
-                return
-                
-            # Read current registers - separate block
-            current_block = mb_read(19012, count=8, slave=rmu_slaveid)
-            if current_block.isError():
-                print("Error reading RMU current registers")
-                return
-                
-            voltage_l1 = struct.unpack('>f', struct.pack('>HH', voltage_block.registers[0], voltage_block.registers[1]))[0]
-            voltage_l2 = struct.unpack('>f', struct.pack('>HH', voltage_block.registers[2], voltage_block.registers[3]))[0]
-            voltage_l3 = struct.unpack('>f', struct.pack('>HH', voltage_block.registers[4], voltage_block.registers[5]))[0]
-                        
-            # Extract current values (using same method)
-            current_l1 = struct.unpack('>f', struct.pack('>HH', current_block.registers[0], current_block.registers[1]))[0]
-            current_l2 = struct.unpack('>f', struct.pack('>HH', current_block.registers[2], current_block.registers[3]))[0]
-            current_l3 = struct.unpack('>f', struct.pack('>HH', current_block.registers[4], current_block.registers[5]))[0]
-
-        else:
-            return
-        
-        # Update min, max, and sum for each value (under agg_lock: publishPowerlog
-        # snapshots and resets this same window from another thread).
-        with agg_lock:
-            voltage_l1_min = min(voltage_l1_min, voltage_l1)
-            voltage_l1_max = max(voltage_l1_max, voltage_l1)
-            voltage_l1_sum += voltage_l1
-
-            voltage_l2_min = min(voltage_l2_min, voltage_l2)
-            voltage_l2_max = max(voltage_l2_max, voltage_l2)
-            voltage_l2_sum += voltage_l2
-
-            voltage_l3_min = min(voltage_l3_min, voltage_l3)
-            voltage_l3_max = max(voltage_l3_max, voltage_l3)
-            voltage_l3_sum += voltage_l3
+def poll_read_plan(slaveid=1):
+    """(regmap, block names, slave id) of the voltage/current poll, or None."""
+    if emdx_connected:
+        # For EMDX, use the provided slaveid (typically 1)
+        return EMDX_REGISTERS, EMDX_POLL_BLOCKS, slaveid
+    if rmu_connected:
+        # For RMU/UMG, always use slave ID 49 - override the parameter.
+        # Voltage (19000) and current (19012) are read as one 20-register request.
+        return RMU_REGISTERS, RMU_POLL_BLOCKS, 49
+    return None
 
-            current_l1_min = min(current_l1_min, current_l1)
-            current_l1_max = max(current_l1_max, current_l1)
-            current_l1_sum += current_l1
+def quantity_table(regmap):
+    return EMDX_QUANTITIES if regmap is EMDX_REGISTERS else RMU_QUANTITIES
 
-            current_l2_min = min(current_l2_min, current_l2)
-            current_l2_max = max(current_l2_max, current_l2)
-            current_l2_sum += current_l2
+def poll_block_names(regmap, names):
+    """(dynamic, static) block names of a poll: `names` plus what the aggregated quantities need.
 
-            current_l3_min = min(current_l3_min, current_l3)
-            current_l3_max = max(current_l3_max, current_l3)
-            current_l3_sum += current_l3
+    Static blocks (the EMDX CT ratio scales power) come from the static
+    cache and are read separately, so they are not re-read on every poll.
+    """
+    wanted = list(names) + [b for b in blocks_for(quantity_table(regmap), quantity_window.channels)
+                            if b not in names]
+    return [b for b in wanted if b not in regmap.static], [b for b in wanted if b in regmap.static]
+
+def fold_poll_sample(regmap, blocks):
+    """Decode one poll and fold it into power_window and quantity_window."""
+    sample = decode_poll_sample(regmap, blocks)
+    names = quantity_window.channels
+    extra = decode_quantities(quantity_table(regmap), names, blocks)
+    # Under agg_lock: publishPowerlog closes these same windows from another
+    # thread.
+    with agg_lock:
+        power_window.add(sample)
+        if quantity_window.channels == names:
+            quantity_window.add(extra)
+            rollups.add(sample + extra)
+    event_detector.add(time.time(), sample)
+
+# Whole-block decoders (regdecode.py): one struct call pair per block
+# instead of one per value.
+EMDX_VOLTAGE_CURRENT = BlockDecoder(14, "I", divisors=1000.0)   # V L1-L3, I L1-L3, I N
+RMU_VOLTAGE = BlockDecoder(6)                                   # V L1-L3
+RMU_CURRENT = BlockDecoder(8)                                   # I L1-L3, I N
+RMU_MAIN = BlockDecoder(86)                                     # 19000-19085: float k at register 19000 + 2k
+
+def decode_poll_sample(regmap, blocks):
+    """Return the POWER_CHANNELS values (V L1-L3, I L1-L3) from the poll blocks."""
+    if regmap is EMDX_REGISTERS:
+        # EMDX scaling: u32 / 1000
+        return tuple(EMDX_VOLTAGE_CURRENT.decode(blocks["voltage_current"])[:6])
+    return tuple(RMU_VOLTAGE.decode(blocks["voltage"]) + RMU_CURRENT.decode(blocks["current"])[:3])
 
-            sample_count += 1
+def poll_voltage_and_current(slaveid=1):
+    try:
+        plan = poll_read_plan(slaveid)
+        if plan is None:
+            return
+        regmap, names, slave = plan
+        if not rtu_slave_ready(regmap, slave):
+            return
+        # Top priority on the bus, but a sample that could not be taken within
+        # one poll period is skipped rather than taken late.
+        read_fn = partial(mb_read, priority=PRIO_POLL, deadline=time.monotonic() + POLL_INTERVAL)
+        dynamic, static = poll_block_names(regmap, names)
+        blocks, error = read_blocks(read_fn, regmap, dynamic, slave,
+                                    cache=register_cache, store_ttl=POLL_SNAPSHOT_TTL, lookup=False)
+        if error is None and static:
+            static_blocks, error = read_blocks(read_fn, regmap, static, slave, cache=register_cache)
+            blocks.update(static_blocks)
+        if error is not None:
+            print(f"Error reading {regmap.name} voltage and current registers")
+            return
+        fold_poll_sample(regmap, blocks)
 
+    except DeadlineExpired:
+        # Counted in the scheduler stats; not a bus error.
+        pass
     except Exception as e:
         count_modbus_error()
         print(f"Error polling voltage and current: {e}")
 
-def reset_aggregation():
-    global voltage_l1_min, voltage_l1_max, voltage_l1_sum
-    global voltage_l2_min, voltage_l2_max, voltage_l2_sum
-    global voltage_l3_min, voltage_l3_max, voltage_l3_sum
-    global current_l1_min, current_l1_max, current_l1_sum
-    global current_l2_min, current_l2_max, current_l2_sum
-    global current_l3_min, current_l3_max, current_l3_sum
-    global sample_count
-    
-    voltage_l1_min = float('inf')
-    voltage_l1_max = float('-inf')
-    voltage_l1_sum = 0
-    voltage_l2_min = float('inf')
-    voltage_l2_max = float('-inf')
-    voltage_l2_sum = 0
-    voltage_l3_min = float('inf')
-    voltage_l3_max = float('-inf')
-    voltage_l3_sum = 0
-    current_l1_min = float('inf')
-    current_l1_max = float('-inf')
-    current_l1_sum = 0
-    current_l2_min = float('inf')
-    current_l2_max = float('-inf')
-    current_l2_sum = 0
-    current_l3_min = float('inf')
-    current_l3_max = float('-inf')
-    current_l3_sum = 0
-    sample_count = 0
-
-def publishPowerlog(client):
+def powerlog_read_plan():
+    """(regmap, block names, slave id) of the powerlog read for the connected device, or None."""
+    if emdx_connected:
+        # EMDX: the nine blocks this used to read one request each are merged
+        # into 4 reads (see regmap.EMDX_REGISTERS); the voltage/current block
+        # normally comes from the poller's snapshot in the cache, serial and
+        # CT ratio from the static cache.
+        return EMDX_REGISTERS, EMDX_PUBLISH_BLOCKS, 1
+    if rmu_connected:
+        # RMU: 19000-19085 in one request plus the three non-consecutive
+        # blocks (CT ratio, serial number, operating hours).
+        return RMU_REGISTERS, RMU_PUBLISH_BLOCKS, 49
+    return None
+
+def set_aggregate_quantities(names):
+    """Aggregate these quantities from the next sample on; the open windows restart."""
+    global quantity_window, rollups
+    names = check_names(names)
+    with agg_lock:
+        quantity_window = WindowAggregator(names)
+        rollups = Rollups(POWER_CHANNELS + list(names), base=ROLLUP_BASE,
+                          tiers=[s for s in ROLLUP_LABELS if s != ROLLUP_BASE])
+    return names
+
+def set_rollup_publishing(setting):
+    """Apply a rollups config value {label: 0, 1 or false}; returns {label: qos}."""
+    seconds_of = {label: seconds for seconds, label in ROLLUP_LABELS.items()}
+    for label, qos in setting.items():
+        if label not in seconds_of:
+            raise ValueError(f"unknown rollup {label}")
+        if qos is False or qos is None:
+            ROLLUP_QOS[seconds_of[label]] = None
+        elif qos in (0, 1):
+            ROLLUP_QOS[seconds_of[label]] = qos
+        else:
+            raise ValueError(f"rollup {label}: QoS must be 0, 1 or false")
+    return {ROLLUP_LABELS[s]: qos for s, qos in ROLLUP_QOS.items()}
+
+def rollup_cycle():
+    """Close the rollup windows due at this ROLLUP_BASE boundary and publish the enabled ones."""
+    boundary = round(time.time() / ROLLUP_BASE) * ROLLUP_BASE
+    with agg_lock:
+        roll = rollups
+        closed = roll.close(boundary)
+    for seconds, window, start, end in closed:
+        qos = ROLLUP_QOS.get(seconds)
+        if qos is None:
+            continue
+        if powerlog_device_serial is None:
+            print(f"Rollup {ROLLUP_LABELS[seconds]} not published: meter serial not known yet")
+            continue
+        message = {
+            "start": start,
+            "end": end,
+            "count": window.count,
+            "values": {name: [round(v, 3) for v in triple] for name, triple in window.as_dict().items()},
+        }
+        topic = f"{topicPowerBase}/{powerlog_device_serial}/{ROLLUP_LABELS[seconds]}"
+        if qos:
+            publish_tracked(client, topic, json.dumps(message))
+        else:
+            client.publish(topic, json.dumps(message), qos=0)
+    roll.recycle(closed)
+
+def set_window_stats(setting):
+    """Apply a windowStats config value (false, or {"std": .., "percentiles": [..]})."""
+    if not setting:
+        variance, percentiles = False, ()
+    else:
+        variance, percentiles = bool(setting.get("std", False)), setting.get("percentiles", ())
+    with agg_lock:
+        power_window.configure(variance, percentiles)
+        return power_window.extended_config
+
+def set_report_by_exception(setting):
+    """Apply a reportByException config value; returns the filter (None: off)."""
+    global powerlog_filter
+    if not setting:
+        powerlog_filter = None
+        return None
+    deadbands = {}
+    for name, band in setting.get("deadbands", {}).items():
+        for channel in DEADBAND_GROUPS.get(name, [name]):
+            if channel not in POWER_CHANNELS and channel not in QUANTITY_IDS:
+                raise ValueError(f"unknown deadband quantity {name}")
+            deadbands[channel] = float(band)
+    powerlog_filter = DeadbandFilter(deadbands, float(setting.get("heartbeat", RBE_DEFAULT_HEARTBEAT)))
+    return powerlog_filter
+
+def set_payload_format(setting):
+    """Apply a payloadFormat config value (1, 2 or {"version": 2, "keyframe": n})."""
+    global powerlog_v2
+    if not isinstance(setting, dict):
+        setting = {"version": setting}
+    version = int(setting.get("version", 1))
+    if version == 1:
+        powerlog_v2 = None
+    elif version == 2:
+        # Replaced whole: the publisher picks up the new encoder with its next record
+        powerlog_v2 = PowerlogV2Encoder(keyframe=int(setting.get("keyframe", DEFAULT_KEYFRAME)))
+    else:
+        raise ValueError(f"unknown payload format {version}")
+    return version
+
+def close_power_window():
+    """Close the aggregation window on the wall-clock boundary that is now.
+
+    The publish loop runs on wall-clock boundaries (:00, :10, :20 for 10 s),
+    so the boundary is the current time rounded to sendInterval. Called at
+    the start of a publish cycle, before the register reads: samples polled
+    while a slow read of the other blocks is still running belong to the
+    next window, not this one. Returns (window, quantities window, start,
+    end, report), wall times in whole seconds - or None if report-by-exception
+    found nothing worth sending, in which case the window stays open and
+    carries on into the next cycle. report is (filter, now, values) for
+    publish_powerlog_blocks to hand to the filter's published() once the
+    frame is out, None without report-by-exception: a cycle whose reads
+    fail must not become the deadband reference or reset the heartbeat.
+    """
+    global power_window_opened
+    end = round(time.time() / sendInterval) * sendInterval
+    now = time.monotonic()
+    report = None
+    with agg_lock:
+        rbe = powerlog_filter
+        if rbe is not None:
+            values = power_window.peek().as_dict()
+            values.update(quantity_window.peek().as_dict())
+            # An empty window (poller down) is published: the publish sample
+            # is all there is
+            if power_window.count and not rbe.due(now, values):
+                return None
+            report = (rbe, now, values)
+        window = power_window.swap()
+        quantities = quantity_window.swap()
+        start, power_window_opened = power_window_opened, end
+    return window, quantities, int(start), int(end), report
+
+def publishPowerlog(client, closed):
     """
     Publish power data in a standardized binary format compatible with the JavaScript parser.
     Implements optimized data collection from yanitza.py while maintaining the same output format.
+    `closed` is what close_power_window() returned at the start of the cycle.
     """
-    global routerSerial, sample_count
-    global voltage_l1_min, voltage_l1_max, voltage_l1_sum
-    global voltage_l2_min, voltage_l2_max, voltage_l2_sum
-    global voltage_l3_min, voltage_l3_max, voltage_l3_sum
-    global current_l1_min, current_l1_max, current_l1_sum
-    global current_l2_min, current_l2_max, current_l2_sum
-    global current_l3_min, current_l3_max, current_l3_sum
-    
+    if closed is None:
+        return
     try:
-        # Sensible defaults so a single failed/optional register read can't leave a
-        # variable undefined and blow up the whole publish further down.
-        operating_hours = 0
-        current_n = 0
-
-        # Read device-specific registers and convert to standardized format
-        if emdx_connected:
-            # --- Optimized EMDX data collection based on yanitza.py ---
-            slaveid = 1
-            
-            # Read serial number
-            block8 = mb_read(int(0x2213), count=1, slave=slaveid)
-            if block8.isError():
-                print("Error reading EMDX serial number register")
-                return
-            device_serial = block8.registers[0]
-            
-            # Read voltage and current registers
-            block1 = mb_read(int(0x1000), count=14, slave=slaveid)
-            if block1.isError():
-                print("Error reading EMDX voltage and current registers")
-                return
-                
-            # Extract voltage values
-            voltage_l1 = (block1.registers[0] << 16 | block1.registers[1]) / 1000.0
-            voltage_l2 = (block1.registers[2] << 16 | block1.registers[3]) / 1000.0
-            voltage_l3 = (block1.registers[4] << 16 | block1.registers[5]) / 1000.0
-            
-            # Extract current values
-            current_l1 = (block1.registers[6] << 16 | block1.registers[7]) / 1000.0
-            current_l2 = (block1.registers[8] << 16 | block1.registers[9]) / 1000.0
-            current_l3 = (block1.registers[10] << 16 | block1.registers[11]) / 1000.0
-            current_n = (block1.registers[12] << 16 | block1.registers[13]) / 1000.0
-            
-            # Read power values
-            block2 = mb_read(int(0x1014), count=10, slave=slaveid)
-            if block2.isError():
-                print("Error reading EMDX power registers")
-                return
-            
-
-            
-            # Read frequency
-            block3 = mb_read(int(0x1026), count=1, slave=slaveid)
-            if block3.isError():
-                print("Error reading EMDX frequency register")
-                return
-            frequency = block3.registers[0] / 10.0
-            
-            # Read energy values
-            block4 = mb_read(int(0x101c), count=2, slave=slaveid)
-            if block4.isError():
-                print("Error reading EMDX consumed energy registers")
-                return
-            
-            block5 = mb_read(int(0x1020), count=2, slave=slaveid)
-            if block5.isError():
-                print("Error reading EMDX delivered energy registers")
-                return
-            
-            # Read power factor
-            block6 = mb_read(int(0x1024), count=2, slave=slaveid)
-            if block6.isError():
-                print("Error reading EMDX power factor registers")
-                return
-            
-            # Read CT ratio
-            block7 = mb_read(int(0x1200), count=1, slave=slaveid)
-            if block7.isError():
-                print("Error reading EMDX CT ratio register")
-                return
-            
-            active_power = (block2.registers[0] << 16 | block2.registers[1]) / 1000.0
-            reactive_power = (block2.registers[2] << 16 | block2.registers[3]) / 1000.0
-            apparent_power = (block2.registers[4] << 16 | block2.registers[5]) / 1000.0
-            ct_ratio = block7.registers[0]
-            if ct_ratio < 5000:
-                active_power = active_power * 0.01
-                reactive_power = reactive_power * 0.01
-                apparent_power = apparent_power * 0.01
-            sign_active = block2.registers[6]
-            sign_reactive = block2.registers[7]
-            chained_voltage_l1l2 = (block2.registers[8] << 16 | block2.registers[9]) / 1000.0
-
-            # Read operating hours
-            block9 = mb_read(int(0x106E), count=1, slave=slaveid)
-            if not block9.isError():
-                operating_hours = block9.registers[0]
-            
-            # Process values
-            power_factor = block6.registers[0] / 1000.0
-            sector_power_factor = block6.registers[1]
-            print(ct_ratio)
-            print(block4.registers[0] << 16 | block4.registers[1])
-            consumed_energy = scale_energy_by_ct_ratio((block4.registers[0] << 16 | block4.registers[1]), ct_ratio)
-            print(consumed_energy)
-            delivered_energy = scale_energy_by_ct_ratio((block5.registers[0] << 16 | block5.registers[1]), ct_ratio)
-            
-        elif rmu_connected:
-            # --- Optimized RMU data collection based on yanitza.py ---
-            slaveid = 49
-            
-            # Read all consecutive registers from 19000 to 19085 in one request
-            main_registers = mb_read(19000, count=86, slave=slaveid)
-            if main_registers.isError():
-                print("Error reading main RMU registers")
-                return
-                
-            # Read the non-consecutive registers separately
-            block7 = mb_read(600, count=2, slave=slaveid)  # CT ratio
-            if block7.isError():
-                print("Error reading RMU CT ratio registers")
-                return
-                
-            block8 = mb_read(911, count=2, slave=slaveid)  # Serial number
-            if block8.isError():
-                print("Error reading RMU serial number")
-                return
-                
-            block9 = mb_read(394, count=2, slave=slaveid)  # Operating hours
-            if block9.isError():
-                print("Error reading RMU operating hours")
-                return
-            
-            # Process serial number
-            device_serial = (block8.registers[0] << 16) | block8.registers[1]
-            
-            # Extract voltage values
-            voltage_l1 = struct.unpack('>f', struct.pack('>HH', main_registers.registers[0], main_registers.registers[1]))[0]
-            voltage_l2 = struct.unpack('>f', struct.pack('>HH', main_registers.registers[2], main_registers.registers[3]))[0]
-            voltage_l3 = struct.unpack('>f', struct.pack('>HH', main_registers.registers[4], main_registers.registers[5]))[0]
-            
-            # Extract current values - offset by 12 from start (19012-19000)
-            current_l1 = struct.unpack('>f', struct.pack('>HH', main_registers.registers[12], main_registers.registers[13]))[0]
-            current_l2 = struct.unpack('>f', struct.pack('>HH', main_registers.registers[14], main_registers.registers[15]))[0]
-            current_l3 = struct.unpack('>f', struct.pack('>HH', main_registers.registers[16], main_registers.registers[17]))[0]
-            current_n = struct.unpack('>f', struct.pack('>HH', main_registers.registers[18], main_registers.registers[19]))[0]
-            
-            # Power values (offsets calculated from their original addresses)
-            active_power = struct.unpack('>f', struct.pack('>HH', main_registers.registers[26], main_registers.registers[27]))[0] / 1000
-            apparent_power = struct.unpack('>f', struct.pack('>HH', main_registers.registers[34], main_registers.registers[35]))[0] / 1000
-            reactive_power = struct.unpack('>f', struct.pack('>HH', main_registers.registers[42], main_registers.registers[43]))[0] / 1000
-
-            # Frequency (original block3) - offset by 50 from start (19050-19000)
-            raw_freq_bytes = struct.pack('>HH', main_registers.registers[50], main_registers.registers[51])
-            frequency = struct.unpack('>f', raw_freq_bytes)[0]
-            
-            # Energy values and power factor
-            consumed_energy = struct.unpack('>f', struct.pack('>HH', main_registers.registers[68], main_registers.registers[69]))[0]
-            delivered_energy = struct.unpack('>f', struct.pack('>HH', main_registers.registers[76], main_registers.registers[77]))[0]
-            # Guard against zero load: apparent_power == 0 would raise ZeroDivisionError
-            power_factor = (active_power / apparent_power / 10) if apparent_power else 0
-            sector_power_factor = 0  # May not be available
-            ct_ratio = block7.registers[0]  # Use primary CT ratio
-            
-            # Get operating hours
-            operating_hours = round(struct.unpack('>I', struct.pack('>HH', block9.registers[0], block9.registers[1]))[0] / 3600, 1)
-            print(operating_hours)
-            # Set signs to 0 as they might not be directly available
-            sign_active = 0
-            sign_reactive = 0
-            
-            # No chained voltage in RMU
-            chained_voltage_l1l2 = 0
-        else:
+        plan = powerlog_read_plan()
+        if plan is None:
             return
+        regmap, names, slaveid = plan
+        if not rtu_slave_ready(regmap, slaveid):
+            return
+        # Blocks served from the snapshot cache instead of the bus
+        cached = set()
+        blocks, error = read_blocks(mb_read, regmap, names, slaveid, cache=register_cache, cached=cached)
+        if error is not None:
+            print(f"Error reading {regmap.name} registers: {error}")
+            return
+        publish_powerlog_blocks(client, regmap, blocks, cached, closed)
+    except Exception as e:
+        count_modbus_error()
+        logMQTT(client, topicLog, f"Modbus connection error - Check wiring or modbus slave: {str(e)}")
+
+def publish_powerlog_blocks(client, regmap, blocks, cached, closed):
+    """Decode the powerlog register blocks and publish them with the closed window.
+
+    Everything after the bus reads, shared by the threaded publishPowerlog and
+    the asyncio publish job. `cached` holds the names of blocks that came from
+    the snapshot cache, `closed` is what close_power_window() returned before
+    the reads. Exceptions propagate to the caller, which counts them as
+    Modbus errors like before. If the reads fail the closed window is
+    dropped: carrying it into the next one would mislabel both. The
+    report-by-exception reference only moves once the frame is handed off.
+    """
+    global routerSerial, powerlog_device_serial
+
+    # Sensible defaults so a single failed/optional register read can't leave a
+    # variable undefined and blow up the whole publish further down.
+    operating_hours = 0
+    current_n = 0
+
+    # Convert the device-specific registers to the standardized format
+    if regmap is EMDX_REGISTERS:
+        # Serial number
+        device_serial = blocks["serial"][0]
+
+        # Voltage and current
+        (voltage_l1, voltage_l2, voltage_l3,
+         current_l1, current_l2, current_l3, current_n) = EMDX_VOLTAGE_CURRENT.decode(blocks["voltage_current"])
+
+        block2 = blocks["power"]
+        frequency = blocks["frequency"][0] / 10.0
+        block4 = blocks["consumed_energy"]
+        block5 = blocks["delivered_energy"]
+        block6 = blocks["power_factor"]
+        ct_ratio = blocks["ct_ratio"][0]
+
+        active_power = (block2[0] << 16 | block2[1]) / 1000.0
+        reactive_power = (block2[2] << 16 | block2[3]) / 1000.0
+        apparent_power = (block2[4] << 16 | block2[5]) / 1000.0
+        if ct_ratio < 5000:
+            active_power = active_power * 0.01
+            reactive_power = reactive_power * 0.01
+            apparent_power = apparent_power * 0.01
+        sign_active = block2[6]
+        sign_reactive = block2[7]
+        chained_voltage_l1l2 = (block2[8] << 16 | block2[9]) / 1000.0
+
+        # Operating hours (optional: keeps its default of 0 if unreadable)
+        if "operating_hours" in blocks:
+            operating_hours = blocks["operating_hours"][0]
+
+        # Process values
+        power_factor = block6[0] / 1000.0
+        sector_power_factor = block6[1]
+        print(ct_ratio)
+        print(block4[0] << 16 | block4[1])
+        consumed_energy = scale_energy_by_ct_ratio((block4[0] << 16 | block4[1]), ct_ratio)
+        print(consumed_energy)
+        delivered_energy = scale_energy_by_ct_ratio((block5[0] << 16 | block5[1]), ct_ratio)
+        # Raw u32 counters for the interval deltas; the CT scaling is applied to the delta
+        energy_raw = {"consumed": block4[0] << 16 | block4[1], "delivered": block5[0] << 16 | block5[1]}
+        energy_scale = partial(scale_energy_by_ct_ratio, ct_ratio=ct_ratio)
+        energy_modulus = 2 ** 32
+
+    else:
+        # --- Optimized RMU data collection based on yanitza.py ---
+        main_registers = blocks["main"]
+        block7 = blocks["ct_ratio"]
+        block8 = blocks["serial"]
+        block9 = blocks["operating_hours"]
         
-        # Fold this synchronous sample into the aggregation window, snapshot it into
-        # locals and reset it, all under agg_lock so the 2 Hz polling thread cannot
-        # add samples between the snapshot and the reset (which would lose data).
-        with agg_lock:
-            voltage_l1_min = min(voltage_l1_min, voltage_l1)
-            voltage_l1_max = max(voltage_l1_max, voltage_l1)
-            voltage_l1_sum += voltage_l1
-            voltage_l2_min = min(voltage_l2_min, voltage_l2)
-            voltage_l2_max = max(voltage_l2_max, voltage_l2)
-            voltage_l2_sum += voltage_l2
-            voltage_l3_min = min(voltage_l3_min, voltage_l3)
-            voltage_l3_max = max(voltage_l3_max, voltage_l3)
-            voltage_l3_sum += voltage_l3
-            current_l1_min = min(current_l1_min, current_l1)
-            current_l1_max = max(current_l1_max, current_l1)
-            current_l1_sum += current_l1
-            current_l2_min = min(current_l2_min, current_l2)
-            current_l2_max = max(current_l2_max, current_l2)
-            current_l2_sum += current_l2
-            current_l3_min = min(current_l3_min, current_l3)
-            current_l3_max = max(current_l3_max, current_l3)
-            current_l3_sum += current_l3
-            sample_count += 1
-
-            # Snapshot the window into locals so the rest runs outside the lock
-            snap_count = sample_count
-            n = snap_count if snap_count > 0 else 1
-            v1_min = voltage_l1_min if voltage_l1_min != float('inf') else 0
-            v1_max = voltage_l1_max if voltage_l1_max != float('-inf') else 0
-            v1_avg = voltage_l1_sum / n
-            v2_min = voltage_l2_min if voltage_l2_min != float('inf') else 0
-            v2_max = voltage_l2_max if voltage_l2_max != float('-inf') else 0
-            v2_avg = voltage_l2_sum / n
-            v3_min = voltage_l3_min if voltage_l3_min != float('inf') else 0
-            v3_max = voltage_l3_max if voltage_l3_max != float('-inf') else 0
-            v3_avg = voltage_l3_sum / n
-            c1_min = current_l1_min if current_l1_min != float('inf') else 0
-            c1_max = current_l1_max if current_l1_max != float('-inf') else 0
-            c1_avg = current_l1_sum / n
-            c2_min = current_l2_min if current_l2_min != float('inf') else 0
-            c2_max = current_l2_max if current_l2_max != float('-inf') else 0
-            c2_avg = current_l2_sum / n
-            c3_min = current_l3_min if current_l3_min != float('inf') else 0
-            c3_max = current_l3_max if current_l3_max != float('-inf') else 0
-            c3_avg = current_l3_sum / n
-
-            # Reset the window now that it's safely captured
-            reset_aggregation()
-
-        # Initialize binary data buffer
-        binary_data = bytearray()
-        
-        # Add timestamp (4 bytes)
-        timestamp = int(time.time())
-        binary_data.extend(struct.pack('>I', timestamp))
+        # Process serial number
+        device_serial = (block8[0] << 16) | block8[1]
         
-        # Add registers in exact order expected by JavaScript parser
-        registers = [
-            # Block 8 - Serial number (2 registers)
-            device_serial >> 16,         # High word
-            device_serial & 0xFFFF,      # Low word
-            
-            # Block 1 - Voltage and current (14 registers)
-            # Phase 1 voltage (2 registers)
-            int(voltage_l1 * 1000) >> 16,
-            int(voltage_l1 * 1000) & 0xFFFF,
-            
-            # Phase 2 voltage (2 registers)
-            int(voltage_l2 * 1000) >> 16,
-            int(voltage_l2 * 1000) & 0xFFFF,
-            
-            # Phase 3 voltage (2 registers)
-            int(voltage_l3 * 1000) >> 16,
-            int(voltage_l3 * 1000) & 0xFFFF,
-            
-            # Phase 1 current (2 registers)
-            int(current_l1 * 1000) >> 16,
-            int(current_l1 * 1000) & 0xFFFF,
-            
-            # Phase 2 current (2 registers)
-            int(current_l2 * 1000) >> 16,
-            int(current_l2 * 1000) & 0xFFFF,
-            
-            # Phase 3 current (2 registers)
-            int(current_l3 * 1000) >> 16,
-            int(current_l3 * 1000) & 0xFFFF,
-            
-            # Neutral current (2 registers)
-            int(current_n * 1000) >> 16,
-            int(current_n * 1000) & 0xFFFF,
-            
-            # Block 2 - Power values (10 registers)
-            # 3-phase active power (2 registers)
-            int(active_power * 100) >> 16,
-            int(active_power * 100) & 0xFFFF,
-            
-            # 3-phase reactive power (2 registers)
-            int(reactive_power * 100) >> 16,
-            int(reactive_power * 100) & 0xFFFF,
-            
-            # 3-phase apparent power (2 registers)
-            int(apparent_power * 100) >> 16,
-            int(apparent_power * 100) & 0xFFFF,
-            
-            # Sign of active power (1 register)
-            sign_active,
-            
-            # Sign of reactive power (1 register)
-            sign_reactive,
-            
-            # Chained voltage L1-L2 (2 registers)
-            int(chained_voltage_l1l2 * 1000) >> 16,
-            int(chained_voltage_l1l2 * 1000) & 0xFFFF,
-            
-            # Block 3 - Frequency (1 register)
-            int(min(100, max(0, frequency)) * 10),  # Limit frequency to valid range (0-100 Hz)
-            
-            # Block 4 - Consumed energy (2 registers)
-            int(consumed_energy) >> 16,
-            int(consumed_energy) & 0xFFFF,
-            
-            # Block 5 - Delivered energy (2 registers)
-            int(delivered_energy) >> 16,
-            int(delivered_energy) & 0xFFFF,
-            
-            # Block 6 - Power factor (2 registers)
-            int(power_factor * 100),
-            sector_power_factor,
-            
-            # Block 7 - CT ratio (1 register)
-            ct_ratio,
-            
-            # Add Operating Hours (1 register)
-            int(operating_hours)
-        ]
+        # All 43 floats of 19000-19085 in one decode; float k is register 19000 + 2k
+        main_floats = RMU_MAIN.decode(main_registers)
+
+        # Voltage values
+        voltage_l1, voltage_l2, voltage_l3 = main_floats[0:3]
+
+        # Current values - offset by 12 from start (19012-19000)
+        current_l1, current_l2, current_l3, current_n = main_floats[6:10]
+
+        # Power values (offsets calculated from their original addresses)
+        active_power = main_floats[13] / 1000       # 19026
+        apparent_power = main_floats[17] / 1000     # 19034
+        reactive_power = main_floats[21] / 1000     # 19042
+
+        # Frequency (original block3) - offset by 50 from start (19050-19000)
+        frequency = main_floats[25]
+
+        # Energy values and power factor
+        consumed_energy = main_floats[34]           # 19068
+        delivered_energy = main_floats[38]          # 19076
+        # Guard against zero load: apparent_power == 0 would raise ZeroDivisionError
+        power_factor = (active_power / apparent_power / 10) if apparent_power else 0
+        sector_power_factor = 0  # May not be available
+        ct_ratio = block7[0]  # Use primary CT ratio
+        # Float counters in the published unit: no scaling, no wrap
+        energy_raw = {"consumed": consumed_energy, "delivered": delivered_energy}
+        energy_scale = lambda value: value
+        energy_modulus = None
         
-        # Add all registers to binary data
-        for reg in registers:
-            binary_data.extend(struct.pack('>H', reg & 0xFFFF))
+        # Get operating hours
+        operating_hours = round(struct.unpack('>I', struct.pack('>HH', block9[0], block9[1]))[0] / 3600, 1)
+        print(operating_hours)
+        # Set signs to 0 as they might not be directly available
+        sign_active = 0
+        sign_reactive = 0
         
-        # Add aggregated values (19 values, 4 bytes each) from the locked snapshot
-        aggregated_values = [
-            int(v1_min * 1000),
-            int(v1_max * 1000),
-            int(v1_avg * 1000),
-            int(v2_min * 1000),
-            int(v2_max * 1000),
-            int(v2_avg * 1000),
-            int(v3_min * 1000),
-            int(v3_max * 1000),
-            int(v3_avg * 1000),
-            int(c1_min * 1000),
-            int(c1_max * 1000),
-            int(c1_avg * 1000),
-            int(c2_min * 1000),
-            int(c2_max * 1000),
-            int(c2_avg * 1000),
-            int(c3_min * 1000),
-            int(c3_max * 1000),
-            int(c3_avg * 1000),
-            snap_count
-        ]
-
-        for value in aggregated_values:
-            binary_data.extend(struct.pack('>I', value & 0xffffffff))
-
-        # Append the router (modem) serial so the backend/UI can link this
-        # powerlogger to its modem while everyone keeps publishing to the same
-        # flat topic. Placed at the very END as an 8-byte big-endian uint64 so the
-        # existing JS parser (which reads fixed offsets from the start) stays
-        # compatible; the new parser reads these trailing 8 bytes as routerSerial.
-        try:
-            router_serial_int = int(routerSerial)
-        except (ValueError, TypeError):
-            router_serial_int = 0
-        binary_data.extend(struct.pack('>Q', router_serial_int & 0xFFFFFFFFFFFFFFFF))
-
-        print(f"Binary data size: {len(binary_data)} bytes")
-        topicPower = f"{topicPowerBase}/{device_serial}/data"
-        # Tracked publish: hard rejections go to the retry queue immediately,
-        # soft losses (accepted but never PUBACK'ed) are caught by the sweep.
-        # bytes(): immutable snapshot, safe to hold in queues.
-        publish_tracked(client, topicPower, bytes(binary_data))
-
-    except Exception as e:
-        count_modbus_error()
-        logMQTT(client, topicLog, f"Modbus connection error - Check wiring or modbus slave: {str(e)}")
+        # No chained voltage in RMU
+        chained_voltage_l1l2 = 0
+
+    # The window was closed on the boundary before the reads. This sample was
+    # read after it, so it goes into the new window - unless the closed one
+    # is empty (poller not running), where it stands in as before.
+    # A voltage/current block taken from the snapshot cache IS the poller's
+    # last sample, already in a window - folding it again would count it twice.
+    window, quantities, window_start, window_end, report = closed
+    if "voltage_current" not in cached:
+        sample = (voltage_l1, voltage_l2, voltage_l3, current_l1, current_l2, current_l3)
+        if window.count == 0:
+            window.add(sample)
+        else:
+            with agg_lock:
+                power_window.add(sample)
+    snap_count = window.count
+    ((v1_min, v1_max, v1_avg), (v2_min, v2_max, v2_avg), (v3_min, v3_max, v3_avg),
+     (c1_min, c1_max, c1_avg), (c2_min, c2_max, c2_avg), (c3_min, c3_max, c3_avg)) = window.stats()
+    # The frame layout, packing and the sections live in powerlog_codec.py,
+    # shared with multi_emdx_logger.py
+    measurement = dict(
+        device_serial=device_serial,
+        voltage_l1=voltage_l1, voltage_l2=voltage_l2, voltage_l3=voltage_l3,
+        current_l1=current_l1, current_l2=current_l2, current_l3=current_l3, current_n=current_n,
+        active_power=active_power, reactive_power=reactive_power, apparent_power=apparent_power,
+        sign_active=sign_active, sign_reactive=sign_reactive,
+        chained_voltage_l1l2=chained_voltage_l1l2,
+        frequency=frequency,
+        consumed_energy=consumed_energy, delivered_energy=delivered_energy,
+        power_factor=power_factor, sector_power_factor=sector_power_factor,
+        ct_ratio=ct_ratio, operating_hours=operating_hours,
+    )
+
+    # Aggregated values (19 values) from the closed window
+    aggregated_values = [
+        int(v1_min * 1000),
+        int(v1_max * 1000),
+        int(v1_avg * 1000),
+        int(v2_min * 1000),
+        int(v2_max * 1000),
+        int(v2_avg * 1000),
+        int(v3_min * 1000),
+        int(v3_max * 1000),
+        int(v3_avg * 1000),
+        int(c1_min * 1000),
+        int(c1_max * 1000),
+        int(c1_avg * 1000),
+        int(c2_min * 1000),
+        int(c2_max * 1000),
+        int(c2_avg * 1000),
+        int(c3_min * 1000),
+        int(c3_max * 1000),
+        int(c3_avg * 1000),
+        snap_count
+    ]
+
+    # Optional tagged sections, each starting with its tag byte, between the
+    # window times and the router serial
+    sections = []
+    extended = window.extended_stats()
+    if extended is not None:
+        sections.append(powerlog_codec.pack_window_stats(window.extended[0].config, extended))
+    if quantities.channels:
+        sections.append(powerlog_codec.pack_quantity_aggregates(quantities.count, quantities.channels,
+                                                                quantities.stats()))
+    energy_flags, energy_since, energy_deltas, energy_reading = energy_tracker.update(
+        device_serial, ct_ratio, energy_raw, window_end, scale=energy_scale, modulus=energy_modulus)
+    sections.append(powerlog_codec.pack_energy_deltas(energy_flags, energy_since, energy_deltas))
+    quantity_window.recycle(quantities)
+
+    # The router (modem) serial goes last so the backend/UI can link this
+    # powerlogger to its modem while everyone keeps publishing to the same
+    # flat topic: an 8-byte big-endian uint64 at the very END, so the
+    # existing JS parser (which reads fixed offsets from the start) stays
+    # compatible; the new parser reads these trailing 8 bytes as routerSerial.
+    # Window start/end come right after the fixed part.
+    try:
+        router_serial_int = int(routerSerial)
+    except (ValueError, TypeError):
+        router_serial_int = 0
+    v2 = powerlog_v2
+    if v2 is not None:
+        payload = v2.encode(window_end, measurement, aggregated_values, (window_start, window_end),
+                            sections, router_serial_int)
+    else:
+        payload = powerlog_codec.encode(window_end, measurement, aggregated_values,
+                                        window=(window_start, window_end), sections=sections,
+                                        router_serial=router_serial_int)
+
+    power_window.recycle(window)
+
+    powerlog_device_serial = device_serial
+    print(f"Binary data size: {len(payload)} bytes")
+    topicPower = f"{topicPowerBase}/{device_serial}/data"
+    # Tracked publish: hard rejections go to the retry queue immediately,
+    # soft losses (accepted but never PUBACK'ed) are caught by the sweep.
+    publish_tracked(client, topicPower, payload)
+    # Only now is this window what the backend has: the energy baseline,
+    # the deadbands and the heartbeat count from it. A failed cycle leaves
+    # the next delta covering both intervals, and the next window due.
+    energy_tracker.commit(energy_reading)
+    if report is not None:
+        rbe, closed_at, values = report
+        rbe.published(closed_at, values)
 
 def publishModemlog(client):
     global routerSerial
@@ -1260,53 +1662,126 @@ def publishModemlog(client):
             imsiData = tcpClient.read_holding_registers(348, count=8)
             wanipData = tcpClient.read_holding_registers(139, count=2)  # WAN IP address registers
 
-        if rssiBlock.isError() or imsiData.isError() or wanipData.isError():
-            logMQTT(client, topicLog, "Error reading modem registers over TCP")
-            return
+        send_modemlog(client, rssiBlock, imsiData, wanipData)
+    except Exception as e:
+        logMQTT(client, topicLog, f"Modem log error - Check wiring or modem TCP link: {str(e)}")
 
-        rssiData = ''.join('{:02x}'.format(b) for b in rssiBlock.registers)
-        rssi = int(rssiData, 16) - 0x10000 if int(rssiData, 16) > 0x7FFF else int(rssiData, 16)
-        imsi = bytes.fromhex(''.join('{:02x}'.format(b) for b in imsiData.registers))[:-1].decode("ASCII")
-        wanipint = (wanipData.registers[0] << 16) | wanipData.registers[1]
-        wanip = '.'.join(str((wanipint >> (8 * i)) & 0xFF) for i in range(3, -1, -1))
+def send_modemlog(client, rssiBlock, imsiData, wanipData):
+    """Build and publish the modemlog from the three TCP register reads.
 
-        with stats_lock:
-            mb_errors = modbus_error_count
-            pub_timeouts = publish_timeouts
-        with retry_lock:
-            retry_depth = len(retry_queue)
+    Shared by the threaded publishModemlog and the asyncio modem job.
+    """
+    if rssiBlock.isError() or imsiData.isError() or wanipData.isError():
+        logMQTT(client, topicLog, "Error reading modem registers over TCP")
+        return
 
-        # Convert to a dotted quad IP string
-        message = {
-            "timestamp": time.time(),
-            "modemSerial": int(routerSerial) if routerSerial.isdigit() else routerSerial,
-            "RSSI": rssi,
-            "IMSI": int(imsi) if imsi.isdigit() else imsi,  # Add the full IMSI as a readable string
-            "IP": wanip,
-            "modbusErrors": mb_errors,   # cumulative failed RTU reads since script start
-            "retryQueue": retry_depth,   # powerlog messages currently held for retry
-            "pubTimeouts": pub_timeouts, # cumulative PUBACK timeouts (soft losses caught)
-            "FW": "1.0.7"
-        }
-        topicModem = f"{topicModemBase}/{routerSerial}/data"
-        # qos=1 so modem/RSSI history around an outage is queued and delivered
-        # after reconnect instead of silently dropped (qos=0 is fire-and-forget).
-        result = client.publish(topicModem, json.dumps(message), qos=1)
-        status = result[0]
-        if not status == 0:
-            print(f'Failed to send message to topic {topicModem}')
-    except Exception as e:
-        logMQTT(client, topicLog, f"Modem log error - Check wiring or modem TCP link: {str(e)}")
+    rssiData = ''.join('{:02x}'.format(b) for b in rssiBlock.registers)
+    rssi = int(rssiData, 16) - 0x10000 if int(rssiData, 16) > 0x7FFF else int(rssiData, 16)
+    imsi = bytes.fromhex(''.join('{:02x}'.format(b) for b in imsiData.registers))[:-1].decode("ASCII")
+    wanipint = (wanipData.registers[0] << 16) | wanipData.registers[1]
+    wanip = '.'.join(str((wanipint >> (8 * i)) & 0xFF) for i in range(3, -1, -1))
+
+    with stats_lock:
+        mb_errors = modbus_error_count
+        pub_timeouts = publish_timeouts
+        batches = batches_sent
+        reads, read_total, read_max = mb_read_time
+    with retry_lock:
+        retry_depth = len(retry_queue)
+        retry_disk = retry_queue.snapshot()
+    cache_hits, cache_misses = register_cache.stats()
+    bus_sched = bus_scheduler.stats.snapshot()
+    learned_timeouts = rtu_timeouts.snapshot()
+    breakers = rtu_breakers.snapshot()
+    bus = bus_stats.summary()
+    poll = poll_rate.snapshot()
+    powerlog = powerlog_rate.snapshot()
+
+    # Convert to a dotted quad IP string
+    message = {
+        "timestamp": time.time(),
+        "modemSerial": int(routerSerial) if routerSerial.isdigit() else routerSerial,
+        "RSSI": rssi,
+        "IMSI": int(imsi) if imsi.isdigit() else imsi,  # Add the full IMSI as a readable string
+        "IP": wanip,
+        "modbusErrors": mb_errors,   # cumulative failed RTU reads since script start
+        "retryQueue": retry_depth,   # powerlog messages currently held for retry
+        "retryDisk": retry_disk,     # on-disk retry queue: bytes, segments, dropped, fsyncs
+        "pubTimeouts": pub_timeouts, # cumulative PUBACK timeouts (soft losses caught)
+        "batches": batches,          # cumulative batch messages sent draining the backlog
+        "drain": drain_planner.snapshot(), # link rate (B/s), compression ratio, last batch size/level
+        "regCacheHits": cache_hits,     # cumulative register blocks served from the snapshot cache
+        "regCacheMisses": cache_misses, # cumulative cache lookups that had to go to the bus
+        "busSched": bus_sched,          # per priority class: served/expired, queue wait, service time
+        "rtuTimeouts": learned_timeouts, # per slave/function code: learned latency and timeout
+        "breakers": breakers,           # per slave: breaker state, cumulative opened/closed/skipped
+        "bus": bus,                     # RTU bus: duty cycle since last modemlog, bytes, latency, error classes
+        "pollRate": poll,               # requested vs achieved poll rate, missed deadlines
+        "powerlogRate": powerlog,       # same for the powerlog publish
+        "mbRead": {                     # cumulative RTU read wall time with the framing in use
+            "framing": RTU_FRAMING,
+            "n": reads,
+            "avgMs": round(read_total / reads * 1000, 2) if reads else 0,
+            "maxMs": round(read_max * 1000, 2),
+        },
+        "events": event_detector.events, # power quality events published by the current detector
+        "rbe": powerlog_filter.snapshot() if powerlog_filter else None, # report-by-exception: windows sent/suppressed
+        "format": 1 if powerlog_v2 is None else 2, # powerlog payload format version
+        "FW": "1.0.7"
+    }
+    topicModem = f"{topicModemBase}/{routerSerial}/data"
+    # qos=1 so modem/RSSI history around an outage is queued and delivered
+    # after reconnect instead of silently dropped (qos=0 is fire-and-forget).
+    result = client.publish(topicModem, json.dumps(message), qos=1)
+    status = result[0]
+    if not status == 0:
+        print(f'Failed to send message to topic {topicModem}')
+
+# Voltage/current poll rate. The polls run at absolute deadlines (pacing.py),
+# so a window of sendInterval seconds holds sendInterval * rate samples
+# (+-1), whatever the read time. Settable at runtime with {"pollRate": Hz}
+# on the config topic, within POLL_RATE_MIN..POLL_RATE_MAX and within what
+# the bus allows: the poll may take at most POLL_BUS_SHARE of the bus time,
+# judged by how long a poll actually takes on this site.
+POLL_RATE_HZ = 5.0
+POLL_RATE_MIN = 0.5
+POLL_RATE_MAX = 10.0
+POLL_BUS_SHARE = 0.5
+POLL_INTERVAL = 1.0 / POLL_RATE_HZ  # seconds between poll deadlines
+
+# Requested vs. achieved rates and missed deadlines, reported in the modemlog
+poll_rate = RateStats("poll")
+powerlog_rate = RateStats("powerlog")
+
+def set_poll_rate(hz):
+    """Apply a requested poll rate, clamped; returns the rate in effect."""
+    global POLL_RATE_HZ, POLL_INTERVAL
+    limit = POLL_RATE_MAX
+    poll_time = poll_rate.job_time()
+    if poll_time:
+        limit = min(limit, POLL_BUS_SHARE / poll_time)
+    POLL_RATE_HZ = max(POLL_RATE_MIN, min(float(hz), limit))
+    POLL_INTERVAL = 1.0 / POLL_RATE_HZ
+    return POLL_RATE_HZ
 
 def voltage_current_polling():
-    global polling_active
-    while polling_active:
-        try:
-            poll_voltage_and_current()
-            time.sleep(0.2)  # Poll at 2Hz (twice per second)
-        except Exception as e:
-            print(f"Error in polling thread: {e}")
-            time.sleep(1)  # Wait a bit longer if there's an error
+    run_periodic(lambda: POLL_INTERVAL, poll_voltage_and_current, "poll",
+                 stats=poll_rate, running=lambda: polling_active)
+
+def powerlog_cycle():
+    try:
+        # Order matters: close the window on the boundary first - the sweep
+        # and the backlog flush can take a while, and samples polled
+        # meanwhile belong to the next window. Then reclaim publishes whose
+        # PUBACK never came (presumed lost in paho's inflight queue), retry
+        # the backlog, and publish the fresh measurement.
+        closed = close_power_window()
+        sweep_pending()
+        sync_retry_queue()
+        flush_retry_queue(client)
+        publishPowerlog(client, closed)
+    except Exception:
+        modbusConnect(modbusclient)
 
 def powerLoop():
     global polling_active
@@ -1315,18 +1790,13 @@ def powerLoop():
     # Start the polling thread
     polling_thread = threading.Thread(target=voltage_current_polling, daemon=True)
     polling_thread.start()
+    rollup_thread = threading.Thread(target=run_periodic, args=(ROLLUP_BASE, rollup_cycle, "rollup"),
+                                     kwargs={"align": True}, daemon=True)
+    rollup_thread.start()
     
-    while True:
-        try:
-            # Order matters: first reclaim publishes whose PUBACK never came
-            # (presumed lost in paho's inflight queue), then retry the backlog,
-            # then publish the fresh measurement. All non-blocking.
-            sweep_pending()
-            flush_retry_queue(client)
-            publishPowerlog(client)
-        except Exception:
-            modbusConnect(modbusclient)
-        time.sleep(sendInterval)
+    # Every sendInterval on wall-clock boundaries: a slow publish no longer
+    # shifts all the following ones, and windows line up across routers.
+    run_periodic(lambda: sendInterval, powerlog_cycle, "powerlog", stats=powerlog_rate, align=True)
 
 def modemLoop():
     global topicLog
@@ -1343,6 +1813,176 @@ def modemLoop():
             modbusTcpConnect(tcpClient)
         time.sleep(300)
 
+# --- asyncio runtime ------------------------------------------------------
+# Same jobs as powerLoop / voltage_current_polling / modemLoop /
+# connectionWatchdog, as coroutines on one event loop. All RTU traffic goes
+# through rtu_bus and all TCP traffic through tcp_bus: one owner task per
+# transport serving a priority queue, so bus_scheduler and tcp_lock are not
+# needed here; the RTU bus owner reports into the same scheduler stats.
+# The register planning, caching, decoding, aggregation and publishing code
+# is shared with the threaded runtime.
+rtu_bus = None
+tcp_bus = None
+async_loop = None
+
+async def amb_read(address, count=1, slave=1, priority=PRIO_PUBLISH, deadline=None):
+    """mb_read for the asyncio runtime: same error counting and cache invalidation."""
+    try:
+        result = await rtu_bus.read(address, count=count, slave=slave, priority=priority, deadline=deadline)
+    except DeadlineExpired:
+        raise
+    except Exception:
+        register_cache.invalidate(slave)
+        rtu_breakers.failure(slave)
+        raise
+    check_read_result(result, slave)
+    return result
+
+async def rtu_slave_ready_async(regmap, slave):
+    """rtu_slave_ready for the asyncio runtime."""
+    verdict = rtu_breakers.get(slave).acquire()
+    if verdict == HALF_OPEN:
+        address, count = regmap.blocks["serial"]
+        try:
+            await amb_read(address, count=count, slave=slave, priority=PRIO_TELEMETRY)
+        except Exception as e:
+            # amb_read has already fed the failure to the breaker
+            print(f"Breaker probe of slave {slave} failed: {e}")
+        return rtu_breakers.get(slave).state == CLOSED
+    return verdict == CLOSED
+
+async def async_poll_job():
+    try:
+        plan = poll_read_plan()
+        if plan is None:
+            return
+        regmap, names, slave = plan
+        if not await rtu_slave_ready_async(regmap, slave):
+            return
+        read_fn = partial(amb_read, priority=PRIO_POLL, deadline=time.monotonic() + POLL_INTERVAL)
+        dynamic, static = poll_block_names(regmap, names)
+        blocks, error = await read_blocks_async(read_fn, regmap, dynamic, slave,
+                                                cache=register_cache, store_ttl=POLL_SNAPSHOT_TTL, lookup=False)
+        if error is None and static:
+            static_blocks, error = await read_blocks_async(read_fn, regmap, static, slave, cache=register_cache)
+            blocks.update(static_blocks)
+        if error is not None:
+            print(f"Error reading {regmap.name} voltage and current registers")
+            return
+        fold_poll_sample(regmap, blocks)
+    except DeadlineExpired:
+        pass
+    except Exception as e:
+        count_modbus_error()
+        print(f"Error polling voltage and current: {e}")
+
+async def async_publish_job():
+    # Same order as powerlog_cycle: close the window on the boundary,
+    # reclaim unconfirmed publishes, retry the backlog, then the fresh
+    # measurement.
+    closed = close_power_window()
+    sweep_pending()
+    # fsync and cursor write: keep them off the event loop
+    await asyncio.get_running_loop().run_in_executor(None, sync_retry_queue)
+    flush_retry_queue(client)
+    if closed is None:
+        return
+    try:
+        plan = powerlog_read_plan()
+        if plan is None:
+            return
+        regmap, names, slaveid = plan
+        if not await rtu_slave_ready_async(regmap, slaveid):
+            return
+        cached = set()
+        blocks, error = await read_blocks_async(amb_read, regmap, names, slaveid,
+                                                cache=register_cache, cached=cached)
+        if error is not None:
+            print(f"Error reading {regmap.name} registers: {error}")
+            return
+        publish_powerlog_blocks(client, regmap, blocks, cached, closed)
+    except Exception as e:
+        count_modbus_error()
+        logMQTT(client, topicLog, f"Modbus connection error - Check wiring or modbus slave: {str(e)}")
+
+async def async_rollup_job():
+    # Only publishes (non-blocking): nothing to await
+    rollup_cycle()
+
+async def async_modem_job():
+    try:
+        rssiBlock = await tcp_bus.read(4, count=1)
+        imsiData = await tcp_bus.read(348, count=8)
+        wanipData = await tcp_bus.read(139, count=2)  # WAN IP address registers
+        send_modemlog(client, rssiBlock, imsiData, wanipData)
+    except Exception as e:
+        logMQTT(client, topicLog, f"Modem log error - Check wiring or modem TCP link: {str(e)}")
+
+async def reboot_modem_async():
+    try:
+        await tcp_bus.write_register(206, 1)
+    except Exception:
+        logMQTT(client, topicLog, "Reboot failed, or pending...")
+    else:
+        logMQTT(client, topicLog, "Rebooting modem...")
+
+async def toggle_connection_async():
+    """toggleConnection for the asyncio runtime - same fail-safe data-ON logic."""
+    logMQTT(client, topicLog, "Toggling mobile data connection (register 204: off -> on)")
+    data_off_written = False
+    try:
+        await tcp_bus.write_register(204, 0)   # mobile data OFF
+        data_off_written = True
+        await asyncio.sleep(DATA_TOGGLE_OFF_TIME)
+        return True
+    except Exception as e:
+        print(f"Connection toggle failed: {e}")
+        return False
+    finally:
+        if data_off_written:
+            for attempt in range(1, 6):
+                try:
+                    await tcp_bus.write_register(204, 1)   # mobile data ON
+                    print(f"Mobile data re-enabled (attempt {attempt})")
+                    break
+                except Exception as e:
+                    print(f"Data-ON write failed (attempt {attempt}): {e}")
+                await asyncio.sleep(2)
+            else:
+                print("Could not re-enable mobile data after retries - rebooting device")
+                await reboot_modem_async()
+
+async def run_async():
+    """Entry point of the asyncio runtime; replaces the four worker threads."""
+    global rtu_bus, tcp_bus, async_loop
+    async_loop = asyncio.get_running_loop()
+    # reconnect_delay=0: the bus owner reconnects on demand before the next
+    # request, pymodbus must not run a reconnect loop of its own beside it.
+    rtu_bus = BusOwner(AsyncModbusSerialClient(reconnect_delay=0, **RTU_SETTINGS), "Modbus RTU",
+                       on_connect=register_cache.invalidate, stats=bus_scheduler.stats,
+                       timeouts=rtu_timeouts, observer=record_rtu_transaction)
+    tcp_bus = BusOwner(AsyncModbusTcpClient(reconnect_delay=0, **TCP_SETTINGS), "Modbus TCP")
+
+    watchdog_state = new_watchdog_state()
+
+    async def watchdog_job():
+        action = watchdog_check(watchdog_state)
+        if action == "rebuild":
+            # client.connect() blocks on DNS/TCP: keep it off the event loop.
+            await async_loop.run_in_executor(None, rebuild_mqtt_client)
+        elif action == "toggle":
+            await toggle_connection_async()
+
+    await asyncio.gather(
+        rtu_bus.run(),
+        tcp_bus.run(),
+        periodic(lambda: POLL_INTERVAL, async_poll_job, "poll", stats=poll_rate),
+        periodic(lambda: sendInterval, async_publish_job, "powerlog", stats=powerlog_rate, align=True),
+        periodic(ROLLUP_BASE, async_rollup_job, "rollup", align=True),
+        periodic(300, async_modem_job, "modemlog"),
+        periodic(WATCHDOG_CHECK_INTERVAL, watchdog_job, "watchdog"),
+    )
+
 # MQTT
 
 # These values get set up after all functions are defined
@@ -1504,8 +2144,10 @@ if __name__ == "__main__":
     # Start the connection watchdog now that the MQTT client exists: while the
     # broker is unreachable it alternates between toggling mobile data
     # (register 204) and rebuilding the MQTT client, every 5 minutes.
-    thread_watchdog = threading.Thread(target=connectionWatchdog, daemon=True)
-    thread_watchdog.start()
+    # (The asyncio runtime runs it as a coroutine instead.)
+    if not ASYNC_RUNTIME:
+        thread_watchdog = threading.Thread(target=connectionWatchdog, daemon=True)
+        thread_watchdog.start()
 
     # Now connect to Modbus
     modbusConnect(modbusclient)
@@ -1560,6 +2202,22 @@ if __name__ == "__main__":
         slaveid = 49
         print(f"RMU connected")
         #rmu_update_ct_settings(400,1)
+
+    # Provisioning is done: fill the static-register cache so the first
+    # publishes don't have to read serial number and CT ratio again.
+    prime_static_registers()
+
+    if ASYNC_RUNTIME:
+        # Startup (router serial, detection, provisioning) ran on the sync
+        # clients above; from here on the async clients own the transports.
+        modbusTcpConnect(tcpClient)
+        logMQTT(client, topicLog, "Node is connected to broker with proper topics!")
+        bus_scheduler.submit(PRIO_PROVISIONING, modbusclient.close)
+        with tcp_lock:
+            tcpClient.close()
+        print("Starting asyncio runtime")
+        asyncio.run(run_async())
+
     thread_modemLoop = threading.Thread(target=modemLoop, daemon=True)
     thread_powerLoop = threading.Thread(target=powerLoop, daemon=True)
     
@@ -1,11 +1,13 @@
 import json
 import time
-import struct
 import threading
 from pymodbus.client.serial import ModbusSerialClient
 from paho.mqtt import client as mqtt_client
 import uuid
 from datetime import datetime
+from regmap import EMDX_REGISTERS, read_blocks
+from breaker import BreakerBoard, OPEN
+import powerlog_codec
 
 # Load credentials
 json_file_path = r".secrets/credentials.json"
@@ -16,8 +18,11 @@ with open(json_file_path, "r") as f:
 LOGGER_COUNT = 5
 LOGGER_ADDRESSES = [1, 2, 3, 4, 5]  # Modbus addresses for the 5 loggers
 SEND_INTERVAL = 10  # seconds between data sends
-RECONNECT_DELAY = 5  # seconds to wait before reconnecting failed loggers
+RECONNECT_DELAY = 5  # seconds to wait before the first reconnect attempt of a failed logger
+MAX_RECONNECT_DELAY = 300  # reconnect attempts back off (with jitter) up to this
 POLLING_INTERVAL = 0.2  # seconds between voltage/current polls
+EMDX_BLOCKS = ["serial", "voltage_current", "power", "frequency", "consumed_energy",
+               "delivered_energy", "power_factor", "ct_ratio", "operating_hours"]
 
 # Global variables
 routerSerial = "0000000000000000"
@@ -30,6 +35,13 @@ logger_data = {}
 logger_threads = {}
 logger_lock = threading.Lock()
 
+# One circuit breaker per logger: an offline logger is probed (serial
+# register) after RECONNECT_DELAY, then 2x, 4x, ... up to MAX_RECONNECT_DELAY
+# instead of every RECONNECT_DELAY forever, so five dead addresses do not
+# keep the shared bus busy with timeouts.
+logger_breakers = BreakerBoard(failure_threshold=1, base_delay=RECONNECT_DELAY,
+                               max_delay=MAX_RECONNECT_DELAY)
+
 # MQTT client setup
 client_id = f"multi-logger-{uuid.uuid4()}"
 client = None
@@ -87,74 +99,46 @@ def emdx_check_connection(slaveid):
 def emdx_read_data(slaveid):
     """Read all data from EMDX logger"""
     try:
-        # Read serial number
-        block8 = modbusclient.read_holding_registers(int(0x2213), count=1, slave=slaveid)
-        if block8.isError():
+        # One planned set of merged reads instead of nine single ones (see
+        # regmap.EMDX_REGISTERS) - with five loggers on one bus this matters.
+        blocks, error = read_blocks(modbusclient.read_holding_registers, EMDX_REGISTERS, EMDX_BLOCKS, slaveid)
+        if error is not None:
             return None
-        device_serial = block8.registers[0]
+        device_serial = blocks["serial"][0]
         
-        # Read voltage and current registers
-        block1 = modbusclient.read_holding_registers(int(0x1000), count=14, slave=slaveid)
-        if block1.isError():
-            return None
-            
         # Extract voltage values
-        voltage_l1 = (block1.registers[0] << 16 | block1.registers[1]) / 1000.0
-        voltage_l2 = (block1.registers[2] << 16 | block1.registers[3]) / 1000.0
-        voltage_l3 = (block1.registers[4] << 16 | block1.registers[5]) / 1000.0
+        block1 = blocks["voltage_current"]
+        voltage_l1 = (block1[0] << 16 | block1[1]) / 1000.0
+        voltage_l2 = (block1[2] << 16 | block1[3]) / 1000.0
+        voltage_l3 = (block1[4] << 16 | block1[5]) / 1000.0
         
         # Extract current values
-        current_l1 = (block1.registers[6] << 16 | block1.registers[7]) / 1000.0
-        current_l2 = (block1.registers[8] << 16 | block1.registers[9]) / 1000.0
-        current_l3 = (block1.registers[10] << 16 | block1.registers[11]) / 1000.0
-        current_n = (block1.registers[12] << 16 | block1.registers[13]) / 1000.0
-        
-        # Read power values
-        block2 = modbusclient.read_holding_registers(int(0x1014), count=10, slave=slaveid)
-        if block2.isError():
-            return None
-        
-        active_power = (block2.registers[0] << 16 | block2.registers[1]) / 1000.0
-        reactive_power = (block2.registers[2] << 16 | block2.registers[3]) / 1000.0
-        apparent_power = (block2.registers[4] << 16 | block2.registers[5]) / 1000.0
-        
-        # Read frequency
-        block3 = modbusclient.read_holding_registers(int(0x1026), count=1, slave=slaveid)
-        if block3.isError():
-            return None
-        frequency = block3.registers[0] / 10.0
-        
-        # Read energy values
-        block4 = modbusclient.read_holding_registers(int(0x101c), count=2, slave=slaveid)
-        if block4.isError():
-            return None
-        
-        block5 = modbusclient.read_holding_registers(int(0x1020), count=2, slave=slaveid)
-        if block5.isError():
-            return None
-        
-        # Read power factor
-        block6 = modbusclient.read_holding_registers(int(0x1024), count=2, slave=slaveid)
-        if block6.isError():
-            return None
-        
-        # Read CT ratio
-        block7 = modbusclient.read_holding_registers(int(0x1200), count=1, slave=slaveid)
-        if block7.isError():
-            return None
-        
-        # Read operating hours
-        block9 = modbusclient.read_holding_registers(int(0x106E), count=1, slave=slaveid)
-        operating_hours = block9.registers[0] if not block9.isError() else 0
+        current_l1 = (block1[6] << 16 | block1[7]) / 1000.0
+        current_l2 = (block1[8] << 16 | block1[9]) / 1000.0
+        current_l3 = (block1[10] << 16 | block1[11]) / 1000.0
+        current_n = (block1[12] << 16 | block1[13]) / 1000.0
+        
+        # Power values
+        block2 = blocks["power"]
+        active_power = (block2[0] << 16 | block2[1]) / 1000.0
+        reactive_power = (block2[2] << 16 | block2[3]) / 1000.0
+        apparent_power = (block2[4] << 16 | block2[5]) / 1000.0
+        
+        frequency = blocks["frequency"][0] / 10.0
+        block4 = blocks["consumed_energy"]
+        block5 = blocks["delivered_energy"]
+        block6 = blocks["power_factor"]
+        block7 = blocks["ct_ratio"]
+        operating_hours = blocks["operating_hours"][0] if "operating_hours" in blocks else 0
         
         # Process values
-        power_factor = block6.registers[0] / 1000.0
-        sector_power_factor = block6.registers[1]
-        ct_ratio = block7.registers[0]
+        power_factor = block6[0] / 1000.0
+        sector_power_factor = block6[1]
+        ct_ratio = block7[0]
         
         # Scale energy values based on CT ratio
-        consumed_energy = scale_energy_by_ct_ratio((block4.registers[0] << 16 | block4.registers[1]), ct_ratio)
-        delivered_energy = scale_energy_by_ct_ratio((block5.registers[0] << 16 | block5.registers[1]), ct_ratio)
+        consumed_energy = scale_energy_by_ct_ratio((block4[0] << 16 | block4[1]), ct_ratio)
+        delivered_energy = scale_energy_by_ct_ratio((block5[0] << 16 | block5[1]), ct_ratio)
         
         # Apply power scaling for low CT ratios
         if ct_ratio < 5000:
@@ -162,9 +146,9 @@ def emdx_read_data(slaveid):
             reactive_power = reactive_power * 0.01
             apparent_power = apparent_power * 0.01
         
-        sign_active = block2.registers[6]
-        sign_reactive = block2.registers[7]
-        chained_voltage_l1l2 = (block2.registers[8] << 16 | block2.registers[9]) / 1000.0
+        sign_active = block2[6]
+        sign_reactive = block2[7]
+        chained_voltage_l1l2 = (block2[8] << 16 | block2[9]) / 1000.0
         
         return {
             'device_serial': device_serial,
@@ -338,104 +322,12 @@ def emdx_insertStandardSettings(slaveid):
 def publish_logger_data(slaveid, data):
     """Publish logger data to MQTT"""
     try:
-        # Create binary data format (same as original main.py)
-        binary_data = bytearray()
-        
-        # Add timestamp (4 bytes)
-        timestamp = int(time.time())
-        binary_data.extend(struct.pack('>I', timestamp))
-        
-        # Add registers in exact order expected by JavaScript parser
-        registers = [
-            # Block 8 - Serial number (2 registers)
-            data['device_serial'] >> 16,         # High word
-            data['device_serial'] & 0xFFFF,      # Low word
-            
-            # Block 1 - Voltage and current (14 registers)
-            # Phase 1 voltage (2 registers)
-            int(data['voltage_l1'] * 1000) >> 16,
-            int(data['voltage_l1'] * 1000) & 0xFFFF,
-            
-            # Phase 2 voltage (2 registers)
-            int(data['voltage_l2'] * 1000) >> 16,
-            int(data['voltage_l2'] * 1000) & 0xFFFF,
-            
-            # Phase 3 voltage (2 registers)
-            int(data['voltage_l3'] * 1000) >> 16,
-            int(data['voltage_l3'] * 1000) & 0xFFFF,
-            
-            # Phase 1 current (2 registers)
-            int(data['current_l1'] * 1000) >> 16,
-            int(data['current_l1'] * 1000) & 0xFFFF,
-            
-            # Phase 2 current (2 registers)
-            int(data['current_l2'] * 1000) >> 16,
-            int(data['current_l2'] * 1000) & 0xFFFF,
-            
-            # Phase 3 current (2 registers)
-            int(data['current_l3'] * 1000) >> 16,
-            int(data['current_l3'] * 1000) & 0xFFFF,
-            
-            # Neutral current (2 registers)
-            int(data['current_n'] * 1000) >> 16,
-            int(data['current_n'] * 1000) & 0xFFFF,
-            
-            # Block 2 - Power values (10 registers)
-            # 3-phase active power (2 registers)
-            int(data['active_power'] * 100) >> 16,
-            int(data['active_power'] * 100) & 0xFFFF,
-            
-            # 3-phase reactive power (2 registers)
-            int(data['reactive_power'] * 100) >> 16,
-            int(data['reactive_power'] * 100) & 0xFFFF,
-            
-            # 3-phase apparent power (2 registers)
-            int(data['apparent_power'] * 100) >> 16,
-            int(data['apparent_power'] * 100) & 0xFFFF,
-            
-            # Sign of active power (1 register)
-            data['sign_active'],
-            
-            # Sign of reactive power (1 register)
-            data['sign_reactive'],
-            
-            # Chained voltage L1-L2 (2 registers)
-            int(data['chained_voltage_l1l2'] * 1000) >> 16,
-            int(data['chained_voltage_l1l2'] * 1000) & 0xFFFF,
-            
-            # Block 3 - Frequency (1 register)
-            int(min(100, max(0, data['frequency'])) * 10),  # Limit frequency to valid range (0-100 Hz)
-            
-            # Block 4 - Consumed energy (2 registers)
-            int(data['consumed_energy']) >> 16,
-            int(data['consumed_energy']) & 0xFFFF,
-            
-            # Block 5 - Delivered energy (2 registers)
-            int(data['delivered_energy']) >> 16,
-            int(data['delivered_energy']) & 0xFFFF,
-            
-            # Block 6 - Power factor (2 registers)
-            int(data['power_factor'] * 100),
-            data['sector_power_factor'],
-            
-            # Block 7 - CT ratio (1 register)
-            data['ct_ratio'],
-            
-            # Add Operating Hours (1 register)
-            int(data['operating_hours'])
-        ]
-        
-        # Add all registers to binary data
-        for reg in registers:
-            binary_data.extend(struct.pack('>H', reg & 0xFFFF))
-        
-        # Add aggregated values (19 values, 4 bytes each) - simplified for multi-logger
+        # Same frame as main.py (powerlog_codec.py), without the trailer
+        # Aggregated values (19 values) - simplified for multi-logger
         aggregated_values = [
             0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1  # sample_count = 1
         ]
-        
-        for value in aggregated_values:
-            binary_data.extend(struct.pack('>I', value & 0xffffffff))
+        binary_data = powerlog_codec.encode(int(time.time()), data, aggregated_values)
         
         # Publish to logger-specific topic
         topic = f"ET/powerlogger/data"
@@ -455,11 +347,19 @@ def logger_monitor_thread(slaveid):
     
     # Track if initialization has been performed for this logger
     initialization_done = False
+    breaker = logger_breakers.get(slaveid)
     
     while True:
         try:
-            # Check if logger is connected
+            if breaker.acquire() == OPEN:
+                # Backing off: wait for the next probe slot
+                time.sleep(max(0.1, breaker.retry_in()))
+                continue
+
+            # Check if logger is connected (single serial register read, which
+            # is also the breaker's probe)
             if emdx_check_connection(slaveid):
+                breaker.success()
                 if not logger_status.get(slaveid, {}).get('connected', False):
                     # Logger just came online
                     with logger_lock:
@@ -498,6 +398,7 @@ def logger_monitor_thread(slaveid):
                     print(f"Failed to read data from logger {slaveid}")
                     
             else:
+                breaker.failure()
                 # Logger is offline
                 if logger_status.get(slaveid, {}).get('connected', False):
                     # Logger just went offline
@@ -507,15 +408,14 @@ def logger_monitor_thread(slaveid):
                     # Reset initialization flag when logger goes offline
                     initialization_done = False
                 
-                print(f"Logger {slaveid} is offline, retrying in {RECONNECT_DELAY} seconds...")
-                time.sleep(RECONNECT_DELAY)
+                print(f"Logger {slaveid} is offline, retrying in {breaker.retry_in():.0f} seconds...")
                 continue
                 
         except Exception as e:
             print(f"Error in logger {slaveid} monitor thread: {e}")
             with logger_lock:
                 logger_status[slaveid] = {'connected': False, 'last_seen': time.time()}
-            time.sleep(RECONNECT_DELAY)
+            breaker.failure()
             continue
         
         # Wait before next check
@@ -533,7 +433,8 @@ def status_monitor_thread():
                 offline_loggers = []
                 for slaveid in LOGGER_ADDRESSES:
                     if not logger_status.get(slaveid, {}).get('connected', False):
-                        offline_loggers.append(str(slaveid))
+                        b = logger_breakers.get(slaveid).snapshot()
+                        offline_loggers.append(f"{slaveid} ({b['state']}, opened {b['opened']}x)")
                 
                 logMQTT(client, topicLog, f"Status: {connected_count}/{total_count} loggers online. Offline: {', '.join(offline_loggers)}")
             else:
@@ -0,0 +1,145 @@
+"""Drift-free periodic scheduling for the threaded runtime, with rate reporting.
+
+The loops used to do `job(); time.sleep(interval)`, so the real period was
+interval + job time: the voltage/current poll meant for 5 Hz ran at
+1 / (0.2 s + read time), and powerLoop slipped by the duration of every
+publish. run_periodic() sleeps until absolute deadlines on the monotonic
+clock instead - start + k * interval - so job time no longer accumulates.
+
+A job that overruns is not made up for with a burst of back-to-back runs:
+whole periods it overran are counted as missed and skipped, and the
+schedule stays on its original grid. The interval may be a callable so a rate
+changed at runtime (config topic) applies from the next deadline on.
+
+With align=True the deadlines are the wall-clock multiples of the interval
+instead (:00, :10, :20, ... for 10 s), so windows closed by the job line up
+across routers; a run that overran a boundary waits for the next one.
+
+RateStats keeps what the modemlog reports: requested vs. achieved rate,
+missed deadlines, how late the runs started and how long the job takes.
+run_periodic() is the threaded loop; aio_runtime.periodic() uses the same
+advance() rule and feeds the same stats in the asyncio runtime.
+"""
+
+import math
+import threading
+import time
+
+
+class RateStats:
+    """Requested vs. achieved rate of one periodic job."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._requested = 0.0       # Hz, at the last run
+        self._runs = 0              # since the last snapshot
+        self._window_start = time.monotonic()
+        self._missed = 0            # cumulative
+        self._late_max = 0.0        # since the last snapshot
+        self._job_avg = None        # EWMA of the job duration (s)
+
+    def ran(self, interval, late, duration):
+        with self._lock:
+            self._requested = 1.0 / interval if interval > 0 else 0.0
+            self._runs += 1
+            self._late_max = max(self._late_max, late)
+            if self._job_avg is None:
+                self._job_avg = duration
+            else:
+                self._job_avg += 0.1 * (duration - self._job_avg)
+
+    def missed(self, n):
+        with self._lock:
+            self._missed += n
+
+    def job_time(self):
+        """Smoothed job duration in seconds (None before the first run)."""
+        with self._lock:
+            return self._job_avg
+
+    def snapshot(self):
+        """{reqHz, hz, missed, lateMaxMs, jobAvgMs}; hz and lateMaxMs since the previous snapshot."""
+        now = time.monotonic()
+        with self._lock:
+            window = now - self._window_start
+            out = {
+                "reqHz": round(self._requested, 3),
+                "hz": round(self._runs / window, 3) if window > 0 else 0,
+                "missed": self._missed,
+                "lateMaxMs": round(self._late_max * 1000, 1),
+                "jobAvgMs": round(self._job_avg * 1000, 1) if self._job_avg is not None else 0,
+            }
+            self._runs = 0
+            self._late_max = 0.0
+            self._window_start = now
+            return out
+
+
+def advance(deadline, interval, now, stats=None):
+    """The deadline after `deadline`, skipping (and counting) periods already over.
+
+    If the job overran so far that whole periods lie behind `now`, those are
+    missed: they are counted in stats and the schedule jumps to the last
+    deadline not yet a full period old, which then runs at once.
+    """
+    deadline += interval
+    if now - deadline >= interval:
+        skipped = int((now - deadline) / interval)
+        deadline += skipped * interval
+        if stats is not None:
+            stats.missed(skipped)
+    return deadline
+
+
+def aligned_deadline(interval, now, last=None, stats=None, wall=None):
+    """(monotonic deadline, wall time) of the next wall-clock multiple of interval.
+
+    `now` is the current monotonic time, `wall` the current wall time
+    (time.time() if None). With the previous boundary in `last`, boundaries
+    passed in between are counted as missed. The result is always after
+    `last`: a run woken just before its boundary (asyncio timers fire up
+    to clock_resolution early, NTP slews or steps the wall clock back)
+    would otherwise get that same boundary again and close a second,
+    near-empty window with the same labels.
+    """
+    if wall is None:
+        wall = time.time()
+    boundary = (math.floor(wall / interval) + 1) * interval
+    if last is not None and boundary <= last:
+        boundary = last + interval
+    elif last is not None and stats is not None:
+        skipped = int(round((boundary - last) / interval)) - 1
+        if skipped > 0:
+            stats.missed(skipped)
+    return now + (boundary - wall), boundary
+
+
+def run_periodic(interval, job, name, stats=None, running=None, align=False):
+    """Call job() at absolute deadlines, forever or while running() is true.
+
+    The threaded twin of aio_runtime.periodic: interval may be a number or a
+    callable returning one; exceptions are printed and never end the loop.
+    align=True runs on wall-clock boundaries (see the module docstring).
+    """
+    deadline = time.monotonic()
+    boundary = None
+    if align:
+        deadline, boundary = aligned_deadline(interval() if callable(interval) else interval, deadline)
+        time.sleep(max(0.0, deadline - time.monotonic()))
+    while running is None or running():
+        started = time.monotonic()
+        try:
+            job()
+        except Exception as e:
+            print(f"Error in {name} job: {e}")
+        now = time.monotonic()
+        period = interval() if callable(interval) else interval
+        if stats is not None:
+            stats.ran(period, started - deadline, now - started)
+        if align:
+            deadline, boundary = aligned_deadline(period, now, boundary, stats)
+        else:
+            deadline = advance(deadline, period, now, stats)
+        if deadline > now:
+            time.sleep(deadline - now)
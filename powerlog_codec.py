@@ -0,0 +1,379 @@
+"""The powerlog binary frame: one precompiled layout, encoder and decoder.
+
+main.py and multi_emdx_logger.py each built the frame by hand - a list of
+35 register words, one struct.pack('>H') per word, 19 struct.pack('>I')
+for the aggregates - and the two copies had to be kept in step. Both now
+encode through this module:
+
+    timestamp        uint32
+    device serial    uint32
+    V L1-L3, I L1-L3, I N            7 x uint32 x1000
+    P, Q, S                          3 x uint32 x100
+    sign P, sign Q                   2 x uint16
+    V L1-L2                          uint32 x1000
+    frequency                        uint16 x10 (clamped to 0-100 Hz)
+    consumed, delivered energy       2 x uint32
+    power factor                     uint16 x100
+    sector PF, CT ratio, op. hours   3 x uint16
+    aggregates                       19 x uint32 (V/I min/max/avg x1000, count)
+
+That is exactly what the word lists produced: a value split into a high
+and a low register word is the same four bytes as the value packed as one
+uint32 (benchmarks/bench_powerlog_codec.py checks this byte for byte
+against the old code). Values are wrapped to their field width as before.
+
+main.py frames continue with the window start/end (2 x uint32), the
+optional tagged sections and the router serial (uint64) as the last eight
+bytes; multi_emdx_logger frames end after the aggregates.
+
+PowerlogEncoder packs everything with pack_into into one preallocated
+buffer; encode() uses one encoder per thread. decode() is the inverse,
+sections included.
+
+powerlog_v2.py is the compact delta/varint format a device can be
+switched to; this v1 frame stays the default.
+
+pack_batch()/unpack_batch() wrap many finished frames into one batch
+message for the backlog drain (see pack_batch for the envelope).
+"""
+
+import struct
+import threading
+import zlib
+
+from quantities import QUANTITY_IDS
+from powerlog_zdict import DICTIONARIES, DEFAULT_ZDICT
+
+FRAME = struct.Struct(">II7I3I2HIH2I4H19I")
+# Same layout with the fields that can be negative read back signed
+FRAME_SIGNED = struct.Struct(">II7i3i2HiH2I4H18iI")
+WINDOW = struct.Struct(">II")
+ROUTER_SERIAL = struct.Struct(">Q")
+AGGREGATES = 19
+
+SECTION_WINDOW_STATS = 0x01
+SECTION_QUANTITIES = 0x02
+QUANTITIES_VERSION = 1
+SECTION_ENERGY = 0x03
+ENERGY_VERSION = 1
+# Channels of the window statistics section (V L1-L3, I L1-L3)
+WINDOW_STATS_CHANNELS = 6
+
+_HEADER_WINDOW_STATS = struct.Struct(">BBB")
+_HEADER_QUANTITIES = struct.Struct(">BBIB")
+_ENERGY = struct.Struct(">BBBIQQ")
+_U32 = struct.Struct(">I")
+_U16 = struct.Struct(">H")
+
+BATCH_VERSION = 1
+BATCH_LENGTHS = 0x01             # flags bit 0: every record carries its own length
+BATCH_ZLIB = 0x02                # flags bit 1: the body is a zlib stream
+BATCH_COLUMNS = 0x04             # flags bit 2: equal-size records stored byte column by column
+_BATCH_HEADER = struct.Struct(">BBH")
+BATCH_MAX_RECORDS = 0xFFFF
+
+M16 = 0xFFFF
+M32 = 0xFFFFFFFF
+M64 = 0xFFFFFFFFFFFFFFFF
+
+# Measurement keys in frame order, with the scaling of each (decode divides)
+FIELDS = (
+    ("device_serial", 1),
+    ("voltage_l1", 1000), ("voltage_l2", 1000), ("voltage_l3", 1000),
+    ("current_l1", 1000), ("current_l2", 1000), ("current_l3", 1000), ("current_n", 1000),
+    ("active_power", 100), ("reactive_power", 100), ("apparent_power", 100),
+    ("sign_active", 1), ("sign_reactive", 1),
+    ("chained_voltage_l1l2", 1000),
+    ("frequency", 10),
+    ("consumed_energy", 1), ("delivered_energy", 1),
+    ("power_factor", 100),
+    ("sector_power_factor", 1), ("ct_ratio", 1), ("operating_hours", 1),
+)
+
+
+def _words(m):
+    return (
+        m["device_serial"] & M32,
+        int(m["voltage_l1"] * 1000) & M32,
+        int(m["voltage_l2"] * 1000) & M32,
+        int(m["voltage_l3"] * 1000) & M32,
+        int(m["current_l1"] * 1000) & M32,
+        int(m["current_l2"] * 1000) & M32,
+        int(m["current_l3"] * 1000) & M32,
+        int(m["current_n"] * 1000) & M32,
+        int(m["active_power"] * 100) & M32,
+        int(m["reactive_power"] * 100) & M32,
+        int(m["apparent_power"] * 100) & M32,
+        m["sign_active"] & M16,
+        m["sign_reactive"] & M16,
+        int(m["chained_voltage_l1l2"] * 1000) & M32,
+        int(min(100, max(0, m["frequency"])) * 10) & M16,  # Limit frequency to valid range (0-100 Hz)
+        int(m["consumed_energy"]) & M32,
+        int(m["delivered_energy"]) & M32,
+        int(m["power_factor"] * 100) & M16,
+        m["sector_power_factor"] & M16,
+        m["ct_ratio"] & M16,
+        int(m["operating_hours"]) & M16,
+    )
+
+
+class PowerlogEncoder:
+    """Encodes frames into one reused buffer; not shared between threads."""
+
+    def __init__(self, size=512):
+        self._buf = bytearray(size)
+
+    def encode(self, timestamp, measurement, aggregates, window=None, sections=(), router_serial=None):
+        """The frame as bytes.
+
+        measurement: mapping with the FIELDS keys; aggregates: 19 ints;
+        window: (start, end) or None; sections: packed tagged sections;
+        router_serial: int, or None for a frame without one.
+        """
+        size = FRAME.size
+        if window is not None:
+            size += WINDOW.size
+        size += sum(len(section) for section in sections)
+        if router_serial is not None:
+            size += ROUTER_SERIAL.size
+        buf = self._buf
+        if len(buf) < size:
+            buf = self._buf = bytearray(size * 2)
+        FRAME.pack_into(buf, 0, timestamp & M32, *_words(measurement), *[a & M32 for a in aggregates])
+        offset = FRAME.size
+        if window is not None:
+            WINDOW.pack_into(buf, offset, window[0] & M32, window[1] & M32)
+            offset += WINDOW.size
+        for section in sections:
+            buf[offset:offset + len(section)] = section
+            offset += len(section)
+        if router_serial is not None:
+            ROUTER_SERIAL.pack_into(buf, offset, router_serial & M64)
+            offset += ROUTER_SERIAL.size
+        # bytes(): immutable snapshot, safe to hold in queues
+        return bytes(memoryview(buf)[:offset])
+
+
+_local = threading.local()
+
+
+def encode(timestamp, measurement, aggregates, window=None, sections=(), router_serial=None):
+    """PowerlogEncoder.encode with this thread's encoder."""
+    encoder = getattr(_local, "encoder", None)
+    if encoder is None:
+        encoder = _local.encoder = PowerlogEncoder()
+    return encoder.encode(timestamp, measurement, aggregates, window, sections, router_serial)
+
+
+def pack_window_stats(config, extended):
+    """The window statistics section.
+
+        tag        uint8   SECTION_WINDOW_STATS
+        flags      uint8   bit 0: standard deviation present
+        k          uint8   number of percentiles
+        points     k x uint8, the percentiles (1-99)
+        per channel (V L1-L3, I L1-L3):
+            std    uint32 x1000 (only with flag bit 0)
+            values k x uint32 x1000
+    """
+    variance, percentiles = config
+    section = bytearray(_HEADER_WINDOW_STATS.pack(SECTION_WINDOW_STATS, 1 if variance else 0, len(percentiles)))
+    section.extend(bytes(percentiles))
+    for std, quantiles in extended:
+        values = ([std] if variance else []) + quantiles
+        for value in values:
+            section.extend(_U32.pack(int(value * 1000) & M32))
+    return section
+
+
+def pack_quantity_aggregates(count, channels, stats):
+    """The aggregated quantities section.
+
+        tag        uint8   SECTION_QUANTITIES
+        version    uint8   QUANTITIES_VERSION
+        count      uint32  samples in the window
+        n          uint8   number of quantities
+        ids        n x uint8, quantities.QUANTITY_IDS
+        per quantity, in id order above: min, max, avg, uint32 x1000 each
+    """
+    section = bytearray(_HEADER_QUANTITIES.pack(SECTION_QUANTITIES, QUANTITIES_VERSION, count, len(channels)))
+    section.extend(bytes(QUANTITY_IDS[name] for name in channels))
+    for triple in stats:
+        for value in triple:
+            section.extend(_U32.pack(int(value * 1000) & M32))
+    return section
+
+
+def pack_energy_deltas(flags, since, deltas):
+    """The interval energy section.
+
+        tag        uint8   SECTION_ENERGY
+        version    uint8   ENERGY_VERSION
+        flags      uint8   energy.BASELINE / CT_CHANGED / WRAPPED / RESET
+        since      uint32  time of the previous reading (0 if none); the
+                           interval runs from there to the window end
+        consumed   uint64  x1000, in the unit of the absolute counter
+        delivered  uint64  x1000
+
+    64 bits so a delta across a long outage cannot overflow.
+    """
+    return _ENERGY.pack(SECTION_ENERGY, ENERGY_VERSION, flags, int(since or 0),
+                        max(0, int(round(deltas["consumed"] * 1000))),
+                        max(0, int(round(deltas["delivered"] * 1000))))
+
+
+def parse_sections(data):
+    """[(tag, {fields}), ...] of the tagged sections in `data`."""
+    sections = []
+    names = {v: k for k, v in QUANTITY_IDS.items()}
+    offset = 0
+    while offset < len(data):
+        tag = data[offset]
+        if tag == SECTION_WINDOW_STATS:
+            _, flags, k = _HEADER_WINDOW_STATS.unpack_from(data, offset)
+            offset += _HEADER_WINDOW_STATS.size
+            points = list(data[offset:offset + k])
+            offset += k
+            per_channel = (flags & 1) + k
+            channels = []
+            for _ in range(WINDOW_STATS_CHANNELS):
+                values = struct.unpack_from(f">{per_channel}i", data, offset)
+                offset += 4 * per_channel
+                channels.append([v / 1000 for v in values])
+            sections.append((tag, {"std": bool(flags & 1), "percentiles": points, "channels": channels}))
+        elif tag == SECTION_QUANTITIES:
+            _, version, count, n = _HEADER_QUANTITIES.unpack_from(data, offset)
+            offset += _HEADER_QUANTITIES.size
+            ids = list(data[offset:offset + n])
+            offset += n
+            values = struct.unpack_from(f">{3 * n}i", data, offset)
+            offset += 12 * n
+            sections.append((tag, {
+                "version": version,
+                "count": count,
+                "values": {names.get(qid, qid): [v / 1000 for v in values[3 * i:3 * i + 3]]
+                           for i, qid in enumerate(ids)},
+            }))
+        elif tag == SECTION_ENERGY:
+            _, version, flags, since, consumed, delivered = _ENERGY.unpack_from(data, offset)
+            offset += _ENERGY.size
+            sections.append((tag, {"version": version, "flags": flags, "since": since,
+                                   "consumed": consumed / 1000, "delivered": delivered / 1000}))
+        else:
+            raise ValueError(f"unknown powerlog section tag 0x{tag:02x} at offset {offset}")
+    return sections
+
+
+def decode(payload):
+    """A frame back into a dict: timestamp, the FIELDS (scaled back), aggregates, trailer.
+
+    Fields that can be negative are read signed. A frame longer than the
+    fixed part has the main.py trailer: window_start/window_end, sections
+    and router_serial (a frame with only the 8-byte serial after the fixed
+    part predates the window times).
+    """
+    values = FRAME_SIGNED.unpack_from(payload, 0)
+    record = {"timestamp": values[0]}
+    for (name, scale), value in zip(FIELDS, values[1:1 + len(FIELDS)]):
+        record[name] = value / scale if scale != 1 else value
+    aggregates = values[1 + len(FIELDS):]
+    record["aggregates"] = [v / 1000 for v in aggregates[:-1]] + [aggregates[-1]]
+    rest = payload[FRAME.size:]
+    if len(rest) >= ROUTER_SERIAL.size:
+        record["router_serial"] = ROUTER_SERIAL.unpack_from(rest, len(rest) - ROUTER_SERIAL.size)[0]
+    if len(rest) >= WINDOW.size + ROUTER_SERIAL.size:
+        record["window_start"], record["window_end"] = WINDOW.unpack_from(rest, 0)
+        record["sections"] = parse_sections(rest[WINDOW.size:len(rest) - ROUTER_SERIAL.size])
+    return record
+
+
+def pack_batch(records, level=None, zdict=DEFAULT_ZDICT):
+    """Many frames as one batch message.
+
+        version    uint8   BATCH_VERSION
+        flags      uint8   BATCH_LENGTHS / BATCH_ZLIB / BATCH_COLUMNS
+        count      uint16  number of records
+        with BATCH_ZLIB:
+            zdict  uint8   preset dictionary id (powerlog_zdict.py), 0: none
+            the rest is the zlib stream of the body below
+        body without BATCH_LENGTHS:
+            size   uint16  length of every record
+            count records of that size, back to back - or with
+            BATCH_COLUMNS, byte 0 of every record, then byte 1, ...
+        body with BATCH_LENGTHS:
+            count x (length uint16, record)
+
+    The records are complete frames, exactly as they would have been
+    published one by one. The fixed-size form is used when all records are
+    the same length, which saves two bytes per record.
+
+    level: None sends the body as is, 0-9 compresses it at that zlib level.
+    Equal-size records are then stored column by column: consecutive
+    records differ in a few low-order bytes, and the unchanged ones line up
+    into long runs (about 30 % of the raw size instead of 50 %). That layout
+    matches no dictionary, so it goes without one; variable-length batches
+    (sections, v2 records) use `zdict`.
+    """
+    if not records or len(records) > BATCH_MAX_RECORDS:
+        raise ValueError(f"a batch holds 1-{BATCH_MAX_RECORDS} records, not {len(records)}")
+    size = len(records[0])
+    if all(len(record) == size for record in records):
+        flags = 0
+        data = b"".join(records)
+        if level is not None and len(records) > 1:
+            flags = BATCH_COLUMNS
+            data = b"".join([data[i::size] for i in range(size)])
+        body = [_U16.pack(size), data]
+    else:
+        flags = BATCH_LENGTHS
+        body = []
+        for record in records:
+            body.append(_U16.pack(len(record)))
+            body.append(record)
+    if level is None:
+        return b"".join([_BATCH_HEADER.pack(BATCH_VERSION, flags, len(records))] + body)
+    if flags & BATCH_COLUMNS:
+        zdict = 0
+    if zdict:
+        compressor = zlib.compressobj(level, zdict=DICTIONARIES[zdict])
+    else:
+        compressor = zlib.compressobj(level)
+    stream = compressor.compress(b"".join(body)) + compressor.flush()
+    return b"".join([_BATCH_HEADER.pack(BATCH_VERSION, flags | BATCH_ZLIB, len(records)),
+                     bytes((zdict,)), stream])
+
+
+def unpack_batch(payload):
+    """The frames of a batch message, in order."""
+    version, flags, count = _BATCH_HEADER.unpack_from(payload, 0)
+    if version != BATCH_VERSION:
+        raise ValueError(f"unsupported powerlog batch version {version}")
+    offset = _BATCH_HEADER.size
+    if flags & BATCH_ZLIB:
+        zdict = payload[offset]
+        if zdict and zdict not in DICTIONARIES:
+            raise ValueError(f"unknown powerlog batch dictionary {zdict}")
+        decompressor = zlib.decompressobj(zdict=DICTIONARIES[zdict]) if zdict else zlib.decompressobj()
+        payload = decompressor.decompress(payload[offset + 1:]) + decompressor.flush()
+        offset = 0
+    records = []
+    if flags & BATCH_LENGTHS:
+        for _ in range(count):
+            (length,) = _U16.unpack_from(payload, offset)
+            offset += _U16.size
+            records.append(bytes(payload[offset:offset + length]))
+            offset += length
+    else:
+        (size,) = _U16.unpack_from(payload, offset)
+        offset += _U16.size
+        data = payload[offset:offset + size * count]
+        offset += size * count
+        if flags & BATCH_COLUMNS:
+            rows = bytearray(size * count)
+            for i in range(size):
+                rows[i::size] = data[i * count:(i + 1) * count]
+            data = rows
+        records = [bytes(data[i:i + size]) for i in range(0, size * count, size)]
+    if offset != len(payload):
+        raise ValueError(f"powerlog batch of {len(payload)} bytes does not match its header ({offset})")
+    return records
@@ -0,0 +1,215 @@
+"""Powerlog payload format v2: versioned header, zig-zag varint deltas.
+
+The v1 frame (powerlog_codec.py) spends a fixed 16 or 32-bit slot on every
+field, although two consecutive records of a meter differ by a few mV, mA
+and Wh, and it truncates the energy counters to 32 bits. A v2 record is
+either a keyframe, carrying every value, or a delta record, carrying each
+value as the difference to the previous record of the same meter. Either
+way each value is a zig-zag varint: small magnitudes, positive or negative,
+take one or two bytes. Values are quantized exactly as in v1 (same field
+scaling, frequency clamped to 0-100 Hz) but never wrapped, so energy
+counters go through at full width (up to 64 bits).
+
+    version    uint8   FORMAT_VERSION (2)
+    flags      uint8   bit 0 (KEYFRAME): values are absolute
+    stream     uint8   random id of the encoder instance
+    meter      varint  device serial
+    seq        varint  record number within the stream
+    values     VALUES.__len__() zig-zag varints, in VALUES order: absolute
+               in a keyframe, minus the previous record's in a delta record
+    sections   the v1 tagged sections, verbatim, up to the end of the record
+
+A v1 frame starts with its uint32 timestamp, whose first byte is 0x65 or
+more for any time after 2023, so the first byte tells the formats apart.
+
+A delta record decodes only on top of record seq - 1 of the same meter and
+stream. Records can arrive out of order - the retry queue re-sends at the
+back - so the decoder holds a delta until its base has arrived. A keyframe
+every `keyframe` records (and at every encoder start, which also picks a
+new stream id) bounds what a lost record takes with it: the retry queue
+drops its oldest entries on overflow, and nothing after that gap decodes
+until the next keyframe.
+
+PowerlogV2Encoder and PowerlogV2Decoder are the reference implementation;
+benchmarks/bench_powerlog_v2.py checks the round trip and compares sizes.
+"""
+
+import os
+from collections import OrderedDict
+
+from powerlog_codec import FIELDS, FRAME_SIGNED, WINDOW, ROUTER_SERIAL, AGGREGATES, parse_sections
+
+FORMAT_VERSION = 2
+KEYFRAME = 0x01
+DEFAULT_KEYFRAME = 30            # records between keyframes (5 min at 10 s)
+
+# Every value of a record, in order; the device serial is in the header
+VALUES = (("timestamp", 1),) + FIELDS[1:] + tuple((f"aggregate_{i}", 1) for i in range(AGGREGATES)) + (
+    ("window_start", 1), ("window_end", 1), ("router_serial", 1))
+_MEASURED = FIELDS[1:]
+_FREQUENCY = [name for name, _ in _MEASURED].index("frequency")
+
+M64 = 0xFFFFFFFFFFFFFFFF
+
+
+def put_varint(out, value):
+    """Append unsigned `value` to bytearray `out` as a varint (7 bits per byte)."""
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def get_varint(data, offset):
+    """(value, new offset) of the varint at `offset`."""
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def quantize(timestamp, measurement, aggregates, window, router_serial):
+    """The integer values of a record, VALUES order, as v1 scales them but unwrapped."""
+    values = [timestamp]
+    for name, scale in _MEASURED:
+        values.append(int(measurement[name] * scale))
+    values[1 + _FREQUENCY] = int(min(100, max(0, measurement["frequency"])) * 10)
+    values.extend(int(a) for a in aggregates)
+    values.extend((window[0], window[1], router_serial & M64))
+    return values
+
+
+def values_from_frame(frame):
+    """(meter, values, sections) of a v1 main.py frame, for re-encoding recorded data.
+
+    The v1 frame has already wrapped its fields, so energy counters above
+    32 bits come out truncated as they went in.
+    """
+    fields = FRAME_SIGNED.unpack_from(frame, 0)
+    rest = frame[FRAME_SIGNED.size:]
+    window = WINDOW.unpack_from(rest, 0)
+    (router_serial,) = ROUTER_SERIAL.unpack_from(rest, len(rest) - ROUTER_SERIAL.size)
+    values = [fields[0]] + list(fields[2:]) + list(window) + [router_serial]
+    return fields[1], values, bytes(rest[WINDOW.size:len(rest) - ROUTER_SERIAL.size])
+
+
+class PowerlogV2Encoder:
+    """Encodes the records of one or more meters; not shared between threads."""
+
+    def __init__(self, keyframe=DEFAULT_KEYFRAME, stream=None):
+        self.keyframe = max(1, int(keyframe))
+        self.stream = os.urandom(1)[0] if stream is None else stream & 0xFF
+        self._state = {}                 # meter -> (seq, values, records since keyframe)
+
+    def encode(self, timestamp, measurement, aggregates, window, sections=(), router_serial=0):
+        """A v2 record as bytes; same arguments as powerlog_codec.encode."""
+        values = quantize(timestamp, measurement, aggregates, window, router_serial)
+        return self.encode_values(measurement["device_serial"], values, b"".join(sections))
+
+    def encode_values(self, meter, values, sections=b""):
+        """A v2 record of already quantized VALUES."""
+        state = self._state.get(meter)
+        if state is None or state[2] + 1 >= self.keyframe:
+            seq = 0 if state is None else state[0] + 1
+            flags, since, deltas = KEYFRAME, 0, values
+        else:
+            seq, previous, since = state[0] + 1, state[1], state[2] + 1
+            flags, deltas = 0, [v - p for v, p in zip(values, previous)]
+        self._state[meter] = (seq, values, since)
+        out = bytearray((FORMAT_VERSION, flags, self.stream))
+        put_varint(out, meter)
+        put_varint(out, seq)
+        for value in deltas:
+            put_varint(out, zigzag(value))
+        out.extend(sections)
+        return bytes(out)
+
+    def reset(self):
+        """Start every meter over with a keyframe."""
+        self._state.clear()
+
+
+def parse(payload):
+    """The raw parts of a v2 record: {flags, stream, meter, seq, values, sections}.
+
+    values are absolute for a keyframe and deltas otherwise.
+    """
+    if payload[0] != FORMAT_VERSION:
+        raise ValueError(f"not a v{FORMAT_VERSION} powerlog record (version byte {payload[0]})")
+    flags, stream = payload[1], payload[2]
+    meter, offset = get_varint(payload, 3)
+    seq, offset = get_varint(payload, offset)
+    values = []
+    for _ in VALUES:
+        value, offset = get_varint(payload, offset)
+        values.append(unzigzag(value))
+    return {"flags": flags, "stream": stream, "meter": meter, "seq": seq,
+            "values": values, "sections": bytes(payload[offset:])}
+
+
+def to_record(meter, values, sections):
+    """Values of a record as the dict powerlog_codec.decode gives for a v1 frame."""
+    record = {"timestamp": values[0], "device_serial": meter}
+    for (name, scale), value in zip(_MEASURED, values[1:]):
+        record[name] = value / scale if scale != 1 else value
+    aggregates = values[len(FIELDS):len(FIELDS) + AGGREGATES]
+    record["aggregates"] = [v / 1000 for v in aggregates[:-1]] + [aggregates[-1]]
+    record["window_start"], record["window_end"], record["router_serial"] = values[-3:]
+    record["sections"] = parse_sections(sections)
+    return record
+
+
+class PowerlogV2Decoder:
+    """Decodes v2 records, holding deltas back until their base has arrived.
+
+    history: decoded records kept per meter and stream, so a duplicate or a
+    late delta still finds its base; pending: undecodable deltas held per
+    meter and stream (the oldest are dropped beyond that).
+    """
+
+    def __init__(self, history=64, pending=1000):
+        self.history = history
+        self.pending = pending
+        self._decoded = {}               # (meter, stream) -> OrderedDict seq -> values
+        self._held = {}                  # (meter, stream) -> {seq: parsed record}
+
+    def feed(self, payload):
+        """Decoded records (dicts, with "seq" and "keyframe") this payload makes available."""
+        part = parse(payload)
+        key = (part["meter"], part["stream"])
+        decoded = self._decoded.setdefault(key, OrderedDict())
+        held = self._held.setdefault(key, {})
+        out = []
+        while part is not None:
+            seq = part["seq"]
+            if part["flags"] & KEYFRAME:
+                values = part["values"]
+            elif seq - 1 in decoded:
+                values = [v + d for v, d in zip(decoded[seq - 1], part["values"])]
+            else:
+                held[seq] = part
+                if len(held) > self.pending:
+                    del held[min(held)]
+                break
+            decoded[seq] = values
+            decoded.move_to_end(seq)
+            if len(decoded) > self.history:
+                decoded.popitem(last=False)
+            record = to_record(part["meter"], values, part["sections"])
+            record["seq"] = seq
+            record["keyframe"] = bool(part["flags"] & KEYFRAME)
+            out.append(record)
+            part = held.pop(seq + 1, None)
+        return out
@@ -0,0 +1,83 @@
+"""Preset zlib dictionaries for compressed powerlog batches.
+
+deflate can only refer back to bytes it has already seen, so the first
+records of a batch compress poorly: there is nothing yet to match their
+fixed layout, zero high bytes and section headers against. A preset
+dictionary is that history, given up front to both compressor and
+decompressor. It is part of the wire format: a compressed batch names
+its dictionary by id, the backend must hold the same bytes, and a
+published dictionary is never changed - a better one gets a new id.
+
+train() builds one from sample records: recent samples of each record
+shape (v1 frame with and without sections, v2 keyframe and delta
+record) in proportion to how common it is, the most common shape last,
+where deflate finds matches cheapest. Dictionary 1 was trained on simulated records
+(benchmarks/bench_batch_compression.py --train rebuilds it from recorded
+frames).
+"""
+
+from collections import Counter
+
+ZDICT_SIZE = 1024
+
+DICTIONARIES = {
+    1: bytes.fromhex(
+        "020101cdd78e09a243a885aad50cf08e1cd68a1cc0921c96f705eeda05b8e705de36b833"
+        "a40abc340000a2d930e807f2daa801a413c40102a0069e8901d0881c90951cf08e1cb684"
+        "1cf6901cd68a1ca08c1ce0981cc0921cf6f005b6fd0596f705ced4058ee105eeda0598e1"
+        "05d8ed05b8e705649485aad50ca885aad50ce4bff1bccece050301006555414a00000000"
+        "0001653b0000000000000000020001cdd78e09bb431416569503b927269e21ec0a130313"
+        "00002400ba010000000000161616565656950395039503b927b927b9272626269e219e21"
+        "9e2100141400030100655542440000000000016c360000000000000000020001cdd78e09"
+        "bc43148101eb01bc0209ef048731ce319d011fa1010000df0101b6010000000000810181"
+        "018101eb01eb01eb01bc02bc02bc02090909ef04ef04ef04873187318731001414000301"
+        "006555424e00000000000163970000000000000000020001cdd78e09bd43145adf04cc01"
+        "cc1f9a06fc22fb36d4012ada0100009c0100bc0100000000005a5a5adf04df04df04cc01"
+        "cc01cc01cc1fcc1fcc1f9a069a069a06fc22fc22fc220014140003010065554258000000"
+        "0000016f1e0000000000000000020001cdd78e09be43149a01da01c801ad279f0cc212f8"
+        "295d116100008a0200ba0100000000009a019a019a01da01da01da01c801c801c801ad27"
+        "ad27ad279f0c9f0c9f0cc212c212c212001414000301006555426200000000000169fc00"
+        "00000000000000020001cdd78e09bf4314c10205788c1fb41ab929bb282e08300000ad04"
+        "00ba010000000000c102c102c1020505057878788c1f8c1f8c1fb41ab41ab41ab929b929"
+        "b929001414000301006555426c0000000000016c7c00000000000000006555426c0123ab"
+        "cd000382f700038042000381d60000ba3d0000b9da0000c2f500000ddf00000d08000002"
+        "9b00000d4a000000000006150201f3001520f1000004d2006200010190224f0003816700"
+        "038487000382f700037eb2000381d2000380420003804600038366000381d60000b8ad00"
+        "00bbcd0000ba3d0000b84a0000bb6a0000b9da0000c1650000c4850000c2f50000003265"
+        "5542626555426c0301006555426200000000000169fc000000000000000000000b3a73ce"
+        "2ff2655542760123abcd000382560003803f000382120000c2030000c0740000b8980000"
+        "03c100000d1f0000029f00000d6200000000000613eb01f30015214e000004d200620001"
+        "0190224f000380c6000383e60003825600037eaf000381cf0003803f00038082000383a2"
+        "000382120000c0730000c3930000c2030000bee40000c2040000c0740000b7080000ba28"
+        "0000b898000000326555426c655542760301006555426c0000000000016c7c0000000000"
+        "00000000000b3a73ce2ff2"
+    ),
+}
+DEFAULT_ZDICT = 1
+
+
+def train(samples, size=ZDICT_SIZE):
+    """A preset dictionary of at most `size` bytes from sample records.
+
+    Each record shape gets a share of `size` by how often it occurs, filled
+    with its latest samples; the most common shape goes last.
+    """
+    shapes = Counter()
+    examples = {}
+    for record in samples:
+        # Shape: a v1 frame by its length (which sections it has), a v2
+        # record by keyframe flag - its length varies with the values
+        shape = ("v2", record[1]) if record[0] == 2 else ("v1", len(record))
+        shapes[shape] += 1
+        examples.setdefault(shape, []).append(record)
+    total = sum(shapes.values())
+    parts = []
+    for shape, count in reversed(shapes.most_common()):
+        budget = max(len(examples[shape][-1]), size * count // total)
+        chosen = []
+        for record in reversed(examples[shape]):
+            if sum(map(len, chosen)) + len(record) > budget:
+                break
+            chosen.insert(0, record)
+        parts.extend(chosen)
+    return b"".join(parts)[-size:]
@@ -0,0 +1,103 @@
+"""Measured quantities the poller can aggregate besides V L1-L3 and I L1-L3.
+
+The powerlog window used to cover only the phase voltages and currents;
+power, power factor, frequency and neutral current went out as the one
+instantaneous sample taken at publish time, so a 10 s power peak between
+two publishes was simply never seen. Each quantity here names the register
+blocks it is decoded from (regmap block names) and how, per device type.
+The poller reads the union of the blocks of the configured quantities -
+regmap's planner merges them into the fewest contiguous reads - and folds
+the decoded values into a second aggregation window.
+
+Decode functions get the raw blocks and, for the float maps, a view that
+decodes each block as a whole once (regdecode.py), however many
+quantities read from it.
+
+QUANTITY_IDS are the numbers the extended payload uses to say which
+quantity a min/max/avg triple belongs to; they are part of the wire format
+and must never be renumbered - new quantities get new numbers.
+"""
+
+from regdecode import decoder_for
+
+QUANTITY_IDS = {
+    "current_n": 1,
+    "active_power": 2,
+    "reactive_power": 3,
+    "apparent_power": 4,
+    "power_factor": 5,
+    "frequency": 6,
+}
+
+
+class FloatBlocks(dict):
+    """{block name: [its IEEE floats]}, each block decoded on first use."""
+
+    def __init__(self, blocks):
+        super().__init__()
+        self.blocks = blocks
+
+    def __missing__(self, name):
+        block = self.blocks[name]
+        values = self[name] = decoder_for(len(block)).decode(block)
+        return values
+
+
+def _u32(block, offset):
+    return (block[offset] << 16 | block[offset + 1]) / 1000.0
+
+
+def _emdx_power(offset):
+    # Same scaling as the publish decode: below a CT ratio of 5000 the meter
+    # reports power in units of 10 W
+    def decode(blocks, floats):
+        value = _u32(blocks["power"], offset)
+        return value * 0.01 if blocks["ct_ratio"][0] < 5000 else value
+    return decode
+
+
+def _rmu_power_factor(blocks, floats):
+    active = floats["power"][0] / 1000
+    apparent = floats["power"][4] / 1000
+    return active / apparent / 10 if apparent else 0
+
+
+# {name: (blocks needed, decode(blocks, floats) -> float)}; units as in the
+# payload. RMU float indices are register offsets / 2.
+EMDX_QUANTITIES = {
+    "current_n": (("voltage_current",), lambda b, f: _u32(b["voltage_current"], 12)),
+    "active_power": (("power", "ct_ratio"), _emdx_power(0)),
+    "reactive_power": (("power", "ct_ratio"), _emdx_power(2)),
+    "apparent_power": (("power", "ct_ratio"), _emdx_power(4)),
+    "power_factor": (("power_factor",), lambda b, f: b["power_factor"][0] / 1000.0),
+    "frequency": (("frequency",), lambda b, f: b["frequency"][0] / 10.0),
+}
+
+RMU_QUANTITIES = {
+    "current_n": (("current",), lambda b, f: f["current"][3]),
+    "active_power": (("power",), lambda b, f: f["power"][0] / 1000),
+    "apparent_power": (("power",), lambda b, f: f["power"][4] / 1000),
+    "reactive_power": (("power",), lambda b, f: f["power"][8] / 1000),
+    "power_factor": (("power",), _rmu_power_factor),
+    "frequency": (("frequency",), lambda b, f: f["frequency"][0]),
+}
+
+
+def check_names(names):
+    """Validate a configured list of quantity names; returns it as a tuple."""
+    names = tuple(names)
+    unknown = [n for n in names if n not in QUANTITY_IDS]
+    if unknown:
+        raise ValueError(f"unknown quantities: {', '.join(unknown)}")
+    return names
+
+
+def blocks_for(table, names):
+    """Register blocks (sorted names) needed to decode `names` from `table`."""
+    return sorted({block for n in names if n in table for block in table[n][0]})
+
+
+def decode(table, names, blocks):
+    """Values of `names` in order; quantities the device lacks read as 0."""
+    floats = FloatBlocks(blocks)
+    return tuple(table[n][1](blocks, floats) if n in table else 0.0 for n in names)
@@ -0,0 +1,68 @@
+"""Timestamped register snapshot cache shared by the RTU jobs.
+
+The 2 Hz voltage/current poller reads EMDX 0x1000/14 every ~200 ms, and
+publishPowerlog used to read the very same block again a moment later just
+to take its own sample. Every successful read can be stored here, keyed by
+(slave, start, count), with a monotonic timestamp and a TTL of its own; a
+later read of the same registers - or of any range inside a cached block -
+is served from memory while the entry is still fresh.
+
+The same cache holds the long-lived "configuration class" blocks (serial
+number, CT ratio) with a TTL of an hour; invalidate() drops them whenever
+they might have changed (reconnect, read error, provisioning write).
+
+Hit/miss counters are kept so the bus saving is visible in the modemlog.
+"""
+
+import threading
+import time
+
+
+class RegisterCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}          # (slave, start, count) -> (stamp, ttl, registers)
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, slave, address, registers, ttl):
+        """Store a successful read for ttl seconds."""
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[(slave, address, len(registers))] = (time.monotonic(), ttl, list(registers))
+
+    def get(self, slave, address, count):
+        """Return the registers [address, address+count) from a fresh entry, or None.
+
+        Any cached block that fully contains the requested range will do, so
+        the poller's 0x1000/14 read also serves a request for 0x1006/6.
+        Expired entries found on the way are dropped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for key, (stamp, ttl, registers) in list(self._entries.items()):
+                entry_slave, start, entry_count = key
+                if now - stamp > ttl:
+                    del self._entries[key]
+                    continue
+                if entry_slave == slave and start <= address and address + count <= start + entry_count:
+                    self.hits += 1
+                    offset = address - start
+                    return registers[offset:offset + count]
+            self.misses += 1
+            return None
+
+    def invalidate(self, slave=None):
+        """Drop all entries, or only those of one slave."""
+        with self._lock:
+            if slave is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == slave]:
+                    del self._entries[key]
+
+    def stats(self):
+        """Return (hits, misses) - cumulative, like modbus_error_count."""
+        with self._lock:
+            return self.hits, self.misses
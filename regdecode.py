@@ -0,0 +1,95 @@
+"""Whole-block decoding of Modbus register blocks.
+
+The RMU decode turned each IEEE float out of its two registers with
+struct.unpack('>f', struct.pack('>HH', hi, lo)) - two struct calls, a
+bytes object and a tuple per value, some fifteen times per publish and
+six times per poll. BlockDecoder decodes a whole block in one go: the
+registers are packed into bytes with one precompiled struct.Struct and
+unpacked as all of its 32-bit values with another, so all 43 floats of
+the 86-register RMU block cost what the 13 decoded one by one did.
+Divisors (scale factors) are applied to the whole vector afterwards.
+
+If NumPy is installed, BlockDecoder(..., numpy=True) uses
+frombuffer('>f4' / '>u4' / '>i4') and a vector division instead; the
+router image usually has no NumPy, hence struct by default.
+benchmarks/bench_regdecode.py compares the three.
+
+Divisors divide, rather than multiply by a reciprocal, so the results are
+bit-identical to the per-value `/ 1000.0` decode they replace.
+"""
+
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# struct format character and NumPy dtype per 32-bit value kind
+KINDS = {
+    "f": ("f", ">f4"),      # IEEE 754 float, high word first
+    "I": ("I", ">u4"),      # unsigned 32-bit, high word first
+    "i": ("i", ">i4"),      # signed 32-bit, high word first
+}
+
+
+class BlockDecoder:
+    """Decode `words` registers as words // 2 32-bit values of one kind.
+
+    divisors: None, one number for every value, or one per value (None or 1
+    leaves that value alone).
+    """
+
+    def __init__(self, words, kind="f", divisors=None, numpy=False):
+        if words % 2:
+            raise ValueError(f"{words} registers do not hold whole 32-bit values")
+        fmt, dtype = KINDS[kind]
+        self.words = words
+        self.count = words // 2
+        self._registers = struct.Struct(f">{words}H")
+        self._values = struct.Struct(f">{self.count}{fmt}")
+        if isinstance(divisors, (list, tuple)):
+            if len(divisors) != self.count:
+                raise ValueError(f"{len(divisors)} divisors for {self.count} values")
+            divisors = [d if d else 1 for d in divisors]
+        self.divisors = divisors
+        self._numpy = None
+        if numpy:
+            self._enable_numpy(dtype)
+
+    def _enable_numpy(self, dtype):
+        if numpy is None:
+            print("NumPy not available, BlockDecoder falls back to struct")
+            return
+        divisors = self.divisors
+        if isinstance(divisors, list):
+            divisors = numpy.array(divisors, dtype=float)
+        self._numpy = (numpy.dtype(dtype), divisors)
+
+    def decode(self, registers):
+        """All values of the block, divided by the divisors, as a list of floats/ints."""
+        raw = self._registers.pack(*registers[:self.words])
+        if self._numpy is not None:
+            dtype, divisors = self._numpy
+            values = numpy.frombuffer(raw, dtype=dtype)
+            if divisors is not None:
+                values = values / divisors
+            return values.tolist()
+        values = self._values.unpack(raw)
+        divisors = self.divisors
+        if divisors is None:
+            return list(values)
+        if isinstance(divisors, list):
+            return [v / d if d != 1 else v for v, d in zip(values, divisors)]
+        return [v / divisors for v in values]
+
+
+_decoders = {}
+
+
+def decoder_for(words, kind="f"):
+    """A shared undivided BlockDecoder for blocks of `words` registers."""
+    decoder = _decoders.get((words, kind))
+    if decoder is None:
+        decoder = _decoders[(words, kind)] = BlockDecoder(words, kind)
+    return decoder
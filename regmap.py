@@ -0,0 +1,255 @@
+"""Declarative register maps and a read planner for the RS485 meters.
+
+At 19200 baud every Modbus request costs a full request/response turnaround
+plus the 3.5-character inter-frame silence on both sides, no matter how few
+registers it carries. The old publishPowerlog issued nine separate reads for
+one EMDX, most of them for one or two registers sitting right next to each
+other. The register map below describes WHAT we need per device type; the
+planner decides HOW to fetch it: nearby blocks are merged into one contiguous
+read as long as the hole between them is at most max_gap registers and the
+merged read stays within the device's max_count per request. The decode code
+then gets each named block back as a plain list of words, sliced out of the
+merged read, exactly as if it had been read on its own.
+"""
+
+# Modbus spec limit for function 0x03 (read holding registers).
+MODBUS_MAX_READ = 125
+
+
+class Read:
+    """One planned read_holding_registers call covering one or more blocks."""
+
+    __slots__ = ("address", "count", "members")
+
+    def __init__(self, address, count, members):
+        self.address = address
+        self.count = count
+        self.members = members      # [(name, address, count), ...]
+
+    def split(self, registers):
+        """Slice the merged register list back into {name: [words]}."""
+        blocks = {}
+        for name, address, count in self.members:
+            offset = address - self.address
+            blocks[name] = registers[offset:offset + count]
+        return blocks
+
+    def __repr__(self):
+        names = ",".join(m[0] for m in self.members)
+        return f"Read(0x{self.address:04x}, count={self.count}, [{names}])"
+
+
+class RegisterMap:
+    """Named register blocks of one device type plus its read limits.
+
+    blocks:    {name: (address, count)}
+    max_count: most registers the device answers in one request
+    max_gap:   largest hole (in registers) the planner may read over to merge
+               two blocks. Reading a hole costs 2 bytes per register on the
+               wire (~1 ms per register at 19200 baud), a separate request
+               costs ~10 ms of framing and turnaround - so small gaps are
+               always worth swallowing. Set to 0 to only merge touching or
+               overlapping blocks, or -1 to disable merging entirely.
+    optional:  blocks whose read failure must not fail the whole plan
+               (e.g. EMDX operating hours, which some firmwares lack)
+    static:    "configuration class" blocks (serial number, CT ratio) that
+               practically never change. read_blocks keeps them in the cache
+               for static_ttl seconds; the cache is invalidated on reconnect,
+               read errors and provisioning writes, so the long TTL is only
+               the lazy safety refresh.
+    """
+
+    def __init__(self, name, blocks, max_count=MODBUS_MAX_READ, max_gap=8, optional=(),
+                 static=(), static_ttl=3600):
+        self.name = name
+        self.blocks = dict(blocks)
+        self.max_count = min(max_count, MODBUS_MAX_READ)
+        self.max_gap = max_gap
+        self.optional = frozenset(optional)
+        self.static = frozenset(static)
+        self.static_ttl = static_ttl
+
+    def plan(self, names=None, max_gap=None):
+        """Return the list of Read objects that fetch the given blocks.
+
+        Blocks are sorted by address and greedily merged into the running
+        read while the gap and the max_count limit allow it. Overlapping
+        blocks (EMDX 0x1014/10 already contains the consumed energy words at
+        0x101C) simply collapse into one read. Optional blocks are never
+        merged with required ones: a device that rejects the optional
+        register must not take the required data down with it. Static blocks
+        are planned on their own too, so a cached read only ever holds
+        registers of one class.
+        """
+        if names is None:
+            names = list(self.blocks)
+        if max_gap is None:
+            max_gap = self.max_gap
+        groups = {}
+        for n in names:
+            address, count = self.blocks[n]
+            groups.setdefault((n in self.optional, n in self.static), []).append((address, count, n))
+        reads = []
+        for key in sorted(groups):
+            reads.extend(self._merge(sorted(groups[key]), max_gap))
+        return reads
+
+    def describe(self, address, count):
+        """Name the blocks a read of [address, address+count) covers, for stats.
+
+        Blocks inside another covered block are left out (RMU "main" rather
+        than "main+voltage+current"); a range matching no block is shown
+        as address/count.
+        """
+        end = address + count
+        inside = [(n, a, a + c) for n, (a, c) in self.blocks.items() if address <= a and a + c <= end]
+        names = [n for n, a, e in inside
+                 if not any(o != n and oa <= a and e <= oe and (oa, oe) != (a, e) for o, oa, oe in inside)]
+        return "+".join(sorted(names, key=lambda n: self.blocks[n])) or f"{address}/{count}"
+
+    def _merge(self, entries, max_gap):
+        reads = []
+        current = None
+        for address, count, name in entries:
+            end = address + count
+            if current is not None:
+                current_end = current.address + current.count
+                if address - current_end <= max_gap and max(end, current_end) - current.address <= self.max_count:
+                    current.count = max(end, current_end) - current.address
+                    current.members.append((name, address, count))
+                    continue
+            current = Read(address, count, [(name, address, count)])
+            reads.append(current)
+        return reads
+
+
+def read_blocks(read_fn, regmap, names, slave, cache=None, store_ttl=0, lookup=True, cached=None):
+    """Execute the plan for `names` on `slave` through read_fn.
+
+    read_fn has the read_holding_registers(address, count=, slave=) signature
+    (main.mb_read, or a bare client's read_holding_registers). Returns
+    (blocks, error): blocks is {name: [words]} for everything that was read,
+    error is None or the failed response of a required read - in which case
+    the caller should give up on this cycle, just like the old per-block
+    error branches did.
+
+    With a RegisterCache, blocks that are still fresh in the cache are taken
+    from there (lookup=True) and only the rest is planned and read; their
+    names are added to the `cached` set if one is passed. store_ttl > 0 puts
+    every successful read into the cache for that many seconds; reads of
+    static blocks are always cached, for the map's static_ttl.
+
+    Some meters answer a read that spans undefined registers with exception
+    code 2 (illegal data address). If a merged read fails that way, its
+    members are retried one by one once, so a too-generous max_gap degrades
+    to the old per-block behaviour instead of breaking the publish.
+    """
+    steps = _block_reads(regmap, names, slave, cache, store_ttl, lookup, cached)
+    try:
+        address, count = next(steps)
+        while True:
+            address, count = steps.send(read_fn(address, count=count, slave=slave))
+    except StopIteration as done:
+        return done.value
+
+
+async def read_blocks_async(read_fn, regmap, names, slave, cache=None, store_ttl=0, lookup=True, cached=None):
+    """read_blocks for the asyncio runtime: read_fn is a coroutine function."""
+    steps = _block_reads(regmap, names, slave, cache, store_ttl, lookup, cached)
+    try:
+        address, count = next(steps)
+        while True:
+            address, count = steps.send(await read_fn(address, count=count, slave=slave))
+    except StopIteration as done:
+        return done.value
+
+
+def _block_reads(regmap, names, slave, cache, store_ttl, lookup, cached):
+    """Generator behind read_blocks/read_blocks_async.
+
+    Yields (address, count) for every bus read it needs and expects the
+    response to be sent back in; returns (blocks, error). Keeping the
+    cache, planning and fallback logic here means the threaded and the
+    asyncio runtime share it instead of keeping two copies in step.
+    """
+    if names is None:
+        names = list(regmap.blocks)
+    blocks = {}
+    if cache is not None and lookup:
+        for name in names:
+            address, count = regmap.blocks[name]
+            registers = cache.get(slave, address, count)
+            if registers is not None:
+                blocks[name] = registers
+                if cached is not None:
+                    cached.add(name)
+        names = [n for n in names if n not in blocks]
+
+    def store(address, registers, members):
+        if cache is None:
+            return
+        if all(m[0] in regmap.static for m in members):
+            cache.put(slave, address, registers, regmap.static_ttl)
+        elif store_ttl > 0:
+            cache.put(slave, address, registers, store_ttl)
+
+    for read in regmap.plan(names):
+        result = yield read.address, read.count
+        if not result.isError():
+            store(read.address, result.registers, read.members)
+            blocks.update(read.split(result.registers))
+            continue
+        if len(read.members) > 1 and getattr(result, "exception_code", None) == 2:
+            for member in read.members:
+                name, address, count = member
+                single = yield address, count
+                if not single.isError():
+                    store(address, single.registers, [member])
+                    blocks[name] = single.registers
+                elif name not in regmap.optional:
+                    return blocks, single
+            continue
+        if any(m[0] not in regmap.optional for m in read.members):
+            return blocks, result
+    return blocks, None
+
+
+# --- Device maps -----------------------------------------------------------
+# Addresses and counts are exactly the ones publishPowerlog used to read one by
+# one; the decode code indexes into each block the same way as before.
+
+EMDX_REGISTERS = RegisterMap(
+    "EMDX",
+    {
+        "voltage_current": (0x1000, 14),   # V L1-L3, I L1-L3, I N (u32, /1000)
+        "power":           (0x1014, 10),   # P, Q, S, signs, V L1-L2
+        "consumed_energy": (0x101C, 2),
+        "delivered_energy": (0x1020, 2),
+        "power_factor":    (0x1024, 2),    # PF, sector
+        "frequency":       (0x1026, 1),
+        "operating_hours": (0x106E, 1),
+        "ct_ratio":        (0x1200, 1),
+        "serial":          (0x2213, 1),
+    },
+    max_count=125,
+    max_gap=8,
+    optional=("operating_hours",),
+    static=("serial", "ct_ratio"),
+)
+
+RMU_REGISTERS = RegisterMap(
+    "RMU",
+    {
+        "main":            (19000, 86),    # IEEE floats, 19000-19085
+        "voltage":         (19000, 6),     # V L1-L3 (poll subset of "main")
+        "current":         (19012, 8),     # I L1-L3, I N (poll subset of "main")
+        "power":           (19026, 18),    # P, S, Q (poll subset of "main")
+        "frequency":       (19050, 2),     # (poll subset of "main")
+        "operating_hours": (394, 2),
+        "ct_ratio":        (600, 2),       # primary, secondary
+        "serial":          (911, 2),
+    },
+    max_count=125,
+    max_gap=8,
+    static=("serial", "ct_ratio"),
+)
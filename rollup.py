@@ -0,0 +1,58 @@
+"""Multi-resolution rollups (10 s / 1 min / 15 min) from one sample stream.
+
+Dashboards want 10 s values for a live view, billing wants 15 min history,
+and until now the database downsampled the one powerlog resolution into
+the others. Rollups keeps all of them on the device, incrementally: every
+poll sample goes into one base window (10 s); at each base boundary that
+window is merged into the coarser tiers (aggregator.WindowAggregator.merge:
+min of minima, max of maxima, sums added - exact for min/max/avg) and each
+tier whose own wall-clock boundary it is closes as well. A sample is
+folded once, whatever the number of tiers.
+
+Windows are aligned to wall-clock multiples of their length, like the
+powerlog window; the first one of each tier starts when Rollups is created
+and is partial.
+"""
+
+import time
+
+from aggregator import WindowAggregator
+
+
+class Rollups:
+    """A base window plus coarser tiers; callers serialise add() and close()."""
+
+    def __init__(self, channels, base=10, tiers=(60, 900)):
+        for seconds in tiers:
+            if seconds % base:
+                raise ValueError(f"rollup of {seconds}s is not a multiple of the {base}s base")
+        self.channels = tuple(channels)
+        self.base = base
+        self._base = WindowAggregator(self.channels)
+        self._tiers = {seconds: WindowAggregator(self.channels) for seconds in tiers}
+        opened = time.time()
+        self._opened = dict.fromkeys((base,) + tuple(tiers), opened)
+
+    def add(self, values):
+        self._base.add(values)
+
+    def close(self, boundary):
+        """Close the base window at wall time `boundary`, and every tier due then.
+
+        Returns [(seconds, Window, start, end), ...], base first. Hand the
+        windows back to recycle() once they are published.
+        """
+        boundary = int(round(boundary))
+        window = self._base.swap()
+        closed = [(self.base, window, int(self._opened[self.base]), boundary)]
+        self._opened[self.base] = boundary
+        for seconds, tier in self._tiers.items():
+            tier.merge(window)
+            if boundary % seconds == 0:
+                closed.append((seconds, tier.swap(), int(self._opened[seconds]), boundary))
+                self._opened[seconds] = boundary
+        return closed
+
+    def recycle(self, closed):
+        for seconds, window, _, _ in closed:
+            (self._base if seconds == self.base else self._tiers[seconds]).recycle(window)
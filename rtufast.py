@@ -0,0 +1,244 @@
+"""Fast path for the fixed RTU reads (function 0x03) on the pymodbus serial port.
+
+The same handful of reads - EMDX slave 1 at 0x1000/14, RMU slave 49 at
+19000/86, ... - go out thousands of times a day, and every one of them
+builds a request PDU, runs the RTU framer, polls in_waiting until the line
+has been silent long enough, decodes into a response PDU and copies the
+registers out. On the router's CPU that machinery costs more than the
+frame itself.
+
+FixedRead precomputes everything that does not change between calls: the
+8 request bytes including their CRC, the expected response header and
+length (5 + 2*count), and a struct.Struct for the register words.
+RtuFastPath.read_holding_registers() writes that frame on the serial port
+pymodbus already owns, reads exactly the expected number of bytes from
+pyserial, checks the CRC with a 256-entry lookup table and unpacks the
+words - no per-call PDU or framer objects. The port's timeout (set per request by
+bustiming.AdaptiveTimeouts) bounds the read.
+
+Only plain 0x03 reads go this way; writes, and anything the fast path does
+not understand, stay on pymodbus. Enabled with RTU_FAST_PATH in main.py;
+benchmarks/bench_rtu_fastpath.py compares the CPU time per transaction of
+both paths.
+
+ExactLengthSerialClient brings the same exact-length framing to everything
+that does go through pymodbus (see its docstring);
+benchmarks/bench_rtu_framing.py measures the wall time it saves.
+"""
+
+import struct
+import time
+
+from pymodbus.client.serial import ModbusSerialClient
+from pymodbus.exceptions import ModbusIOException
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(data):
+    """Modbus CRC-16 (poly 0xA001, init 0xFFFF), table driven."""
+    crc = 0xFFFF
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def with_crc(frame):
+    """Append the CRC, low byte first as on the wire."""
+    return frame + struct.pack("<H", crc16(frame))
+
+
+def classify_response(frame, expected):
+    """(error class, exception code) of a raw response frame.
+
+    error class is None for a good frame, else one of busstats.ERROR_CLASSES:
+    "timeout" (nothing came back), "short", "crc" or "exception".
+    """
+    if not frame:
+        return "timeout", None
+    if len(frame) == 5 and frame[1] & 0x80:
+        if crc16(frame) != 0:
+            return "crc", None
+        return "exception", frame[2]
+    if len(frame) < expected:
+        return "short", None
+    if crc16(frame) != 0:
+        return "crc", None
+    return None, None
+
+
+class FastResponse:
+    """The part of the pymodbus response interface read_blocks and mb_read use."""
+
+    __slots__ = ("registers", "exception_code")
+
+    def __init__(self, registers=None, exception_code=None):
+        self.registers = registers
+        self.exception_code = exception_code
+
+    def isError(self):
+        return self.exception_code is not None
+
+
+class FixedRead:
+    """One precomputed read_holding_registers(address, count, slave) transaction."""
+
+    __slots__ = ("slave", "address", "count", "request", "header", "length", "words")
+
+    def __init__(self, slave, address, count):
+        self.slave = slave
+        self.address = address
+        self.count = count
+        self.request = with_crc(struct.pack(">BBHH", slave, 0x03, address, count))
+        self.header = bytes((slave, 0x03, 2 * count))
+        self.length = 5 + 2 * count
+        self.words = struct.Struct(f">{count}H")
+
+
+class RtuFastPath:
+    """Executes FixedReads on the serial port of a connected ModbusSerialClient.
+
+    The caller must hold the bus (bus_scheduler / the RTU BusOwner), exactly
+    as for any other call on the client. Reads are retried up to
+    client.retries times on silence or a corrupt frame, like pymodbus does.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._reads = {}
+        self._last_frame_end = 0.0
+        # Called as frame_hook(tx bytes, rx bytes, error class, exception code)
+        # after every attempt, e.g. busstats.BusStats.frame.
+        self.frame_hook = None
+
+    def fixed_read(self, slave, address, count):
+        key = (slave, address, count)
+        read = self._reads.get(key)
+        if read is None:
+            read = self._reads[key] = FixedRead(slave, address, count)
+        return read
+
+    def read_holding_registers(self, address, count=1, slave=1):
+        """Drop-in for client.read_holding_registers on the fast path."""
+        read = self.fixed_read(slave, address, count)
+        for _ in range(self.client.retries + 1):
+            response = self.execute(read)
+            if response is not None:
+                return response
+        raise ModbusIOException(f"No valid response from slave {slave} after {self.client.retries} retries")
+
+    def execute(self, read):
+        """One attempt: FastResponse, or None on silence / bad frame."""
+        port = self.client.socket
+        if port is None:
+            if not self.client.connect():
+                raise ModbusIOException("serial port not open")
+            port = self.client.socket
+        if port.inter_byte_timeout is not None:
+            # pymodbus opens the port with a 1.5 character inter-byte timeout;
+            # a USB adapter's latency timer easily exceeds that mid-frame, and
+            # we know how many bytes to wait for anyway.
+            port.inter_byte_timeout = None
+        if port.in_waiting:
+            # Late or stray bytes from a previous frame
+            port.reset_input_buffer()
+        # Inter-frame silence (3.5 characters) after the previous response
+        wait = self._last_frame_end + self.client.silent_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        port.write(read.request)
+        frame = port.read(5)
+        if len(frame) == 5 and frame[0] == read.slave and frame[1] != 0x83 and frame[:3] == read.header:
+            frame += port.read(read.length - 5)
+        self._last_frame_end = time.monotonic()
+        # The CRC over a frame including its own CRC is 0, which is what
+        # classify_response checks.
+        error, exception_code = classify_response(frame, read.length)
+        if error is None and frame[:3] != read.header:
+            error = "short"     # a valid frame, but not the answer to this request
+        if self.frame_hook is not None:
+            self.frame_hook(len(read.request), len(frame), error, exception_code)
+        if error == "exception" and frame[0] == read.slave:
+            return FastResponse(exception_code=exception_code)
+        if error is not None:
+            return None
+        return FastResponse(list(read.words.unpack_from(frame, 3)))
+
+
+def expected_response_length(request):
+    """Length of the normal response to an RTU request frame, or None if unknown.
+
+    A function code with the 0x80 bit set (exception) is always 5 bytes;
+    that case is detected from the first bytes of the response.
+    """
+    if len(request) < 8:
+        return None
+    fc = request[1]
+    if fc in (0x03, 0x04):
+        return 5 + 2 * int.from_bytes(request[4:6], "big")
+    if fc in (0x06, 0x10):
+        return 8
+    return None
+
+
+class ExactLengthSerialClient(ModbusSerialClient):
+    """ModbusSerialClient that ends a response on its known length, not on silence.
+
+    The stock sync client polls in_waiting every 4 character times and only
+    hands bytes to the framer once the count stopped growing for one poll:
+    every frame pays for a silence period after its last byte. For the
+    function codes we use the response length follows from the request, so
+    send() remembers it and recv() asks pyserial for exactly that many bytes
+    (5 first, to catch exception responses) and returns the moment the last
+    one is in. The port timeout bounds the wait; a short or unexpected frame
+    falls back to the stock silence-based recv for whatever else arrives.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._expected = None
+        self._request_len = 0
+        # Called as frame_hook(tx bytes, rx bytes, error class, exception code)
+        # for every response read on its expected length.
+        self.frame_hook = None
+
+    def connect(self):
+        if self.socket:
+            return True
+        if super().connect():
+            # The pymodbus 1.5 character inter-byte timeout would cut a frame
+            # at the first USB latency gap; the byte count ends reads now.
+            self.socket.inter_byte_timeout = None
+        return self.socket is not None
+
+    def send(self, request, addr=None):
+        self._expected = expected_response_length(request)
+        self._request_len = len(request)
+        return super().send(request, addr)
+
+    def recv(self, size):
+        expected, self._expected = self._expected, None
+        if size is not None or expected is None or not self.socket:
+            return super().recv(size)
+        data = self.socket.read(5)
+        if len(data) == 5 and not data[1] & 0x80:
+            data += self.socket.read(expected - 5)
+            if len(data) < expected:
+                data += super().recv(None)
+        self.last_frame_end = round(time.time(), 6)
+        if self.frame_hook is not None:
+            error, exception_code = classify_response(data, expected)
+            self.frame_hook(self._request_len, len(data), error, exception_code)
+        return data
@@ -0,0 +1,136 @@
+"""Constant-memory streaming estimators for the aggregation window.
+
+min/max/avg say nothing about how much a voltage or current moved inside a
+window: a steady 230 V and one flickering between 225 and 235 V can have the
+same three numbers. Shipping the raw samples over the cellular link is not
+an option, so the spread is estimated on the device:
+
+  - Welford: running mean and sum of squared deviations, numerically stable
+    (no sum-of-squares cancellation at 230 V +- a few mV)
+  - P2Quantile: the P-square algorithm (Jain & Chlamtac, 1985) - five
+    markers per quantile whose heights are nudged with a piecewise-parabolic
+    fit as samples arrive; no samples are kept
+
+Both use the same few slots whatever the sample rate or window length.
+ChannelEstimator bundles them for one channel; aggregator.WindowAggregator
+runs one per channel when the extended statistics are switched on.
+"""
+
+import math
+from bisect import insort
+
+
+class Welford:
+    __slots__ = ("n", "mean", "m2")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def variance(self):
+        """Population variance of the samples so far (0 below two samples)."""
+        return self.m2 / self.n if self.n > 1 else 0.0
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+
+class P2Quantile:
+    """Streaming estimate of the p-quantile (0 < p < 1) in five markers."""
+
+    __slots__ = ("p", "count", "q", "n", "want", "dn")
+
+    def __init__(self, p):
+        if not 0 < p < 1:
+            raise ValueError(f"quantile {p} outside (0, 1)")
+        self.p = p
+        self.reset()
+
+    def reset(self):
+        p = self.p
+        self.count = 0
+        self.q = []                                  # marker heights (the first five samples until then)
+        self.n = [0, 1, 2, 3, 4]                     # marker positions
+        self.want = [0, 2 * p, 4 * p, 2 + 2 * p, 4]  # desired positions
+        self.dn = [0, p / 2, p, (1 + p) / 2, 1]      # their increments per sample
+
+    def add(self, x):
+        q = self.q
+        self.count += 1
+        if self.count <= 5:
+            insort(q, x)
+            return
+        n = self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        want = self.want
+        for i in range(5):
+            want[i] += self.dn[i]
+        for i in (1, 2, 3):
+            d = want[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    # Parabola overshoots a neighbour: move linearly instead
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        """Current estimate; exact (nearest rank) up to five samples, 0 for none."""
+        if not self.count:
+            return 0.0
+        if self.count <= 5:
+            return self.q[min(self.count - 1, int(round(self.p * (self.count - 1))))]
+        return self.q[2]
+
+
+class ChannelEstimator:
+    """Optional standard deviation plus a set of quantiles for one channel."""
+
+    __slots__ = ("config", "welford", "quantiles")
+
+    def __init__(self, variance, percentiles):
+        self.config = (variance, percentiles)
+        self.welford = Welford() if variance else None
+        self.quantiles = [P2Quantile(pct / 100.0) for pct in percentiles]
+
+    def add(self, x):
+        if self.welford is not None:
+            self.welford.add(x)
+        for estimator in self.quantiles:
+            estimator.add(x)
+
+    def reset(self):
+        if self.welford is not None:
+            self.welford.reset()
+        for estimator in self.quantiles:
+            estimator.reset()
+
+    def result(self):
+        """(std or None, [quantile values in the configured order])"""
+        std = self.welford.std() if self.welford is not None else None
+        return std, [estimator.value() for estimator in self.quantiles]